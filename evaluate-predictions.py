@@ -1,37 +1,31 @@
 import argparse
-import dataclasses
+import contextvars
+import functools
+import glob
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import Callable, List, Dict, Set, Union, Optional
 
-from mdace.cleanup import trim_annotations, merge_adjacent_annotations
-from mdace.data import MDACEData, Admission
-from mdace.metrics import AllErrorRates
-from mdace.text import tokenize
+from mdace.breakdown import JsonlBreakdownWriter, open_breakdown_writer
+from mdace.data import MDACEData, Admission, LazyMDACEData, Span, process_pool
+from mdace.metrics import (
+    GROUP_BYS,
+    AllErrorRates,
+    GroupedErrorRates,
+    comparison_table,
+)
+from mdace.notestore import NoteTextStore
+from mdace.pipeline import STAGES, Pipeline, stage_names
+from mdace.profiling import profiling
+from mdace.resultcache import ResultCache, admission_keys, settings_digest
+from mdace.text import tokenize, TokenizationCache
+from mdace.tokenizers import TOKENIZERS, get_tokenizer, tokenizer_id
 
 logger = logging.getLogger(Path(__file__).name)
 
 
-def filter_admissions_by_id(dataset: MDACEData, hadm_ids: Set[int]) -> MDACEData:
-    return MDACEData(
-        admissions=[adm for adm in dataset.admissions if adm.hadm_id in hadm_ids]
-    )
-
-
-def filter_notes_by_category(
-    dataset: MDACEData, note_categories: Set[str]
-) -> MDACEData:
-    return MDACEData(
-        admissions=[
-            dataclasses.replace(
-                adm,
-                notes=[note for note in adm.notes if note.category in note_categories],
-            )
-            for adm in dataset.admissions
-        ]
-    )
-
-
 def load_hadm_ids(split_file: Path) -> Set[int]:
     hadm_ids = set()
     with open(split_file, "r") as ifp:
@@ -51,58 +45,475 @@ def load_grouped_predictions(
     target_categories: List[str],
     merge_adjacent: bool,
     trim_annos: bool,
-) -> Dict[int, Admission]:
-    """Load dataset, do optional preprocessing/filtering and group evidence annotations by note_id"""
-    dataset = MDACEData.from_dir(dataset_dir, require_text=True)
+    workers: int = 1,
+    streaming: bool = False,
+    note_store: Optional[Path] = None,
+    cache_dir: Optional[Path] = None,
+    stages: Optional[List[str]] = None,
+) -> Union[Dict[int, Admission], LazyMDACEData]:
+    """Load dataset, do optional preprocessing/filtering and group evidence annotations by note_id
+
+    With ``streaming`` a LazyMDACEData is returned instead; it supports the same
+    ``items()``/``get()`` calls but parses (and preprocesses) admissions on demand.
+
+    With ``note_store`` the JSON files may be text-free; note text is read from the
+    (memory-mapped) store when an admission is parsed.
+
+    With ``cache_dir`` (and without ``streaming``) the parsed directory is kept in a
+    columnar cache that is rebuilt whenever its JSON files change.
 
-    dataset = filter_admissions_by_id(dataset, hadm_ids)
+    Admissions are preprocessed by a Pipeline of ``stages`` (by default the stages of
+    ``merge_adjacent`` and ``trim_annos``), one admission at a time.
+    """
+    # filters are applied while loading so excluded admissions/notes are never kept
+    hadm_id_filter = hadm_ids.__contains__
+    category_filter = set(target_categories).__contains__ if target_categories else None
+    note_texts = NoteTextStore(note_store) if note_store else None
+    pipeline = Pipeline.from_names(
+        stages if stages is not None else stage_names(merge_adjacent, trim_annos),
+        name=str(dataset_dir),
+    )
+    if streaming:
+        dataset = LazyMDACEData(
+            dataset_dir,
+            require_text=True,
+            hadm_id_filter=hadm_id_filter,
+            category_filter=category_filter,
+            note_texts=note_texts,
+        )
+        # stats are logged once the dataset has been scored, see _log_pipeline_stats
+        return dataset.map_admissions(pipeline) if pipeline.stages else dataset
+    elif cache_dir:
+        # optional dependency (pyarrow)
+        from mdace.cache import from_dir_cached
 
-    if target_categories:
-        dataset = filter_notes_by_category(dataset, set(target_categories))
+        admissions = from_dir_cached(
+            dataset_dir,
+            cache_dir,
+            require_text=True,
+            hadm_id_filter=hadm_id_filter,
+            category_filter=category_filter,
+            workers=workers,
+            note_texts=note_texts,
+        ).admissions
+    else:
+        admissions = MDACEData.iter_dir(
+            dataset_dir,
+            require_text=True,
+            hadm_id_filter=hadm_id_filter,
+            category_filter=category_filter,
+            workers=workers,
+            note_texts=note_texts,
+        )
 
-    if merge_adjacent:
-        dataset = merge_adjacent_annotations(dataset)
+    return {adm.hadm_id: adm for adm in pipeline.run(admissions)}
 
-    if trim_annos:
-        dataset = trim_annotations(dataset)
 
-    return {adm.hadm_id: adm for adm in dataset.admissions}
+def _log_pipeline_stats(*datasets: Union[Dict[int, Admission], LazyMDACEData]):
+    """Log the preprocessing stats of streamed datasets"""
+    for dataset in datasets:
+        for transform in getattr(dataset, "transforms", ()):
+            if isinstance(transform, Pipeline):
+                transform.log_stats()
 
 
-def main(args: argparse.Namespace):
-    hadm_ids = load_hadm_ids(args.split_file)
-    target_categories = args.note_category
-
-    def _load_grouped_predictions(data_dir: Path):
-        return load_grouped_predictions(
-            dataset_dir=data_dir,
-            hadm_ids=hadm_ids,
-            target_categories=target_categories,
-            merge_adjacent=args.merge_adjacent,
-            trim_annos=args.trim_annotations,
+def make_error_rates(
+    columnar: bool = False,
+    gold_token_cache: Optional[TokenizationCache] = None,
+    group_bys: Optional[List[str]] = None,
+    top_k: int = 10,
+    keep_per_admission: bool = False,
+    tokenize_fn: Callable[[str], List[Span]] = tokenize,
+    overlap_metrics: bool = False,
+    iou_threshold: float = 0.5,
+) -> AllErrorRates:
+    """AllErrorRates, or with ``columnar`` a ColumnarErrorRates unless an option needs
+    AllErrorRates (ColumnarErrorRates only supports observe, error_rates and str)
+    """
+    if group_bys or keep_per_admission or overlap_metrics:
+        return AllErrorRates(
+            tokenize_fn=tokenize_fn,
+            gold_token_cache=gold_token_cache,
+            grouped=GroupedErrorRates(group_bys, top_k) if group_bys else None,
+            keep_per_admission=keep_per_admission,
+            overlap_metrics=overlap_metrics,
+            iou_threshold=iou_threshold,
         )
+    if columnar:
+        # optional dependency (numpy)
+        from mdace.columnar import ColumnarErrorRates
 
-    gold = _load_grouped_predictions(args.gold_dir)
-    predictions = _load_grouped_predictions(args.predictions_dir)
+        return ColumnarErrorRates(tokenize_fn, gold_token_cache)
+    return AllErrorRates(tokenize_fn=tokenize_fn, gold_token_cache=gold_token_cache)
 
-    error_rates = AllErrorRates(tokenize_fn=tokenize)
 
+def score_predictions(
+    gold: Union[Dict[int, Admission], LazyMDACEData],
+    predictions: Union[Dict[int, Admission], LazyMDACEData],
+    error_rates: AllErrorRates,
+    breakdown_writer: Optional[JsonlBreakdownWriter] = None,
+) -> AllErrorRates:
+    """Observe every gold admission; with ``breakdown_writer`` also stream its breakdown rows"""
     for hadm_id, actual_evidence in gold.items():
-        predicted_evidence = predictions.get(hadm_id, [])
-        if not predicted_evidence and actual_evidence:
+        predicted_evidence = predictions.get(hadm_id)
+        if predicted_evidence is None:
             logger.debug(
-                f"No evidence predicted for admission={hadm_id} [{len(actual_evidence):,} actual]"
+                f"No evidence predicted for admission={hadm_id} [{sum(1 for _ in actual_evidence):,} actual]"
+            )
+            predicted_evidence = Admission(hadm_id=hadm_id, notes=[])
+
+        if breakdown_writer is None:
+            error_rates.observe(actual_evidence, predicted_evidence)
+        else:
+            breakdown_writer.write(
+                error_rates.observe_breakdown(actual_evidence, predicted_evidence)
+            )
+
+    return error_rates
+
+
+# gold admissions shared by all runs scored in a (worker) process; see score_runs
+_BATCH_GOLD = None  # type: Optional[Dict[int, Admission]]
+_BATCH_GOLD_TOKEN_CACHE = None  # type: Optional[TokenizationCache]
+
+
+def _init_batch_worker(
+    gold: Dict[int, Admission], tokenize_fn: Callable[[str], List[Span]] = tokenize
+):
+    global _BATCH_GOLD, _BATCH_GOLD_TOKEN_CACHE
+    _BATCH_GOLD = gold
+    _BATCH_GOLD_TOKEN_CACHE = TokenizationCache(tokenize_fn)
+
+
+def _score_run(
+    predictions_dir: Path,
+    breakdown_out: Optional[Path],
+    load_kwargs: Dict,
+    error_rates_kwargs: Optional[Dict] = None,
+) -> AllErrorRates:
+    predictions = load_grouped_predictions(dataset_dir=predictions_dir, **load_kwargs)
+    error_rates = make_error_rates(
+        gold_token_cache=_BATCH_GOLD_TOKEN_CACHE, **(error_rates_kwargs or dict())
+    )
+    if breakdown_out:
+        with open_breakdown_writer(breakdown_out) as breakdown_writer:
+            score_predictions(_BATCH_GOLD, predictions, error_rates, breakdown_writer)
+    else:
+        score_predictions(_BATCH_GOLD, predictions, error_rates)
+    # do not ship the cache back to the parent process
+    error_rates.gold_token_cache = None
+    return error_rates
+
+
+def score_runs(
+    gold: Dict[int, Admission],
+    prediction_dirs: List[Path],
+    load_kwargs: Dict,
+    run_workers: int = 1,
+    error_rates_kwargs: Optional[Dict] = None,
+    breakdown_outs: Optional[List[Path]] = None,
+) -> List[AllErrorRates]:
+    """Score several prediction directories against the same, already loaded, gold
+
+    ``error_rates_kwargs`` are passed to make_error_rates for every run.
+    """
+    breakdown_outs = breakdown_outs or [None] * len(prediction_dirs)
+    tokenize_fn = (error_rates_kwargs or dict()).get("tokenize_fn", tokenize)
+    if run_workers > 1:
+        score_fn = functools.partial(
+            _score_run,
+            load_kwargs=dict(load_kwargs, workers=1),
+            error_rates_kwargs=error_rates_kwargs,
+        )
+        with process_pool(
+            run_workers,
+            initializer=_init_batch_worker,
+            initargs=(gold, tokenize_fn),
+        ) as pool:
+            return list(pool.map(score_fn, prediction_dirs, breakdown_outs))
+
+    _init_batch_worker(gold, tokenize_fn)
+    score_fn = functools.partial(
+        _score_run, load_kwargs=load_kwargs, error_rates_kwargs=error_rates_kwargs
+    )
+    return list(map(score_fn, prediction_dirs, breakdown_outs))
+
+
+def score_incremental(
+    gold_dir: Path,
+    predictions_dir: Path,
+    load_kwargs: Dict,
+    result_cache: ResultCache,
+    keep_per_admission: bool = False,
+    tokenize_fn: Callable[[str], List[Span]] = tokenize,
+    overlap_metrics: bool = False,
+    iou_threshold: float = 0.5,
+) -> AllErrorRates:
+    """Score like ``score_predictions`` but only (re)score admissions missing from ``result_cache``
+
+    Admissions whose gold and predicted files and settings are unchanged are summed
+    from the cache without being parsed.
+    """
+    settings = settings_digest(
+        target_categories=load_kwargs["target_categories"],
+        merge_adjacent=load_kwargs["merge_adjacent"],
+        trim_annos=load_kwargs["trim_annos"],
+        tokenizer=tokenizer_id(tokenize_fn),
+        note_store=load_kwargs.get("note_store"),
+        iou_threshold=iou_threshold if overlap_metrics else None,
+        stages=load_kwargs.get("stages"),
+    )
+    keys = admission_keys(gold_dir, predictions_dir, load_kwargs["hadm_ids"], settings)
+    error_rates = AllErrorRates(
+        tokenize_fn=tokenize_fn,
+        keep_per_admission=keep_per_admission,
+        overlap_metrics=overlap_metrics,
+        iou_threshold=iou_threshold,
+    )
+    if keys is None:
+        logger.warning(
+            f"Cannot read hadm_ids from all file names in {gold_dir}; not using the result cache"
+        )
+        gold = load_grouped_predictions(dataset_dir=gold_dir, **load_kwargs)
+        predictions = load_grouped_predictions(
+            dataset_dir=predictions_dir, **load_kwargs
+        )
+        return score_predictions(gold, predictions, error_rates)
+
+    results = result_cache.get_many(keys.values())
+    misses = {hadm_id for hadm_id, key in keys.items() if key not in results}
+    logger.info(
+        f"{predictions_dir}: {len(keys) - len(misses):,} cached, {len(misses):,} to score"
+    )
+
+    if misses:
+        miss_kwargs = dict(load_kwargs, hadm_ids=misses)
+        gold = load_grouped_predictions(dataset_dir=gold_dir, **miss_kwargs)
+        predictions = load_grouped_predictions(
+            dataset_dir=predictions_dir, **miss_kwargs
+        )
+        scored = dict()
+        for hadm_id, actual_evidence in gold.items():
+            predicted_evidence = predictions.get(hadm_id)
+            if predicted_evidence is None:
+                predicted_evidence = Admission(hadm_id=hadm_id, notes=[])
+            scored[keys[hadm_id]] = error_rates.score(
+                actual_evidence, predicted_evidence
+            )
+        result_cache.put_many(scored)
+        results.update(scored)
+
+    for hadm_id, key in keys.items():
+        if key in results:
+            error_rates.add(results[key], hadm_id)
+    return error_rates
+
+
+def find_prediction_dirs(
+    predictions_dirs: Optional[List[Path]], predictions_globs: Optional[List[str]]
+) -> List[Path]:
+    found = list(predictions_dirs or [])
+    for pattern in predictions_globs or []:
+        found.extend(sorted(Path(p) for p in glob.glob(pattern) if Path(p).is_dir()))
+    # de-duplicate, keep order
+    return list({d.absolute(): d for d in found}.values())
+
+
+def run_names(prediction_dirs: List[Path]) -> List[str]:
+    """Name runs by their path relative to the common parent of all runs"""
+    if len(prediction_dirs) == 1:
+        return [prediction_dirs[0].name]
+    absolute = [d.absolute() for d in prediction_dirs]
+    common = Path(os.path.commonpath(absolute))
+    return [d.relative_to(common).as_posix() for d in absolute]
+
+
+def _write_md(md_out: Path, content: str):
+    md_out.parent.mkdir(parents=True, exist_ok=True)
+    with open(md_out, "w", encoding="utf8") as ofp:
+        print(content, file=ofp)
+
+
+def error_rates_kwargs(args: argparse.Namespace) -> Dict:
+    return dict(
+        columnar=args.columnar,
+        group_bys=args.group_by,
+        top_k=args.top_k,
+        keep_per_admission=args.bootstrap > 0,
+        tokenize_fn=get_tokenizer(args.tokenizer, args.token_cache),
+        overlap_metrics=args.overlap_metrics,
+        iou_threshold=args.iou_threshold,
+    )
+
+
+def _results_md(args: argparse.Namespace, error_rates: AllErrorRates) -> str:
+    if not args.bootstrap:
+        return str(error_rates)
+
+    # optional dependency (numpy)
+    from mdace.bootstrap import bootstrap_report
+
+    report = bootstrap_report(error_rates, args.bootstrap, args.confidence, args.seed)
+    return f"{error_rates}\n{report}"
+
+
+def main(args: argparse.Namespace):
+    hadm_ids = load_hadm_ids(args.split_file)
+    prediction_dirs = find_prediction_dirs(args.predictions_dir, args.predictions_glob)
+    if not prediction_dirs:
+        raise ValueError("No prediction directories given or matched")
+
+    load_kwargs = dict(
+        hadm_ids=hadm_ids,
+        target_categories=args.note_category,
+        merge_adjacent=args.merge_adjacent,
+        trim_annos=args.trim_annotations,
+        workers=args.workers,
+        streaming=args.streaming,
+        note_store=args.note_store,
+        cache_dir=args.cache_dir,
+        stages=args.stages,
+    )
+
+    if args.result_cache:
+        main_incremental(args, prediction_dirs, load_kwargs)
+        return
+
+    if len(prediction_dirs) > 1:
+        main_batch(args, prediction_dirs, load_kwargs)
+        return
+
+    # load gold and predictions concurrently
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # each in a copy of the context, so their stages are profiled (--profile)
+        gold_future = pool.submit(
+            contextvars.copy_context().run,
+            load_grouped_predictions,
+            dataset_dir=args.gold_dir,
+            **load_kwargs,
+        )
+        predictions_future = pool.submit(
+            contextvars.copy_context().run,
+            load_grouped_predictions,
+            dataset_dir=prediction_dirs[0],
+            **load_kwargs,
+        )
+        gold = gold_future.result()
+        predictions = predictions_future.result()
+
+    # gold admissions are only reused when they are held in memory
+    kwargs = error_rates_kwargs(args)
+    error_rates = make_error_rates(
+        gold_token_cache=(
+            None if args.streaming else TokenizationCache(kwargs["tokenize_fn"])
+        ),
+        **kwargs,
+    )
+    if args.breakdown_out:
+        with open_breakdown_writer(args.breakdown_out) as breakdown_writer:
+            score_predictions(gold, predictions, error_rates, breakdown_writer)
+    else:
+        score_predictions(gold, predictions, error_rates)
+    _log_pipeline_stats(gold, predictions)
+
+    results_md = _results_md(args, error_rates)
+    logger.info(results_md)
+
+    md_out = args.md_out  # type: Path
+    if md_out:
+        _write_md(md_out, results_md)
+
+
+def main_batch(
+    args: argparse.Namespace, prediction_dirs: List[Path], load_kwargs: Dict
+):
+    """Load and preprocess gold once, then score every prediction directory against it"""
+    # gold is shared by all runs, so it is always held in memory
+    gold = load_grouped_predictions(
+        dataset_dir=args.gold_dir, **dict(load_kwargs, streaming=False)
+    )
+
+    names = run_names(prediction_dirs)
+    logger.info(
+        f"Scoring {len(prediction_dirs):,} runs against {len(gold):,} admissions"
+    )
+    breakdown_out = args.breakdown_out  # type: Optional[Path]
+    breakdown_outs = None
+    if breakdown_out:
+        breakdown_outs = [
+            breakdown_out.parent / name / breakdown_out.name for name in names
+        ]
+    results = score_runs(
+        gold,
+        prediction_dirs,
+        load_kwargs,
+        args.run_workers,
+        error_rates_kwargs(args),
+        breakdown_outs,
+    )
+    _report_batch(args, names, results)
+
+
+def main_incremental(
+    args: argparse.Namespace, prediction_dirs: List[Path], load_kwargs: Dict
+):
+    """Score every prediction directory, reusing per-admission results from --result-cache"""
+    if args.columnar:
+        logger.warning("--columnar is ignored with --result-cache")
+
+    with ResultCache(args.result_cache) as result_cache:
+        results = [
+            score_incremental(
+                args.gold_dir,
+                predictions_dir,
+                load_kwargs,
+                result_cache,
+                keep_per_admission=args.bootstrap > 0,
+                tokenize_fn=get_tokenizer(args.tokenizer, args.token_cache),
+                overlap_metrics=args.overlap_metrics,
+                iou_threshold=args.iou_threshold,
             )
+            for predictions_dir in prediction_dirs
+        ]
+
+    if len(prediction_dirs) == 1:
+        results_md = _results_md(args, results[0])
+        logger.info(results_md)
+        if args.md_out:
+            _write_md(args.md_out, results_md)
+        return
 
-        error_rates.observe(actual_evidence, predicted_evidence)
+    _report_batch(args, run_names(prediction_dirs), results)
 
-    logger.info(error_rates)
+
+def _report_batch(
+    args: argparse.Namespace, names: List[str], results: List[AllErrorRates]
+):
+    md_out_dir = args.md_out_dir  # type: Optional[Path]
+    for name, error_rates in zip(names, results):
+        results_md = _results_md(args, error_rates)
+        logger.info(f"{name}\n{results_md}")
+        if md_out_dir:
+            _write_md(md_out_dir / name / "results.md", results_md)
+
+    comparison = comparison_table(dict(zip(names, results)))
+    if args.bootstrap:
+        # optional dependency (numpy)
+        from mdace.bootstrap import paired_report
+
+        comparison += "\n" + paired_report(
+            names[0],
+            results[0],
+            dict(zip(names[1:], results[1:])),
+            args.bootstrap,
+            args.confidence,
+            args.seed,
+        )
+    logger.info(f"\n{comparison}")
 
     md_out = args.md_out  # type: Path
     if md_out:
-        md_out.parent.mkdir(parents=True, exist_ok=True)
-        with open(md_out, "w", encoding="utf8") as ofp:
-            print(str(error_rates), file=ofp)
+        _write_md(md_out, comparison)
 
 
 if __name__ == "__main__":
@@ -116,9 +527,23 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--predictions-dir",
-        help="Path to directory containing annotation JSON files",
+        help="Path to directory containing annotation JSON files; "
+        "give more than one to score several runs against the same gold",
         type=Path,
-        required=True,
+        nargs="+",
+        action="extend",
+    )
+    parser.add_argument(
+        "--predictions-glob",
+        help="Glob pattern matching prediction directories, e.g. 'with_text/predictions/*/Inpatient/ICD-9/Discharge'",
+        type=str,
+        action="append",
+    )
+    parser.add_argument(
+        "--note-store",
+        help="Note text store (see inject-note-text.py --note-store) used for JSON files without text",
+        type=Path,
+        required=False,
     )
     parser.add_argument(
         "--split-file",
@@ -151,12 +576,150 @@ if __name__ == "__main__":
 
     parser.add_argument(
         "--md-out",
-        help="Write results markdown to this file",
+        help="Write results markdown to this file (comparison table when scoring several runs)",
+        type=Path,
+        required=False,
+    )
+    parser.add_argument(
+        "--md-out-dir",
+        help="When scoring several runs, write <run>/results.md for each run under this directory",
         type=Path,
         required=False,
     )
 
+    parser.add_argument(
+        "--workers",
+        help="Number of processes used to parse each of the gold and prediction directories",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--run-workers",
+        help="Number of processes used to score runs in parallel when scoring several runs",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Parse admissions one at a time while scoring instead of loading everything up front",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache parsed datasets here (Arrow IPC, requires pyarrow); ignored with --streaming",
+        type=Path,
+        required=False,
+    )
+    parser.add_argument(
+        "--result-cache",
+        help="SQLite file with per-admission results; only admissions whose gold/predicted "
+        "files or options changed are scored again",
+        type=Path,
+        required=False,
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Compute metrics with NumPy set operations over the whole split (requires numpy)",
+    )
+
+    parser.add_argument(
+        "--group-by",
+        help="Also report micro/macro error rates and the worst groups per ICD code, "
+        "code chapter and/or note category",
+        type=str,
+        nargs="+",
+        action="extend",
+        choices=GROUP_BYS,
+    )
+    parser.add_argument(
+        "--top-k",
+        help="Number of worst groups listed per metric with --group-by",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--bootstrap",
+        help="Number of bootstrap resamples for confidence intervals (and, with several "
+        "runs, paired tests against the first run); 0 disables (requires numpy)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--confidence",
+        help="Confidence level of bootstrap intervals",
+        type=float,
+        default=0.95,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Random seed for bootstrap resampling",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--breakdown-out",
+        help="Stream TP/FP/FN per admission, note, code and metric to this JSONL file "
+        "(Parquet for *.parquet, requires pyarrow); with several runs it is written to "
+        "<parent>/<run>/<name> for each run",
+        type=Path,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--tokenizer",
+        help="Tokenizer of the token metrics: "
+        + ", ".join(TOKENIZERS)
+        + "; subword tokenizers take a local file, e.g. wordpiece:vocab.txt or "
+        "bpe:merges.txt (see mdace/tokenizers.py)",
+        default="regex",
+    )
+    parser.add_argument(
+        "--token-cache",
+        help="SQLite file storing the note tokenizations of subword tokenizers, so they "
+        "are computed once per corpus",
+        type=Path,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--overlap-metrics",
+        action="store_true",
+        help="Also report any-overlap and IoU span matches and character-level overlap",
+    )
+    parser.add_argument(
+        "--iou-threshold",
+        help="Minimum intersection over union of a span match with --overlap-metrics",
+        type=float,
+        default=0.5,
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Write the wall time, calls, peak RSS and allocated memory blocks of every "
+        "stage (loading, preprocessing, tokenization, each metric) to this JSON file; "
+        "worker processes are not profiled",
+        type=Path,
+        required=False,
+    )
+    parser.add_argument(
+        "--cprofile-stage",
+        help="Also run cProfile within this stage (e.g. observe/tokenize or "
+        "span_exact_match) and write its stats next to --profile as *.pstats",
+        required=False,
+    )
+
     cleanup = parser.add_argument_group("Clean Up Options")
+    cleanup.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        help="Preprocessing stages in the order they run, instead of --merge-adjacent "
+        "and --trim-annotations (which run merge-adjacent, then trim)",
+        required=False,
+    )
     cleanup.add_argument(
         "--merge-adjacent",
         action="store_true",
@@ -169,4 +732,31 @@ if __name__ == "__main__":
     )
 
     logging.basicConfig(level=logging.INFO)
-    main(parser.parse_args())
+    parsed_args = parser.parse_args()
+    if parsed_args.breakdown_out and (parsed_args.columnar or parsed_args.result_cache):
+        parser.error(
+            "--breakdown-out cannot be combined with --columnar or --result-cache"
+        )
+    if parsed_args.bootstrap and parsed_args.columnar:
+        parser.error("--bootstrap cannot be combined with --columnar")
+    if parsed_args.group_by and (parsed_args.columnar or parsed_args.result_cache):
+        parser.error("--group-by cannot be combined with --columnar or --result-cache")
+    if parsed_args.stages is not None and (
+        parsed_args.merge_adjacent or parsed_args.trim_annotations
+    ):
+        parser.error(
+            "--stages cannot be combined with --merge-adjacent or --trim-annotations"
+        )
+    if parsed_args.overlap_metrics and parsed_args.columnar:
+        parser.error("--overlap-metrics cannot be combined with --columnar")
+    if parsed_args.cprofile_stage and not parsed_args.profile:
+        parser.error("--cprofile-stage requires --profile")
+    if parsed_args.profile:
+        with profiling(
+            parsed_args.profile,
+            parsed_args.cprofile_stage,
+            parsed_args.profile.with_suffix(".pstats"),
+        ):
+            main(parsed_args)
+    else:
+        main(parsed_args)
@@ -1,15 +1,23 @@
 import argparse
 import csv
+import functools
+import hashlib
 import json
 import logging
+import os
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator, Mapping, Tuple, Optional, Set
+
+from mdace.notestore import NoteTextStore
 
 logger = logging.getLogger(Path(__file__).name)
 
 
-def inject_note_text(notes_map: Dict[int, str], admission: Dict) -> Dict:
+def inject_note_text(notes_map: Mapping[int, str], admission: Dict) -> Dict:
     """Inject text in-place"""
     for note in admission["notes"]:
         text = notes_map[note["note_id"]]
@@ -25,53 +33,264 @@ def _make_out_path(json_file: Path, input_dir: Path, out_dir: Path) -> Path:
     return out_dir.joinpath(*json_file.parts[prefix_len:])
 
 
-def inject_and_persist(notes_map: Dict[int, str], data_dir: Path, out_dir: Path):
-    """Inject text into admission and persist in ``out_dir``"""
+def _sha256(path: Path) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, "rb") as ifp:
+        for chunk in iter(lambda: ifp.read(2**20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _atomic_write(out_path: Path, content: bytes):
+    """Write to a temporary file next to ``out_path`` and rename it into place"""
+    with tempfile.NamedTemporaryFile(
+        dir=out_path.parent, prefix=f".{out_path.name}.", suffix=".tmp", delete=False
+    ) as ofp:
+        ofp.write(content)
+    try:
+        if out_path.exists():
+            os.chmod(ofp.name, out_path.stat().st_mode)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(ofp.name, 0o666 & ~umask)
+        os.replace(ofp.name, out_path)
+    except BaseException:
+        os.unlink(ofp.name)
+        raise
+
+
+# notes shared (read-only) by every file handled in a worker process
+_NOTES_MAP = None  # type: Optional[Mapping[int, str]]
+
+
+def _init_worker(notes_map: Mapping[int, str]):
+    global _NOTES_MAP
+    _NOTES_MAP = notes_map
+
+
+def _inject_file(json_file: Path, out_path: Path, force: bool = False) -> bool:
+    """Inject text into one file; False if ``out_path`` already had the same content"""
+    with open(json_file, "r", encoding="utf8") as ifp:
+        admission = inject_note_text(_NOTES_MAP, json.load(ifp))
+    content = json.dumps(admission, indent=2).encode("utf8")
+
+    if (
+        not force
+        and out_path.exists()
+        and out_path.stat().st_size == len(content)
+        and _sha256(out_path) == hashlib.sha256(content).digest()
+    ):
+        return False
+
+    _atomic_write(out_path, content)
+    return True
+
+
+def inject_and_persist(
+    notes_map: Mapping[int, str],
+    data_dir: Path,
+    out_dir: Path,
+    workers: int = 1,
+    force: bool = False,
+):
+    """Inject text into admission and persist in ``out_dir``
+
+    Files are written atomically and left untouched when their content would not
+    change. With ``workers > 1`` files are processed in a process pool; a
+    NoteTextStore is re-opened (memory-mapped) in each worker rather than copied.
+    """
     if out_dir:
         logger.info(f"Injecting text and persisting to {out_dir.absolute()}")
     else:
         logger.info("Injecting text in place")
 
+    tasks = list()
     for json_file in data_dir.glob("**/*.json"):
-        with open(json_file, "r", encoding="utf8") as ifp:
-            admission = inject_note_text(notes_map, json.load(ifp))
-
         if out_dir:
             out_path = _make_out_path(json_file, data_dir, out_dir)
             out_path.parent.mkdir(parents=True, exist_ok=True)
         else:
             out_path = json_file
+        tasks.append((json_file, out_path))
+
+    inject_fn = functools.partial(_inject_file, force=force)
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(notes_map,)
+        ) as pool:
+            written = list(
+                pool.map(
+                    inject_fn,
+                    *zip(*tasks),
+                    chunksize=max(1, len(tasks) // (workers * 4)),
+                )
+            )
+    else:
+        _init_worker(notes_map)
+        written = [inject_fn(json_file, out_path) for json_file, out_path in tasks]
+
+    logger.info(
+        f"Wrote {sum(written):,} files; {len(written) - sum(written):,} already up to date"
+    )
+
+
+def collect_note_ids(data_dir: Path) -> Set[int]:
+    """note_ids referenced by any admission JSON file under ``data_dir``"""
+    note_ids = set()
+    for json_file in data_dir.glob("**/*.json"):
+        with open(json_file, "r", encoding="utf8") as ifp:
+            note_ids.update(note["note_id"] for note in json.load(ifp)["notes"])
+    return note_ids
+
+
+class _Progress(object):
+    """Periodically log how far we are through NOTEEVENTS.csv"""
+
+    def __init__(self, ifp, interval_secs: float = 10.0):
+        self.ifp = ifp
+        self.interval_secs = interval_secs
+        self.total_bytes = os.fstat(ifp.fileno()).st_size
+        self.start = self.last = time.monotonic()
+        self.rows = 0
+        self.kept = 0
+
+    def update(self, force: bool = False):
+        now = time.monotonic()
+        if force or now - self.last >= self.interval_secs:
+            self.last = now
+            # position of the underlying binary buffer; ahead by at most one chunk
+            read_mb = self.ifp.buffer.tell() / 2**20
+            elapsed = max(now - self.start, 1e-6)
+            logger.info(
+                f"{read_mb:,.0f}/{self.total_bytes / 2**20:,.0f} MB, {self.rows:,} rows, "
+                f"{self.kept:,} notes kept [{read_mb / elapsed:,.1f} MB/s, {self.rows / elapsed:,.0f} rows/s]"
+            )
 
-        with open(out_path, "w", encoding="utf8") as ofp:
-            json.dump(admission, ofp, indent=2)
 
+def iter_noteevents(
+    noteevents: Path, note_ids: Optional[Set[int]] = None
+) -> Iterator[Tuple[int, str]]:
+    """(note_id, text) pairs from NOTEEVENTS.csv
 
-def build_notes_map(noteevents: Path) -> Dict[int, str]:
-    """Mapping from note_id to text constructed from NOTEEVENTS.csv"""
+    If ``note_ids`` is given, only those notes are returned and reading stops as soon
+    as all of them have been found.
+    """
     logger.info(f"Loading {noteevents}")
-    id_text_map = dict()
+    remaining = set(note_ids) if note_ids is not None else None
     csv.field_size_limit(sys.maxsize)
     with open(noteevents, "r", encoding="utf8") as ifp:
+        progress = _Progress(ifp)
         reader = csv.reader(ifp)
         # skip header
         # "ROW_ID","SUBJECT_ID","HADM_ID","CHARTDATE","CHARTTIME","STORETIME","CATEGORY","DESCRIPTION","CGID","ISERROR","TEXT"
         next(reader)
         for row in reader:
-            note_id, text = int(row[0]), row[10]
-            id_text_map[note_id] = text
-    return id_text_map
+            progress.rows += 1
+            if progress.rows % 10_000 == 0:
+                progress.update()
+
+            note_id = int(row[0])
+            if remaining is not None:
+                if note_id not in remaining:
+                    continue
+                remaining.discard(note_id)
+
+            progress.kept += 1
+            yield note_id, row[10]
+
+            if remaining is not None and not remaining:
+                logger.info("Found all requested notes; stopping early")
+                break
+
+        progress.update(force=True)
+
+    if remaining:
+        logger.warning(f"{len(remaining):,} requested notes not found in {noteevents}")
+
+
+def build_notes_map(
+    noteevents: Path, note_ids: Optional[Set[int]] = None
+) -> Dict[int, str]:
+    """Mapping from note_id to text constructed from NOTEEVENTS.csv
+
+    Pass ``note_ids`` to keep only the notes that will be injected.
+    """
+    return dict(iter_noteevents(noteevents, note_ids))
+
+
+def load_notes(args: argparse.Namespace) -> Mapping[int, str]:
+    if args.note_store is None:
+        if args.noteevents is None:
+            raise ValueError("One of --noteevents or --note-store is required")
+        if args.all_notes:
+            return build_notes_map(args.noteevents)
+        note_ids = collect_note_ids(args.data_dir)
+        logger.info(f"{len(note_ids):,} notes referenced in {args.data_dir}")
+        return build_notes_map(args.noteevents, note_ids)
+
+    if args.noteevents is not None and (
+        args.rebuild_note_store or not args.note_store.exists()
+    ):
+        logger.info(f"Building note text store {args.note_store}")
+        return NoteTextStore.build(args.note_store, iter_noteevents(args.noteevents))
+
+    logger.info(f"Using note text store {args.note_store}")
+    return NoteTextStore(args.note_store)
+
+
+def check_note_store(note_store: NoteTextStore, data_dir: Path):
+    """Make sure every note referenced under ``data_dir`` can be read from the store"""
+    missing = {
+        note_id for note_id in collect_note_ids(data_dir) if note_id not in note_store
+    }
+    if missing:
+        raise ValueError(
+            f"{len(missing):,} notes referenced in {data_dir} are missing from {note_store.path}"
+        )
+    logger.info(
+        f"All notes referenced in {data_dir} are in {note_store.path}; "
+        f"use --note-store with evaluate-predictions.py"
+    )
 
 
 def main(args: argparse.Namespace):
-    notes_map = build_notes_map(args.noteevents)
-    inject_and_persist(notes_map, args.data_dir, args.out_dir)
+    notes_map = load_notes(args)
+    if args.text_free:
+        if not isinstance(notes_map, NoteTextStore):
+            raise ValueError("--text-free requires --note-store")
+        check_note_store(notes_map, args.data_dir)
+        return
+
+    inject_and_persist(
+        notes_map, args.data_dir, args.out_dir, workers=args.workers, force=args.force
+    )
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
+    parser.add_argument("--noteevents", help="Path to NOTEEVENTS.csv", type=Path)
+    parser.add_argument(
+        "--note-store",
+        help="Path to a memory-mapped note text store; built from --noteevents if it does not exist yet",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--all-notes",
+        action="store_true",
+        help="Load every note from --noteevents instead of only those referenced in --data-dir",
+    )
+    parser.add_argument(
+        "--rebuild-note-store",
+        action="store_true",
+        help="Rebuild --note-store from --noteevents even if it exists",
+    )
     parser.add_argument(
-        "--noteevents", help="Path to NOTEEVENTS.csv", type=Path, required=True
+        "--text-free",
+        action="store_true",
+        help="Keep JSON files text-free: only build/check --note-store; text is attached when loading",
     )
     parser.add_argument(
         "--data-dir",
@@ -85,6 +304,17 @@ if __name__ == "__main__":
         type=Path,
         default=None,
     )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes used to inject text",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rewrite files even if they already have the injected content",
+    )
 
     logging.basicConfig(level=logging.INFO)
     main(parser.parse_args())
@@ -1,21 +1,22 @@
 """
 NOTE: Requires,
 
-pandas
 pyarrow
-fastparquet
 
 """
 
 import argparse
-import dataclasses
+import functools
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterator, Dict
+from typing import Iterator, Dict, List, Optional
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from mdace.data import MDACEData, Admission, Note, Annotation
+from mdace.data import MDACEData
+from mdace.notestore import NoteTextStore
 
 logger = logging.getLogger(Path(__file__).name)
 
@@ -32,48 +33,137 @@ def find_annotations_dirs(data_dir: Path) -> Iterator[Path]:
             yield annotations_dir
 
 
-def _get_out_path(out_dir: Path, annotations_dir: Path, extension: str) -> Path:
+def _get_out_path(
+    out_dir: Path, annotations_dir: Path, extension: str, suffix: str = ""
+) -> Path:
     # data_set_version = annotations_dir.name
     code_system = annotations_dir.parent.name
     specialty = annotations_dir.parent.parent.name
 
-    return out_dir / f"{specialty}-{code_system}.{extension}"
-
-
-def _flatten(admission: Admission, note: Note, annotation: Annotation) -> Dict:
-    adm_dict = dataclasses.asdict(admission)
-    del adm_dict["notes"]
-    note_dict = dataclasses.asdict(note)
-    del note_dict["annotations"]
-    anno_dict = dataclasses.asdict(annotation)
-    span_dict = anno_dict.pop("span")
-    billing_code_dict = anno_dict.pop("billing_code")
-
-    return {
-        **adm_dict,
-        **note_dict,
-        **span_dict,
-        **billing_code_dict,
-        **anno_dict,
-    }
-
-
-def as_dataframe(dataset: MDACEData) -> pd.DataFrame:
-    return pd.DataFrame(data=(_flatten(*tpl) for tpl in dataset))
-
-
-def convert_and_serialize(target_dir: Path, output_dir: Path):
-    dataset = MDACEData.from_dir(target_dir)
-    df = as_dataframe(dataset)
-
+    return out_dir / f"{specialty}-{code_system}{suffix}.{extension}"
+
+
+# one row per annotation; note text lives in NOTES_SCHEMA, keyed by note_id
+ANNOTATIONS_SCHEMA = pa.schema(
+    [
+        ("hadm_id", pa.int64()),
+        ("comment", pa.string()),
+        ("note_id", pa.int64()),
+        ("category", pa.string()),
+        ("description", pa.string()),
+        ("begin", pa.int64()),
+        ("end", pa.int64()),
+        ("covered_text", pa.string()),
+        ("code", pa.string()),
+        ("code_system", pa.string()),
+        ("code_description", pa.string()),
+        ("type", pa.string()),
+    ]
+)
+
+NOTES_SCHEMA = pa.schema(
+    [
+        ("note_id", pa.int64()),
+        ("hadm_id", pa.int64()),
+        ("category", pa.string()),
+        ("description", pa.string()),
+        ("text", pa.large_string()),
+    ]
+)
+
+
+class _BatchWriter(object):
+    """Accumulate columns and write them as one Parquet row group per ``batch_size`` rows"""
+
+    def __init__(self, path: Path, schema: pa.Schema, batch_size: int):
+        self.schema = schema
+        self.batch_size = batch_size
+        self.writer = pq.ParquetWriter(str(path), schema)
+        self.columns = {name: list() for name in schema.names}  # type: Dict[str, List]
+        self.n_rows = 0
+
+    def append(self, *values):
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+        if len(self.columns[self.schema.names[0]]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        n_rows = len(self.columns[self.schema.names[0]])
+        if n_rows:
+            self.writer.write_table(
+                pa.Table.from_pydict(self.columns, schema=self.schema)
+            )
+            self.n_rows += n_rows
+            for column in self.columns.values():
+                column.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def convert_and_serialize(
+    target_dir: Path,
+    output_dir: Path,
+    note_store: Optional[NoteTextStore] = None,
+    batch_size: int = 100_000,
+):
+    """Stream admissions from ``target_dir`` into annotation and note Parquet files"""
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_file = _get_out_path(output_dir, target_dir, "parquet")
-    df.to_parquet(output_file)
+    annotations = _BatchWriter(
+        _get_out_path(output_dir, target_dir, "parquet"), ANNOTATIONS_SCHEMA, batch_size
+    )
+    notes = _BatchWriter(
+        _get_out_path(output_dir, target_dir, "parquet", suffix="-notes"),
+        NOTES_SCHEMA,
+        batch_size,
+    )
+
+    for adm in MDACEData.iter_dir(target_dir, note_texts=note_store):
+        for note in adm.notes:
+            notes.append(
+                note.note_id, adm.hadm_id, note.category, note.description, note.text
+            )
+        for note, annotation in adm:
+            span, billing_code = annotation.span, annotation.billing_code
+            annotations.append(
+                adm.hadm_id,
+                adm.comment,
+                note.note_id,
+                note.category,
+                note.description,
+                span.begin,
+                span.end,
+                span.covered_text,
+                billing_code.code,
+                billing_code.code_system,
+                billing_code.code_description,
+                annotation.type,
+            )
+
+    annotations.close()
+    notes.close()
+    logger.info(
+        f"{target_dir}: {annotations.n_rows:,} annotations, {notes.n_rows:,} notes"
+    )
 
 
 def main(args: argparse.Namespace):
-    for target_dir in find_annotations_dirs(args.data_dir):
-        convert_and_serialize(target_dir, args.output_dir)
+    note_store = NoteTextStore(args.note_store) if args.note_store else None
+    convert_fn = functools.partial(
+        convert_and_serialize,
+        output_dir=args.output_dir,
+        note_store=note_store,
+        batch_size=args.batch_size,
+    )
+    target_dirs = list(find_annotations_dirs(args.data_dir))
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            list(pool.map(convert_fn, target_dirs))
+    else:
+        for target_dir in target_dirs:
+            convert_fn(target_dir)
 
 
 if __name__ == "__main__":
@@ -86,7 +176,25 @@ if __name__ == "__main__":
         default="with_text/gold",
     )
     parser.add_argument(
-        "--output-dir", help="Path to write CSV file", type=Path, default="parquet"
+        "--note-store",
+        help="Note text store used for JSON files without text",
+        type=Path,
+        default=None,
+    )
+    parser.add_argument(
+        "--output-dir", help="Path to write Parquet files", type=Path, default="parquet"
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="Number of rows per Parquet row group",
+        type=int,
+        default=100_000,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes used to convert specialty/code system directories",
+        type=int,
+        default=1,
     )
 
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,274 @@
+"""
+Bootstrap confidence intervals and paired significance tests for ``AllErrorRates``.
+
+Resampling works on an (admissions, metrics, TP/FP/FN) count array built from
+``AllErrorRates.per_admission``, so one resample is a weighted sum of that array
+instead of a re-run of the scorer. Every metric that was observed is bootstrapped,
+including the overlap metrics of ``AllErrorRates(overlap_metrics=True)``.
+
+NOTE: Requires,
+
+numpy
+
+"""
+
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from mdace.metrics import ALL_METRIC_TITLES, AllErrorRates, ErrorRate
+
+_logger = logging.getLogger(Path(__file__).name)
+
+STATS = ("precision", "recall", "f1_score")
+
+# resamples per matrix product; bounds memory to _CHUNK x admissions weights
+_CHUNK = 256
+
+
+@dataclass(frozen=True)
+class Interval:
+    estimate: float
+    low: float
+    high: float
+
+
+@dataclass(frozen=True)
+class PairedTest:
+    """Difference (other - baseline) with its bootstrap interval and permutation p-value"""
+
+    delta: float
+    low: float
+    high: float
+    p_value: float
+
+
+def observed_metrics(
+    *per_admissions: Dict[int, Dict[str, ErrorRate]]
+) -> Tuple[str, ...]:
+    """Metrics with error rates in every one of ``per_admissions``, in title order"""
+    observed = [
+        set(metric for error_rates in per_admission.values() for metric in error_rates)
+        for per_admission in per_admissions
+    ]
+    return tuple(
+        metric
+        for metric in ALL_METRIC_TITLES
+        if all(metric in metrics for metrics in observed)
+    )
+
+
+def count_array(
+    per_admission: Dict[int, Dict[str, ErrorRate]],
+    hadm_ids: Sequence[int],
+    metrics: Sequence[str],
+) -> np.ndarray:
+    """(admissions, metrics, 3) array of TP/FP/FN; admissions without results count as 0"""
+    counts = np.zeros((len(hadm_ids), len(metrics), 3), dtype=np.float64)
+    for row, hadm_id in enumerate(hadm_ids):
+        error_rates = per_admission.get(hadm_id, dict())
+        for col, metric in enumerate(metrics):
+            error_rate = error_rates.get(metric)
+            if error_rate is not None:
+                counts[row, col] = (
+                    error_rate.true_positives,
+                    error_rate.false_positives,
+                    error_rate.false_negatives,
+                )
+    return counts
+
+
+def scores(totals: np.ndarray) -> np.ndarray:
+    """Precision, recall and F1 of summed TP/FP/FN (last axis), computed like ErrorRate"""
+    tp, fp, fn = totals[..., 0], totals[..., 1], totals[..., 2]
+    precision = tp / (tp + fp + 1e-6)
+    recall = tp / (tp + fn + 1e-6)
+    f1_score = 2 * (precision * recall) / (precision + recall + 1e-6)
+    return np.stack((precision, recall, f1_score), axis=-1)
+
+
+def _weighted_totals(weights: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    n_admissions = counts.shape[0]
+    totals = weights @ counts.reshape(n_admissions, -1)
+    return totals.reshape((weights.shape[0],) + counts.shape[1:])
+
+
+def _resample_weights(
+    rng: np.random.Generator, n_admissions: int, n_resamples: int
+) -> Iterator[np.ndarray]:
+    """Number of times each admission is drawn, for chunks of resamples"""
+    probabilities = np.full(n_admissions, 1 / n_admissions)
+    for start in range(0, n_resamples, _CHUNK):
+        size = min(_CHUNK, n_resamples - start)
+        yield rng.multinomial(n_admissions, probabilities, size=size).astype(np.float64)
+
+
+def bootstrap_intervals(
+    counts: np.ndarray,
+    metrics: Sequence[str],
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Dict[str, Dict[str, Interval]]:
+    """Percentile bootstrap interval of precision, recall and F1 of every metric
+
+    ``metrics`` names the columns of ``counts``.
+    """
+    if len(counts) == 0:
+        raise ValueError("Cannot bootstrap without admissions")
+    rng = np.random.default_rng(seed)
+    estimate = scores(counts.sum(axis=0))
+    resampled = np.concatenate(
+        [
+            scores(_weighted_totals(weights, counts))
+            for weights in _resample_weights(rng, len(counts), n_resamples)
+        ]
+    )
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(resampled, [alpha, 1 - alpha], axis=0)
+    return {
+        metric: {
+            stat: Interval(float(estimate[m, s]), float(low[m, s]), float(high[m, s]))
+            for s, stat in enumerate(STATS)
+        }
+        for m, metric in enumerate(metrics)
+    }
+
+
+def paired_test(
+    baseline: np.ndarray,
+    other: np.ndarray,
+    metrics: Sequence[str],
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Dict[str, Dict[str, PairedTest]]:
+    """Compare two runs scored on the same admissions (rows of ``baseline``/``other``)
+    and metrics (columns, named by ``metrics``)
+
+    The interval of the difference comes from a paired bootstrap (both runs use the same
+    resampled admissions); the two-sided p-value from a paired permutation test that
+    swaps the results of the two runs per admission.
+    """
+    if baseline.shape != other.shape:
+        raise ValueError(f"Count arrays differ: {baseline.shape} != {other.shape}")
+    if len(baseline) == 0:
+        raise ValueError("Cannot bootstrap without admissions")
+    rng = np.random.default_rng(seed)
+    n_admissions = len(baseline)
+    delta = scores(other.sum(axis=0)) - scores(baseline.sum(axis=0))
+
+    resampled, extreme = list(), np.zeros(delta.shape, dtype=np.int64)
+    for weights in _resample_weights(rng, n_admissions, n_resamples):
+        resampled.append(
+            scores(_weighted_totals(weights, other))
+            - scores(_weighted_totals(weights, baseline))
+        )
+        swap = (rng.random(weights.shape) < 0.5).astype(np.float64)
+        keep = 1 - swap
+        permuted = scores(
+            _weighted_totals(swap, baseline) + _weighted_totals(keep, other)
+        ) - scores(_weighted_totals(swap, other) + _weighted_totals(keep, baseline))
+        extreme += (np.abs(permuted) >= np.abs(delta) - 1e-12).sum(axis=0)
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(np.concatenate(resampled), [alpha, 1 - alpha], axis=0)
+    p_value = (extreme + 1) / (n_resamples + 1)
+    return {
+        metric: {
+            stat: PairedTest(
+                float(delta[m, s]),
+                float(low[m, s]),
+                float(high[m, s]),
+                float(p_value[m, s]),
+            )
+            for s, stat in enumerate(STATS)
+        }
+        for m, metric in enumerate(metrics)
+    }
+
+
+def _per_admission(error_rates: AllErrorRates) -> Dict[int, Dict[str, ErrorRate]]:
+    if error_rates.per_admission is None:
+        raise ValueError(
+            "Bootstrapping requires AllErrorRates(keep_per_admission=True)"
+        )
+    return error_rates.per_admission
+
+
+def bootstrap_report(
+    error_rates: AllErrorRates,
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> str:
+    """Markdown table with the bootstrap interval of every metric"""
+    per_admission = _per_admission(error_rates)
+    metrics = observed_metrics(per_admission)
+    counts = count_array(per_admission, sorted(per_admission), metrics)
+    intervals = bootstrap_intervals(counts, metrics, n_resamples, confidence, seed)
+
+    title = f"Bootstrap {confidence:.0%} Confidence Intervals"
+    lines = [
+        "",
+        title,
+        "=" * len(title),
+        f"{n_resamples:,} resamples of {len(counts):,} admissions",
+        "",
+        "| Metric | Pr | Rc | F1 |",
+        "| ------ | ------ | ------ | ------ |",
+    ]
+    for metric, stats in intervals.items():
+        cells = [
+            f"{interval.estimate:.1%} [{interval.low:.1%}, {interval.high:.1%}]"
+            for interval in (stats[stat] for stat in STATS)
+        ]
+        lines.append(f"| {ALL_METRIC_TITLES[metric]} | " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def paired_report(
+    baseline_name: str,
+    baseline: AllErrorRates,
+    runs: Dict[str, AllErrorRates],
+    n_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> str:
+    """Markdown table comparing every run in ``runs`` with ``baseline``
+
+    Each run is compared on the metrics both it and ``baseline`` were scored on.
+    """
+    baseline_admissions = _per_admission(baseline)
+    lines = [
+        "",
+        f"Paired Tests against {baseline_name}",
+        "",
+        f"| Run | Metric | ΔPr | ΔRc | ΔF1 | ΔF1 {confidence:.0%} CI | p (F1) |",
+        "| ------ | ------ | ------ | ------ | ------ | ------ | ------ |",
+    ]
+    for name, other in runs.items():
+        other_admissions = _per_admission(other)
+        hadm_ids = sorted(
+            set(baseline_admissions) | set(other_admissions)
+        )  # type: List[int]
+        metrics = observed_metrics(baseline_admissions, other_admissions)
+        tests = paired_test(
+            count_array(baseline_admissions, hadm_ids, metrics),
+            count_array(other_admissions, hadm_ids, metrics),
+            metrics,
+            n_resamples,
+            confidence,
+            seed,
+        )
+        for metric, stats in tests.items():
+            f1 = stats["f1_score"]
+            lines.append(
+                f"| {name} | {ALL_METRIC_TITLES[metric]} "
+                f"| {stats['precision'].delta:+.1%} | {stats['recall'].delta:+.1%} "
+                f"| {f1.delta:+.1%} | [{f1.low:+.1%}, {f1.high:+.1%}] | {f1.p_value:.3f} |"
+            )
+    return "\n".join(lines)
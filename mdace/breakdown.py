@@ -0,0 +1,109 @@
+"""
+Streaming writers for the per-admission breakdown of ``AllErrorRates.observe_breakdown``.
+
+NOTE: Requires, for Parquet output,
+
+pyarrow
+
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+_logger = logging.getLogger(Path(__file__).name)
+
+BREAKDOWN_FIELDS = (
+    "hadm_id",
+    "note_id",
+    "code",
+    "code_system",
+    "metric",
+    "true_positives",
+    "false_positives",
+    "false_negatives",
+)
+
+
+class JsonlBreakdownWriter(object):
+    """One JSON object per line"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._ofp = open(path, "w", encoding="utf8")
+        self.n_rows = 0
+
+    def write(self, rows: List[Dict]):
+        for row in rows:
+            self._ofp.write(json.dumps(row))
+            self._ofp.write("\n")
+        self.n_rows += len(rows)
+
+    def close(self):
+        self._ofp.close()
+        _logger.info(f"Wrote {self.n_rows:,} breakdown rows to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParquetBreakdownWriter(JsonlBreakdownWriter):
+    """Rows are buffered and written as one row group per ``batch_size`` rows"""
+
+    def __init__(self, path: Path, batch_size: int = 100_000):
+        # optional dependency (pyarrow)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.n_rows = 0
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("hadm_id", pa.int64()),
+                ("note_id", pa.int64()),
+                ("code", pa.string()),
+                ("code_system", pa.string()),
+                ("metric", pa.dictionary(pa.int8(), pa.string())),
+                ("true_positives", pa.int32()),
+                ("false_positives", pa.int32()),
+                ("false_negatives", pa.int32()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(str(path), self._schema)
+        self._columns = {name: list() for name in BREAKDOWN_FIELDS}
+
+    def write(self, rows: List[Dict]):
+        for row in rows:
+            for name, column in self._columns.items():
+                column.append(row[name])
+        self.n_rows += len(rows)
+        if len(self._columns["hadm_id"]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._columns["hadm_id"]:
+            self._writer.write_table(
+                self._pa.Table.from_pydict(self._columns, schema=self._schema)
+            )
+            for column in self._columns.values():
+                column.clear()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        _logger.info(f"Wrote {self.n_rows:,} breakdown rows to {self.path}")
+
+
+def open_breakdown_writer(path: Path) -> JsonlBreakdownWriter:
+    """Parquet for ``*.parquet`` paths, JSONL otherwise"""
+    if path.suffix == ".parquet":
+        return ParquetBreakdownWriter(path)
+    return JsonlBreakdownWriter(path)
@@ -0,0 +1,345 @@
+"""
+Columnar on-disk cache of parsed MDACE datasets.
+
+NOTE: Requires,
+
+pyarrow
+
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+
+from mdace.data import (
+    Admission,
+    Annotation,
+    BillingCode,
+    CategoryFilter,
+    HadmIdFilter,
+    MDACEData,
+    Note,
+    NoteTexts,
+    Span,
+)
+
+_logger = logging.getLogger(Path(__file__).name)
+
+_FINGERPRINT_KEY = b"mdace.fingerprint"
+
+ADMISSIONS_SCHEMA = pa.schema(
+    [
+        ("hadm_id", pa.int64()),
+        ("comment", pa.string()),
+        ("n_notes", pa.int32()),
+    ]
+)
+
+NOTES_SCHEMA = pa.schema(
+    [
+        ("note_id", pa.int64()),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("description", pa.dictionary(pa.int32(), pa.string())),
+        ("text", pa.large_string()),
+        ("n_annotations", pa.int32()),
+    ]
+)
+
+ANNOTATIONS_SCHEMA = pa.schema(
+    [
+        ("begin", pa.int64()),
+        ("end", pa.int64()),
+        ("covered_text", pa.string()),
+        ("code", pa.dictionary(pa.int32(), pa.string())),
+        ("code_system", pa.dictionary(pa.int32(), pa.string())),
+        ("code_description", pa.dictionary(pa.int32(), pa.string())),
+        ("type", pa.dictionary(pa.int32(), pa.string())),
+    ]
+)
+
+_TABLES = ("admissions", "notes", "annotations")
+
+
+def fingerprint(dataset_dir: Path) -> str:
+    """Hash of the names, sizes and modification times of the JSON files in ``dataset_dir``"""
+    digest = hashlib.sha256()
+    for json_file in sorted(dataset_dir.glob("*.json")):
+        stat = json_file.stat()
+        digest.update(
+            f"{json_file.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode()
+        )
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: Path, dataset_dir: Path) -> Path:
+    """One cache entry per dataset directory"""
+    key = hashlib.sha1(str(dataset_dir.absolute()).encode("utf8")).hexdigest()[:16]
+    return cache_dir / f"{dataset_dir.name}-{key}"
+
+
+def _to_tables(dataset: MDACEData) -> Dict[str, pa.Table]:
+    columns = {
+        "admissions": {name: list() for name in ADMISSIONS_SCHEMA.names},
+        "notes": {name: list() for name in NOTES_SCHEMA.names},
+        "annotations": {name: list() for name in ANNOTATIONS_SCHEMA.names},
+    }
+    adm_cols, note_cols, anno_cols = (columns[name] for name in _TABLES)
+
+    for adm in dataset.admissions:
+        adm_cols["hadm_id"].append(adm.hadm_id)
+        adm_cols["comment"].append(adm.comment)
+        adm_cols["n_notes"].append(len(adm.notes))
+        for note in adm.notes:
+            note_cols["note_id"].append(note.note_id)
+            note_cols["category"].append(note.category)
+            note_cols["description"].append(note.description)
+            note_cols["text"].append(note.text)
+            note_cols["n_annotations"].append(len(note.annotations))
+            for annotation in note.annotations:
+                anno_cols["begin"].append(annotation.span.begin)
+                anno_cols["end"].append(annotation.span.end)
+                anno_cols["covered_text"].append(annotation.span.covered_text)
+                anno_cols["code"].append(annotation.billing_code.code)
+                anno_cols["code_system"].append(annotation.billing_code.code_system)
+                anno_cols["code_description"].append(
+                    annotation.billing_code.code_description
+                )
+                anno_cols["type"].append(annotation.type)
+
+    schemas = (ADMISSIONS_SCHEMA, NOTES_SCHEMA, ANNOTATIONS_SCHEMA)
+    return {
+        name: pa.Table.from_pydict(columns[name], schema=schema)
+        for name, schema in zip(_TABLES, schemas)
+    }
+
+
+def save(dataset: MDACEData, path: Path, dataset_fingerprint: str = ""):
+    """Write ``dataset`` as three Arrow IPC files in directory ``path``
+
+    Files are written to a fresh temporary directory next to ``path`` that is then
+    renamed, so concurrent writers of the same cache never touch each other's files.
+    A writer that loses the rename race keeps the other writer's cache.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(prefix=f"{path.name}.", dir=path.parent))
+    try:
+        for name, table in _to_tables(dataset).items():
+            table = table.replace_schema_metadata(
+                {_FINGERPRINT_KEY: dataset_fingerprint.encode()}
+            )
+            with pa.OSFile(str(tmp_path / f"{name}.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        # a directory can only be renamed onto a missing (or empty) one
+        old_path = tmp_path.with_name(tmp_path.name + ".old")
+        try:
+            os.replace(path, old_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            if not path.is_dir():
+                raise
+            _logger.info(f"Cache {path} was written by another process")
+        shutil.rmtree(old_path, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _read_table(path: Path, name: str) -> pa.Table:
+    # memory mapped; columns are only copied when converted to Python objects
+    return pa.ipc.open_file(pa.memory_map(str(path / f"{name}.arrow"))).read_all()
+
+
+def cached_fingerprint(path: Path) -> Optional[str]:
+    try:
+        metadata = _read_table(path, "annotations").schema.metadata or dict()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return metadata.get(_FINGERPRINT_KEY, b"").decode() or None
+
+
+def _repeat(mask: List[bool], counts: List[int]) -> List[bool]:
+    return list(
+        itertools.chain.from_iterable(
+            itertools.repeat(keep, count) for keep, count in zip(mask, counts)
+        )
+    )
+
+
+def _to_list(table: pa.Table, name: str) -> List:
+    """Column as a Python list; much faster than ``to_pylist`` for dictionary columns"""
+    column = table[name]
+    if not pa.types.is_dictionary(column.type):
+        return column.to_pylist()
+
+    values = list()
+    for chunk in column.chunks:
+        dictionary = chunk.dictionary.to_pylist()
+        values.extend(
+            None if idx is None else dictionary[idx]
+            for idx in chunk.indices.to_pylist()
+        )
+    return values
+
+
+def _segment_sums(mask: List[bool], counts: List[int]) -> List[int]:
+    """Number of kept rows in each consecutive segment of ``counts`` rows"""
+    sums, offset = list(), 0
+    for count in counts:
+        sums.append(sum(mask[offset : offset + count]))
+        offset += count
+    return sums
+
+
+def load(
+    path: Path,
+    hadm_id_filter: Optional[HadmIdFilter] = None,
+    category_filter: Optional[CategoryFilter] = None,
+    note_texts: Optional[NoteTexts] = None,
+) -> MDACEData:
+    """Rebuild MDACEData from a cache written by ``save``
+
+    Filters are applied to the Arrow tables, so rows of excluded admissions and notes
+    are never converted to Python objects.
+    """
+    admissions, notes, annotations = (_read_table(path, name) for name in _TABLES)
+
+    n_notes = _to_list(admissions, "n_notes")
+    n_annotations = _to_list(notes, "n_annotations")
+
+    if hadm_id_filter is not None or category_filter is not None:
+        adm_mask = [
+            hadm_id_filter is None or hadm_id_filter(hadm_id)
+            for hadm_id in _to_list(admissions, "hadm_id")
+        ]
+        note_mask = _repeat(adm_mask, n_notes)
+        if category_filter is not None:
+            note_mask = [
+                keep and category_filter(category)
+                for keep, category in zip(note_mask, _to_list(notes, "category"))
+            ]
+
+        # admissions without matching notes are kept (with no notes)
+        n_notes = [
+            n for n, keep in zip(_segment_sums(note_mask, n_notes), adm_mask) if keep
+        ]
+        admissions = admissions.filter(pa.array(adm_mask, type=pa.bool_()))
+        annotations = annotations.filter(
+            pa.array(_repeat(note_mask, n_annotations), type=pa.bool_())
+        )
+        notes = notes.filter(pa.array(note_mask, type=pa.bool_()))
+        n_annotations = _to_list(notes, "n_annotations")
+
+    return _from_tables(
+        admissions, notes, annotations, n_notes, n_annotations, note_texts
+    )
+
+
+def _from_tables(
+    admissions: pa.Table,
+    notes: pa.Table,
+    annotations: pa.Table,
+    n_notes: List[int],
+    n_annotations: List[int],
+    note_texts: Optional[NoteTexts],
+) -> MDACEData:
+    # dictionary encoded columns: build each distinct BillingCode/type once
+    billing_codes = [
+        BillingCode.intern(*key)
+        for key in zip(
+            _to_list(annotations, "code"),
+            _to_list(annotations, "code_system"),
+            _to_list(annotations, "code_description"),
+        )
+    ]
+    annotation_objs = [
+        Annotation(
+            span=Span(begin, end, covered_text),
+            billing_code=billing_code,
+            type=anno_type,
+        )
+        for begin, end, covered_text, billing_code, anno_type in zip(
+            _to_list(annotations, "begin"),
+            _to_list(annotations, "end"),
+            _to_list(annotations, "covered_text"),
+            billing_codes,
+            _to_list(annotations, "type"),
+        )
+    ]
+
+    note_objs, offset = list(), 0
+    for note_id, category, description, text, count in zip(
+        _to_list(notes, "note_id"),
+        _to_list(notes, "category"),
+        _to_list(notes, "description"),
+        _to_list(notes, "text"),
+        n_annotations,
+    ):
+        if text is None and note_texts is not None:
+            text = note_texts.get(note_id)
+        note_objs.append(
+            Note(
+                note_id=note_id,
+                category=category,
+                description=description,
+                annotations=annotation_objs[offset : offset + count],
+                text=text,
+            )
+        )
+        offset += count
+
+    admission_objs, offset = list(), 0
+    for hadm_id, comment, count in zip(
+        _to_list(admissions, "hadm_id"), _to_list(admissions, "comment"), n_notes
+    ):
+        admission_objs.append(
+            Admission(
+                hadm_id=hadm_id,
+                notes=note_objs[offset : offset + count],
+                comment=comment,
+            )
+        )
+        offset += count
+
+    return MDACEData(admission_objs)
+
+
+def from_dir_cached(
+    dataset_dir: Path,
+    cache_dir: Path,
+    require_text: bool = True,
+    hadm_id_filter: Optional[HadmIdFilter] = None,
+    category_filter: Optional[CategoryFilter] = None,
+    workers: int = 1,
+    note_texts: Optional[NoteTexts] = None,
+) -> MDACEData:
+    """``MDACEData.from_dir`` backed by a cache that is rebuilt when the JSON files change
+
+    The cache holds the whole, unfiltered directory so that it can serve any split or
+    note category.
+    """
+    path = cache_path(cache_dir, dataset_dir)
+    current = fingerprint(dataset_dir)
+
+    if cached_fingerprint(path) != current:
+        _logger.info(f"(Re)building cache {path} for {dataset_dir}")
+        dataset = MDACEData.from_dir(dataset_dir, require_text=False, workers=workers)
+        save(dataset, path, current)
+
+    dataset = load(path, hadm_id_filter, category_filter, note_texts)
+    if require_text:
+        admissions = MDACEData._check_admissions(
+            iter(dataset.admissions), dataset_dir, require_text, None
+        )
+        dataset = MDACEData(list(admissions))
+    return dataset
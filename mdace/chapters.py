@@ -0,0 +1,124 @@
+import bisect
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple
+
+from mdace.data import BillingCode
+
+_logger = logging.getLogger(Path(__file__).name)
+
+# (first code, label) of every chapter, sorted by first code
+_ICD9_CM = [
+    ("001", "001-139"),
+    ("140", "140-239"),
+    ("240", "240-279"),
+    ("280", "280-289"),
+    ("290", "290-319"),
+    ("320", "320-389"),
+    ("390", "390-459"),
+    ("460", "460-519"),
+    ("520", "520-579"),
+    ("580", "580-629"),
+    ("630", "630-679"),
+    ("680", "680-709"),
+    ("710", "710-739"),
+    ("740", "740-759"),
+    ("760", "760-779"),
+    ("780", "780-799"),
+    ("800", "800-999"),
+    ("E", "E000-E999"),
+    ("V", "V01-V91"),
+]
+
+_ICD9_PCS = [
+    ("00", "00"),
+    ("01", "01-05"),
+    ("06", "06-07"),
+    ("08", "08-16"),
+    ("17", "17"),
+    ("18", "18-20"),
+    ("21", "21-29"),
+    ("30", "30-34"),
+    ("35", "35-39"),
+    ("40", "40-41"),
+    ("42", "42-54"),
+    ("55", "55-59"),
+    ("60", "60-64"),
+    ("65", "65-71"),
+    ("72", "72-75"),
+    ("76", "76-84"),
+    ("85", "85-86"),
+    ("87", "87-99"),
+]
+
+_ICD10_CM = [
+    ("A00", "A00-B99"),
+    ("C00", "C00-D49"),
+    ("D50", "D50-D89"),
+    ("E00", "E00-E89"),
+    ("F01", "F01-F99"),
+    ("G00", "G00-G99"),
+    ("H00", "H00-H59"),
+    ("H60", "H60-H95"),
+    ("I00", "I00-I99"),
+    ("J00", "J00-J99"),
+    ("K00", "K00-K95"),
+    ("L00", "L00-L99"),
+    ("M00", "M00-M99"),
+    ("N00", "N00-N99"),
+    ("O00", "O00-O9A"),
+    ("P00", "P00-P96"),
+    ("Q00", "Q00-Q99"),
+    ("R00", "R00-R99"),
+    ("S00", "S00-T88"),
+    ("U00", "U00-U85"),
+    ("V00", "V00-Y99"),
+    ("Z00", "Z00-Z99"),
+]
+
+_CPT = [
+    ("00100", "00100-01999"),
+    ("10004", "10004-69990"),
+    ("70010", "70010-79999"),
+    ("80047", "80047-89398"),
+    ("90281", "90281-99199"),
+    ("99202", "99202-99499"),
+    ("99500", "99500-99607"),
+]
+
+_CHAPTERS = {
+    "ICD-9-CM": (_ICD9_CM, 3),
+    "ICD-9-PCS": (_ICD9_PCS, 2),
+    "ICD-10-CM": (_ICD10_CM, 3),
+    "CPT": (_CPT, 5),
+}
+
+
+def _lookup(chapters: List[Tuple[str, str]], prefix: str) -> str:
+    idx = bisect.bisect_right([first for first, _ in chapters], prefix) - 1
+    return chapters[idx][1] if idx >= 0 else "other"
+
+
+@lru_cache(maxsize=None)
+def code_chapter(billing_code: BillingCode) -> str:
+    """Chapter (range of codes) of an ICD-9/ICD-10 diagnosis, ICD-9 procedure or CPT code
+
+    ICD-10-PCS codes are grouped by section (first character). Codes of other systems
+    are grouped as "<code system> other".
+    """
+    code, code_system = billing_code.code.strip().upper(), billing_code.code_system
+    if code_system == "ICD-10-PCS":
+        return f"{code_system} section {code[:1]}"
+    if code_system not in _CHAPTERS:
+        return f"{code_system} other"
+
+    chapters, n_chars = _CHAPTERS[code_system]
+    if code_system == "ICD-9-CM" and code[:1] in ("E", "V"):
+        prefix = code[:1]
+    elif code_system == "CPT" and not code[:n_chars].isdigit():
+        # Category II/III codes, e.g. 0001F
+        return f"{code_system} category {code[-1:]}"
+    else:
+        prefix = code[:n_chars]
+    return f"{code_system} {_lookup(chapters, prefix)}"
@@ -1,10 +1,11 @@
 import dataclasses
+import functools
 import logging
 import string
 from pathlib import Path
-from typing import List, Callable
+from typing import List, Callable, Optional, Tuple, TypeVar
 
-from mdace.data import Annotation, Note, Admission, MDACEData, Span
+from mdace.data import Annotation, Note, Admission, MDACEData, Span, LazyMDACEData
 
 _logger = logging.getLogger(Path(__file__).name)
 
@@ -109,19 +110,146 @@ def trim_annotations_in_note(note: Note) -> Note:
     return dataclasses.replace(note, annotations=new_annos)
 
 
-def _map_notes(mdace: MDACEData, map_fn: Callable[[Note], Note]):
+# character classes as strings, for str.strip: a run of characters is entirely of a
+# class when stripping the class leaves nothing
+_NON_BREAKING_STR = "".join(sorted(_NON_BREAKING_CHARS))
+_TRIM_L_STR = "".join(sorted(TRIM_L_CHARS))
+_TRIM_R_STR = "".join(sorted(TRIM_R_CHARS))
+
+
+def _trim_offsets(text: str, begin: int, end: int) -> Tuple[int, int]:
+    """Offsets of [begin, end) after ``_do_trim``"""
+    if 0 <= begin <= end <= len(text):
+        stripped = text[begin:end].lstrip(_TRIM_L_STR)
+        new_begin = end - len(stripped)
+        return new_begin, new_begin + len(stripped.rstrip(_TRIM_R_STR))
+
+    # out of range offsets index like _do_trim
+    span = _do_trim(text, Span(begin, end))
+    return span.begin, span.end
+
+
+def _emit(
+    note: Note,
+    annotation: Annotation,
+    begin: int,
+    end: int,
+    covered_text: Optional[str],
+    trim: bool,
+) -> Annotation:
+    """``annotation`` with span [begin, end) and ``covered_text``, trimmed if ``trim``"""
+    span = annotation.span
+    if trim:
+        new_begin, new_end = _trim_offsets(note.text, begin, end)
+        if (new_begin, new_end) != (begin, end):
+            if new_end == new_begin:
+                if (begin, end) != (span.begin, span.end):
+                    annotation = dataclasses.replace(
+                        annotation, span=Span(begin, end, covered_text)
+                    )
+                _logger.error(
+                    "All characters stripped from %s in note_id=%d",
+                    annotation,
+                    note.note_id,
+                )
+            new_text = note.text[new_begin:new_end] if covered_text else None
+            return dataclasses.replace(
+                annotation, span=Span(new_begin, new_end, new_text)
+            )
+    if (begin, end) == (span.begin, span.end) and covered_text is span.covered_text:
+        return annotation
+    return dataclasses.replace(annotation, span=Span(begin, end, covered_text))
+
+
+def _trim_all(note: Note) -> Note:
+    return dataclasses.replace(
+        note,
+        annotations=[
+            _emit(
+                note, anno, anno.span.begin, anno.span.end, anno.span.covered_text, True
+            )
+            for anno in note.annotations
+        ],
+    )
+
+
+def clean_note(note: Note, merge_adjacent: bool = True, trim: bool = True) -> Note:
+    """``merge_adjacent_in_note`` and then ``trim_annotations_in_note``, in one sweep
+
+    Annotations are sorted once; each run of merged annotations becomes a single
+    Annotation, trimmed as it is emitted. Character class checks strip note text
+    slices instead of testing characters one by one.
+    """
+    annotations = note.annotations
+    if not merge_adjacent or len(annotations) < 2:
+        return _trim_all(note) if trim else note
+
+    text = note.text
+    order_ensured = sorted(annotations, key=lambda a: a.span.begin)
+    # runs of merged annotations as (first annotation, begin, end, has_text, n), where
+    # has_text tells whether the covered_text of the run was set before its last merge
+    runs = list()
+    first = order_ensured[0]
+    begin, end = first.span.begin, first.span.end
+    has_text, n = bool(first.span.covered_text), 1
+    for current in order_ensured[1:]:
+        if first.billing_code == current.billing_code and not text[
+            end : current.span.begin
+        ].strip(_NON_BREAKING_STR):
+            if n > 1:
+                # like _merge, the covered_text of the run so far decides
+                has_text = has_text and len(range(len(text))[begin:end]) > 0
+            end, n = current.span.end, n + 1
+        else:
+            runs.append((first, begin, end, has_text, n))
+            first = current
+            begin, end = first.span.begin, first.span.end
+            has_text, n = bool(first.span.covered_text), 1
+    runs.append((first, begin, end, has_text, n))
+
+    if len(runs) == len(annotations):
+        # nothing merged, the original order is kept
+        return _trim_all(note) if trim else note
+
+    new_annos = list()
+    for first, begin, end, has_text, n in runs:
+        if n == 1:
+            covered_text = first.span.covered_text
+        else:
+            covered_text = text[begin:end] if has_text else None
+        new_annos.append(_emit(note, first, begin, end, covered_text, trim))
+    return dataclasses.replace(note, annotations=new_annos)
+
+
+Dataset = TypeVar("Dataset", MDACEData, LazyMDACEData)
+
+
+def _map_notes(mdace: Dataset, map_fn: Callable[[Note], Note]) -> Dataset:
     def map_adm(adm: Admission) -> Admission:
         return dataclasses.replace(
             adm,
             notes=[map_fn(note) for note in adm.notes],
         )
 
-    return MDACEData(admissions=[map_adm(admission) for admission in mdace.admissions])
+    # lazy datasets defer the work until admissions are iterated
+    return mdace.map_admissions(map_adm)
 
 
-def merge_adjacent_annotations(mdace: MDACEData) -> MDACEData:
+def merge_adjacent_annotations(mdace: Dataset) -> Dataset:
     return _map_notes(mdace, merge_adjacent_in_note)
 
 
-def trim_annotations(mdace: MDACEData) -> MDACEData:
+def trim_annotations(mdace: Dataset) -> Dataset:
     return _map_notes(mdace, trim_annotations_in_note)
+
+
+def clean_annotations(
+    mdace: Dataset, merge_adjacent: bool = True, trim: bool = True
+) -> Dataset:
+    """``merge_adjacent_annotations`` and/or ``trim_annotations`` in one pass over the notes"""
+    if not (merge_adjacent or trim):
+        return mdace
+    return _map_notes(
+        mdace,
+        functools.partial(clean_note, merge_adjacent=merge_adjacent, trim=trim),
+    )
@@ -0,0 +1,205 @@
+"""
+Columnar (NumPy) implementation of the metrics in ``mdace.metrics``.
+
+NOTE: Requires,
+
+numpy
+
+"""
+
+import logging
+from array import array
+from itertools import repeat
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+from mdace.data import Admission, Span
+from mdace.metrics import ErrorRate, error_rates_str, normalize
+from mdace.profiling import stage
+from mdace.text import (
+    TokenizationCache,
+    TokenizedAdmission,
+    note_token_cache,
+    offsets_tokenizer,
+    tokenize_admission_offsets,
+)
+
+_logger = logging.getLogger(Path(__file__).name)
+
+
+class Interner(object):
+    """Map hashable values to dense integer ids"""
+
+    def __init__(self):
+        self._ids = dict()  # type: Dict[Hashable, int]
+
+    def __call__(self, value: Hashable) -> int:
+        try:
+            return self._ids[value]
+        except KeyError:
+            return self._ids.setdefault(value, len(self._ids))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class AnnotationColumns(object):
+    """Annotations of many admissions stored as int64 columns
+
+    Billing codes and normalized covered text are interned to ids so that a row can be
+    compared with plain integer operations.
+    """
+
+    COLUMNS = ("hadm_id", "note_id", "begin", "end", "code_id", "text_id")
+
+    def __init__(self, codes: Interner, texts: Interner):
+        self.codes = codes
+        self.texts = texts
+        self._columns = {name: array("q") for name in self.COLUMNS}
+
+    def extend(self, admission: Admission):
+        hadm_id = admission.hadm_id
+        columns = self._columns
+        for note, annotation in admission:
+            columns["hadm_id"].append(hadm_id)
+            columns["note_id"].append(note.note_id)
+            columns["begin"].append(annotation.span.begin)
+            columns["end"].append(annotation.span.end)
+            columns["code_id"].append(self.codes(annotation.billing_code))
+            columns["text_id"].append(
+                self.texts(normalize(annotation.span.covered_text))
+            )
+
+    def extend_tokens(self, hadm_id: int, tokenized: TokenizedAdmission):
+        """Add tokens; token ids serve as text ids (tokens are already normalized)
+
+        Token rows use their begin offset as end, like ``tokenize_annotation``.
+        """
+        columns = self._columns
+        for note, annotations in tokenized:
+            note_id = note.note_id
+            for annotation, (begins, _, token_ids) in annotations:
+                code_id = self.codes(annotation.billing_code)
+                n_tokens = len(begins)
+                columns["hadm_id"].extend(repeat(hadm_id, n_tokens))
+                columns["note_id"].extend(repeat(note_id, n_tokens))
+                columns["begin"].extend(begins)
+                columns["end"].extend(begins)
+                columns["code_id"].extend(repeat(code_id, n_tokens))
+                columns["text_id"].extend(token_ids)
+
+    def __len__(self) -> int:
+        return len(self._columns["hadm_id"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        # copy, so that the underlying array can keep growing
+        return np.array(self._columns[name], dtype=np.int64)
+
+
+# key columns; mirror the key functions of exact_match_error/position_independent_error
+EXACT_MATCH_KEY = ("hadm_id", "note_id", "begin", "end", "code_id")
+POSITION_INDEPENDENT_KEY = ("hadm_id", "text_id", "code_id")
+
+
+def _unique_rows(table: AnnotationColumns, key: List[str]) -> np.ndarray:
+    if len(table) == 0:
+        return np.empty((0, len(key)), dtype=np.int64)
+    return np.unique(np.stack([table[name] for name in key], axis=1), axis=0)
+
+
+def count_unique_errors(
+    actual: AnnotationColumns, predicted: AnnotationColumns, key: List[str]
+) -> ErrorRate:
+    """Equivalent of ``metrics._count_unique_errors`` summed over all admissions
+
+    ``hadm_id`` is part of every key, so a single set operation over the whole split
+    gives the same counts as one per admission.
+    """
+    actual_rows = _unique_rows(actual, key)
+    predicted_rows = _unique_rows(predicted, key)
+
+    # rows present in both show up twice after concatenating the unique rows
+    _, counts = np.unique(
+        np.concatenate((actual_rows, predicted_rows)), axis=0, return_counts=True
+    )
+    tp = int(np.count_nonzero(counts == 2))
+
+    return ErrorRate(
+        true_positives=tp,
+        false_positives=len(predicted_rows) - tp,
+        false_negatives=len(actual_rows) - tp,
+    )
+
+
+class ColumnarErrorRates(object):
+    """NumPy counterpart of AllErrorRates for the four metrics of the paper
+
+    ``observe`` only appends rows; the metrics are computed with set operations over
+    the whole split when ``error_rates`` is first read after an ``observe``. Only
+    ``observe``, ``error_rates`` and ``str`` are supported: there are no per-admission
+    error rates, breakdowns, groupings or overlap metrics, so this is not an
+    AllErrorRates subclass.
+    """
+
+    def __init__(
+        self,
+        tokenize_fn: Callable[[str], List[Span]],
+        gold_token_cache: Optional[TokenizationCache] = None,
+    ):
+        self.tokenize_fn = tokenize_fn
+        self.tokenize_offsets_fn = offsets_tokenizer(tokenize_fn)
+        self.gold_token_cache = gold_token_cache
+        if gold_token_cache is not None:
+            self.note_tokens = gold_token_cache.note_tokens
+        else:
+            self.note_tokens = note_token_cache(tokenize_fn)
+
+        codes, texts = Interner(), Interner()
+        self.spans = AnnotationColumns(codes, texts), AnnotationColumns(codes, texts)
+        self.tokens = AnnotationColumns(codes, texts), AnnotationColumns(codes, texts)
+        self._error_rates = None  # type: Optional[Dict[str, ErrorRate]]
+
+    def observe(self, actual: Admission, predicted: Admission):
+        """Append the rows of an admission; error rates are only computed when read"""
+        self._error_rates = None
+        with stage("observe"):
+            self.spans[0].extend(actual)
+            self.spans[1].extend(predicted)
+
+            with stage("tokenize"):
+                if self.gold_token_cache is not None:
+                    a_tokenized = self.gold_token_cache(actual)
+                else:
+                    a_tokenized = tokenize_admission_offsets(
+                        actual, self.tokenize_offsets_fn, self.note_tokens
+                    )
+                p_tokenized = tokenize_admission_offsets(
+                    predicted, self.tokenize_offsets_fn, self.note_tokens
+                )
+            self.tokens[0].extend_tokens(actual.hadm_id, a_tokenized)
+            self.tokens[1].extend_tokens(predicted.hadm_id, p_tokenized)
+
+    @property
+    def error_rates(self) -> Dict[str, ErrorRate]:
+        if self._error_rates is None:
+            self._error_rates = self._count_errors()
+        return self._error_rates
+
+    def _count_errors(self) -> Dict[str, ErrorRate]:
+        metrics = dict(
+            span_exact_match=(self.spans, EXACT_MATCH_KEY),
+            span_position_independent=(self.spans, POSITION_INDEPENDENT_KEY),
+            token_exact_match=(self.tokens, EXACT_MATCH_KEY),
+            token_position_independent=(self.tokens, POSITION_INDEPENDENT_KEY),
+        )
+        error_rates = dict()
+        with stage("error_rates"):
+            for name, (columns, key) in metrics.items():
+                with stage(name):
+                    error_rates[name] = count_unique_errors(*columns, key)
+        return error_rates
+
+    def __str__(self):
+        return error_rates_str(self.error_rates)
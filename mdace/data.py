@@ -1,18 +1,53 @@
 import dataclasses
+import functools
 import json
 import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterator, List, Dict, Tuple, Optional
+from typing import Iterator, List, Dict, Tuple, Optional, Callable, Mapping
+
+from mdace.profiling import stage
 
 _logger = logging.getLogger(Path(__file__).name)
 
+HadmIdFilter = Callable[[int], bool]
+CategoryFilter = Callable[[str], bool]
+# note_id -> text, e.g. a dict or mdace.notestore.NoteTextStore
+NoteTexts = Mapping[int, str]
+
+
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """ProcessPoolExecutor whose workers are not forked from this process
+
+    Pools may be created while other threads run (e.g. gold and predictions load
+    concurrently), and forking then copies locks those threads hold. Workers start
+    from a fork server, or are spawned where there is none.
+    """
+    method = (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(method),
+        **kwargs,
+    )
+
+
+# no per-instance __dict__; frozen slotted dataclasses only pickle correctly from 3.11
+_SLOTS = dict(slots=True) if sys.version_info >= (3, 11) else dict()
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class Span:
     begin: int
     end: int
 
+    # None when it can be sliced from Note.text; Admission.__iter__ fills it in
     covered_text: Optional[str] = dataclasses.field(compare=False, default=None)
 
     def __len__(self) -> int:
@@ -23,35 +58,65 @@ class Span:
         return Span(begin, end, note_text[begin:end])
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class BillingCode:
     code: str
     code_system: str
     code_description: Optional[str] = dataclasses.field(compare=False, default=None)
 
+    @staticmethod
+    def intern(
+        code: str, code_system: str, code_description: Optional[str] = None
+    ) -> "BillingCode":
+        """Shared instance from the registry; a handful of codes repeat across millions of annotations"""
+        key = (code, code_system, code_description)
+        billing_code = _BILLING_CODES.get(key)
+        if billing_code is None:
+            billing_code = _BILLING_CODES.setdefault(
+                key,
+                BillingCode(
+                    sys.intern(code),
+                    sys.intern(code_system),
+                    code_description and sys.intern(code_description),
+                ),
+            )
+        return billing_code
+
+    def __reduce__(self):
+        # unpickled codes (e.g. from worker processes) share the registry instances
+        return BillingCode.intern, (self.code, self.code_system, self.code_description)
+
+
+_BILLING_CODES = dict()  # type: Dict[Tuple[str, str, Optional[str]], BillingCode]
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, **_SLOTS)
 class Annotation:
     span: Span
     billing_code: BillingCode
     type: Optional[str] = dataclasses.field(compare=False, default=None)
 
     @staticmethod
-    def from_json_dict(data: Dict) -> "Annotation":
+    def from_json_dict(data: Dict, note_text: Optional[str] = None) -> "Annotation":
+        begin, end = data.pop("begin"), data.pop("end")
+        covered_text = data.pop("covered_text", None)
+        if note_text is not None and covered_text == note_text[begin:end]:
+            # redundant copy of the note text, Admission.__iter__ slices it when needed
+            covered_text = None
+
+        if data.get("type"):
+            data["type"] = sys.intern(data["type"])
+
         return Annotation(
-            span=Span(
-                begin=data.pop("begin"),
-                end=data.pop("end"),
-                covered_text=data.pop("covered_text", None),
-            ),
-            billing_code=BillingCode(
+            span=Span(begin=begin, end=end, covered_text=covered_text),
+            billing_code=BillingCode.intern(
                 data.pop("code"), data.pop("code_system"), data.pop("description", None)
             ),
             **data,
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class Note:
     note_id: int
     category: str
@@ -61,15 +126,21 @@ class Note:
     text: Optional[str] = dataclasses.field(repr=False, default=None)
 
     @staticmethod
-    def from_json_dict(data: Dict) -> "Note":
+    def from_json_dict(data: Dict, note_texts: Optional[NoteTexts] = None) -> "Note":
+        """Build a Note; text missing from ``data`` is taken from ``note_texts``"""
+        text = data.pop("text", None)
+        if text is None and note_texts is not None:
+            text = note_texts.get(data["note_id"])
         return Note(
-            text=data.pop("text", None),
-            annotations=[Annotation.from_json_dict(a) for a in data.pop("annotations")],
+            text=text,
+            annotations=[
+                Annotation.from_json_dict(a, text) for a in data.pop("annotations")
+            ],
             **data,
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class Admission:
     hadm_id: int
     notes: List[Note]
@@ -77,18 +148,22 @@ class Admission:
     comment: str = None
 
     def __iter__(self) -> Iterator[Tuple[Note, Annotation]]:
+        """Annotations with their note, covered_text filled in from the note text
+
+        covered_text is not kept when it equals the note slice (see
+        ``Annotation.from_json_dict``), so it is sliced again on every pass: about a
+        microsecond per annotation per pass, traded for not holding a second copy of
+        every evidence span.
+        """
         for note in self.notes:
+            text = note.text
             for annotation in note.annotations:
-                # set annotation.span.covered_text if we have note.text
-                if note.text and not annotation.span.covered_text:
-                    annotation = dataclasses.replace(
-                        annotation,
-                        span=dataclasses.replace(
-                            annotation.span,
-                            covered_text=note.text[
-                                annotation.span.begin : annotation.span.end
-                            ],
-                        ),
+                span = annotation.span
+                if text and not span.covered_text:
+                    annotation = Annotation(
+                        Span(span.begin, span.end, text[span.begin : span.end]),
+                        annotation.billing_code,
+                        annotation.type,
                     )
                 yield note, annotation
 
@@ -97,19 +172,55 @@ class Admission:
         return not any(note.text is None for note in self.notes)
 
     @staticmethod
-    def from_json_dict(data: Dict) -> "Admission":
+    def from_json_dict(
+        data: Dict,
+        category_filter: Optional[CategoryFilter] = None,
+        note_texts: Optional[NoteTexts] = None,
+    ) -> "Admission":
+        """Build an Admission; notes rejected by ``category_filter`` are never constructed"""
         return Admission(
-            notes=[Note.from_json_dict(note) for note in data.pop("notes")],
+            notes=[
+                Note.from_json_dict(note, note_texts)
+                for note in data.pop("notes")
+                if category_filter is None or category_filter(note["category"])
+            ],
             **data,
         )
 
     @staticmethod
-    def from_json_file(file_path: Path) -> "Admission":
-        with open(file_path, "r", encoding="utf8") as ifp:
-            return Admission.from_json_dict(json.load(ifp))
+    def from_json_file(
+        file_path: Path,
+        category_filter: Optional[CategoryFilter] = None,
+        note_texts: Optional[NoteTexts] = None,
+    ) -> "Admission":
+        with stage("parse"), open(file_path, "r", encoding="utf8") as ifp:
+            return Admission.from_json_dict(json.load(ifp), category_filter, note_texts)
+
+
+def hadm_id_from_path(json_file: Path) -> Optional[int]:
+    """Parse hadm_id from ``<hadm_id>.json`` or ``<hadm_id>-<code system>.json``"""
+    prefix, _, _ = json_file.stem.partition("-")
+    try:
+        return int(prefix)
+    except ValueError:
+        return None
+
+
+def index_dir(dataset_dir: Path) -> List[Tuple[Path, Optional[int]]]:
+    """Sorted (file, hadm_id) pairs for every JSON file in ``dataset_dir``
+
+    hadm_id is None when it cannot be read from the file name.
+    """
+    index = [
+        (json_file, hadm_id_from_path(json_file))
+        for json_file in dataset_dir.glob("*.json")
+    ]
+    if not index:
+        raise ValueError(f"No JSON files found in path {dataset_dir.absolute()}")
+    return sorted(index)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class MDACEData:
     admissions: List[Admission]
 
@@ -118,24 +229,193 @@ class MDACEData:
         return sum((1 for _ in iter(self)))
 
     @staticmethod
-    def from_dir(dataset_dir: Path, require_text: bool = True) -> "MDACEData":
-        try:
-            next(dataset_dir.glob("*.json"))
-        except StopIteration:
-            raise ValueError(f"No JSON files found in path {dataset_dir.absolute()}")
-
-        admissions = list()
-        for json_file in dataset_dir.glob("*.json"):
-            with open(json_file, "r", encoding="utf8") as ifp:
-                adm = Admission.from_json_dict(json.load(ifp))
-                if require_text and not adm._has_text():
-                    raise ValueError(
-                        f"Admission {adm.hadm_id} is missing note text. "
-                        f"Please run: python inject-note-text.py --noteevents NOTEEVENTS.csv --data-dir {dataset_dir}"
+    def iter_dir(
+        dataset_dir: Path,
+        require_text: bool = True,
+        hadm_id_filter: Optional[HadmIdFilter] = None,
+        category_filter: Optional[CategoryFilter] = None,
+        workers: int = 1,
+        note_texts: Optional[NoteTexts] = None,
+    ) -> Iterator[Admission]:
+        """Stream admissions from ``dataset_dir``
+
+        Files whose name identifies an hadm_id rejected by ``hadm_id_filter`` are not
+        opened, and notes rejected by ``category_filter`` are dropped while parsing.
+
+        With ``workers > 1`` files are parsed in a process pool (filters must be
+        picklable, e.g. ``set.__contains__``); admissions are still yielded in file
+        name order.
+
+        ``note_texts`` supplies the text of notes stored without it, so annotation files
+        can stay text-free; only the notes that survive filtering are looked up.
+        """
+        json_files = [
+            json_file
+            for json_file, hadm_id in index_dir(dataset_dir)
+            if hadm_id is None or hadm_id_filter is None or hadm_id_filter(hadm_id)
+        ]
+
+        load_fn = functools.partial(
+            Admission.from_json_file,
+            category_filter=category_filter,
+            note_texts=note_texts,
+        )
+
+        if workers > 1 and len(json_files) > 1:
+            with process_pool(workers) as pool:
+                chunksize = max(1, len(json_files) // (workers * 4))
+                yield from MDACEData._check_admissions(
+                    pool.map(load_fn, json_files, chunksize=chunksize),
+                    dataset_dir,
+                    require_text,
+                    hadm_id_filter,
+                )
+        else:
+            yield from MDACEData._check_admissions(
+                map(load_fn, json_files), dataset_dir, require_text, hadm_id_filter
+            )
+
+    @staticmethod
+    def _check_admissions(
+        admissions: Iterator[Admission],
+        dataset_dir: Path,
+        require_text: bool,
+        hadm_id_filter: Optional[HadmIdFilter],
+    ) -> Iterator[Admission]:
+        for adm in admissions:
+            if hadm_id_filter and not hadm_id_filter(adm.hadm_id):
+                continue
+
+            if require_text and not adm._has_text():
+                raise ValueError(
+                    f"Admission {adm.hadm_id} is missing note text. "
+                    f"Please run: python inject-note-text.py --noteevents NOTEEVENTS.csv --data-dir {dataset_dir} "
+                    f"or provide a note text store"
+                )
+            yield adm
+
+    @staticmethod
+    def from_dir(
+        dataset_dir: Path,
+        require_text: bool = True,
+        hadm_id_filter: Optional[HadmIdFilter] = None,
+        category_filter: Optional[CategoryFilter] = None,
+        workers: int = 1,
+        note_texts: Optional[NoteTexts] = None,
+    ) -> "MDACEData":
+        return MDACEData(
+            list(
+                MDACEData.iter_dir(
+                    dataset_dir,
+                    require_text=require_text,
+                    hadm_id_filter=hadm_id_filter,
+                    category_filter=category_filter,
+                    workers=workers,
+                    note_texts=note_texts,
+                )
+            )
+        )
+
+    def map_admissions(self, map_fn: Callable[[Admission], Admission]) -> "MDACEData":
+        return MDACEData(admissions=[map_fn(adm) for adm in self.admissions])
+
+    def __iter__(self) -> Iterator[Tuple[Admission, Note, Annotation]]:
+        """Iterate over Annotations; include information from Admission and Note"""
+        for admission in self.admissions:
+            for note, annotation in admission:
+                yield admission, note, annotation
+
+
+class LazyMDACEData(object):
+    """File backed counterpart of MDACEData
+
+    Admissions are parsed when iterated (or fetched with ``get``) and are not retained,
+    so memory use is bounded by a single admission rather than the whole corpus.
+    """
+
+    def __init__(
+        self,
+        dataset_dir: Path,
+        require_text: bool = True,
+        hadm_id_filter: Optional[HadmIdFilter] = None,
+        category_filter: Optional[CategoryFilter] = None,
+        transforms: Tuple[Callable[[Admission], Admission], ...] = (),
+        note_texts: Optional[NoteTexts] = None,
+    ):
+        self.dataset_dir = dataset_dir
+        self.require_text = require_text
+        self.hadm_id_filter = hadm_id_filter
+        self.category_filter = category_filter
+        self.transforms = transforms
+        self.note_texts = note_texts
+        self._files_by_hadm_id = None  # type: Optional[Dict[int, Path]]
+
+    @property
+    def admissions(self) -> Iterator[Admission]:
+        admissions = MDACEData.iter_dir(
+            self.dataset_dir,
+            require_text=self.require_text,
+            hadm_id_filter=self.hadm_id_filter,
+            category_filter=self.category_filter,
+            note_texts=self.note_texts,
+        )
+        for transform in self.transforms:
+            admissions = map(transform, admissions)
+        return admissions
+
+    def map_admissions(
+        self, map_fn: Callable[[Admission], Admission]
+    ) -> "LazyMDACEData":
+        """Return a new lazy dataset with ``map_fn`` applied to each admission"""
+        return LazyMDACEData(
+            self.dataset_dir,
+            self.require_text,
+            self.hadm_id_filter,
+            self.category_filter,
+            self.transforms + (map_fn,),
+            self.note_texts,
+        )
+
+    def _index(self) -> Dict[int, Path]:
+        if self._files_by_hadm_id is None:
+            files_by_hadm_id = dict()
+            for json_file, hadm_id in index_dir(self.dataset_dir):
+                if hadm_id is None:
+                    # file name does not tell us; peek inside
+                    hadm_id = Admission.from_json_file(json_file).hadm_id
+                files_by_hadm_id[hadm_id] = json_file
+            self._files_by_hadm_id = files_by_hadm_id
+        return self._files_by_hadm_id
+
+    def get(self, hadm_id: int, default=None) -> Optional[Admission]:
+        """Load a single admission, like ``dict.get``"""
+        json_file = self._index().get(hadm_id)
+        if json_file is None or (
+            self.hadm_id_filter is not None and not self.hadm_id_filter(hadm_id)
+        ):
+            return default
+
+        admissions = MDACEData._check_admissions(
+            iter(
+                [
+                    Admission.from_json_file(
+                        json_file, self.category_filter, self.note_texts
                     )
-                admissions.append(adm)
+                ]
+            ),
+            self.dataset_dir,
+            self.require_text,
+            self.hadm_id_filter,
+        )
+        for adm in admissions:
+            for transform in self.transforms:
+                adm = transform(adm)
+            return adm
+        return default
 
-        return MDACEData(admissions)
+    def items(self) -> Iterator[Tuple[int, Admission]]:
+        for adm in self.admissions:
+            yield adm.hadm_id, adm
 
     def __iter__(self) -> Iterator[Tuple[Admission, Note, Annotation]]:
         """Iterate over Annotations; include information from Admission and Note"""
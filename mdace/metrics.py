@@ -1,10 +1,36 @@
+import functools
 import logging
 from dataclasses import dataclass
+from itertools import repeat
 from pathlib import Path
-from typing import List, Callable, Hashable
-
-from mdace.data import Annotation, Span, Admission, Note
-from mdace.text import tokenize_admission
+from typing import (
+    Any,
+    List,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Optional,
+    Dict,
+    Set,
+    Tuple,
+    Sequence,
+    Union,
+)
+
+from mdace.chapters import code_chapter
+from mdace.data import Annotation, Span, Admission, Note, BillingCode
+from mdace.overlap import Interval, char_overlap, match_spans
+from mdace.profiling import stage
+from mdace.text import (
+    TokenizationCache,
+    TokenizedAdmission,
+    normalize,
+    note_token_cache,
+    offsets_tokenizer,
+    tokenize_admission,
+    tokenize_admission_offsets,
+)
 
 _logger = logging.getLogger(Path(__file__).name)
 
@@ -61,17 +87,26 @@ class ErrorRate:
         )
 
 
-def _count_unique_errors(
-    actual: Admission,
-    predicted: Admission,
-    key: Callable[[Note, Annotation], Hashable],
-) -> ErrorRate:
+KeyFn = Callable[[Note, Annotation], Hashable]
+
+
+def _unique_errors(
+    actual: Admission, predicted: Admission, key: KeyFn
+) -> Tuple[Set[Hashable], Set[Hashable], Set[Hashable]]:
+    """True positive, false positive and false negative keys"""
     actual_set = set(key(note, annotation) for note, annotation in actual)
     predicted_set = set(key(note, annotation) for note, annotation in predicted)
 
     tp = actual_set & predicted_set
     fp = predicted_set - actual_set
     fn = actual_set - predicted_set
+    return tp, fp, fn
+
+
+def _count_unique_errors(
+    actual: Admission, predicted: Admission, key: KeyFn
+) -> ErrorRate:
+    tp, fp, fn = _unique_errors(actual, predicted, key)
     return ErrorRate(
         true_positives=len(tp),
         false_positives=len(fp),
@@ -79,22 +114,20 @@ def _count_unique_errors(
     )
 
 
-def exact_match_error(actual: Admission, predicted: Admission) -> ErrorRate:
-    def key_fn(note: Note, anno: Annotation) -> Hashable:
-        return note.note_id, anno
+def exact_match_key(note: Note, anno: Annotation) -> Hashable:
+    return note.note_id, anno
 
-    return _count_unique_errors(actual, predicted, key_fn)
 
+def exact_match_error(actual: Admission, predicted: Admission) -> ErrorRate:
+    return _count_unique_errors(actual, predicted, exact_match_key)
 
-def normalize(text: str) -> str:
-    return text.lower()
 
+def position_independent_key(note: Note, anno: Annotation) -> Hashable:
+    return normalize(anno.span.covered_text), anno.billing_code
 
-def position_independent_error(actual: Admission, predicted: Admission) -> ErrorRate:
-    def key_fn(note: Note, anno: Annotation) -> Hashable:
-        return normalize(anno.span.covered_text), anno.billing_code
 
-    return _count_unique_errors(actual, predicted, key_fn)
+def position_independent_error(actual: Admission, predicted: Admission) -> ErrorRate:
+    return _count_unique_errors(actual, predicted, position_independent_key)
 
 
 def token_exact_match_error(
@@ -119,48 +152,604 @@ def token_position_independent_error(
     return position_independent_error(a_tokenized, p_tokenized)
 
 
-class AllErrorRates(object):
-    """Wrapper object for a bunch of error rates"""
+METRIC_TITLES = dict(
+    span_exact_match="Exact Span Match",
+    span_position_independent="Position-Independent Span Match",
+    token_exact_match="Exact Token Match",
+    token_position_independent="Position-Independent Token Match",
+)
+
+# opt-in, see AllErrorRates(overlap_metrics=True)
+OVERLAP_METRIC_TITLES = dict(
+    span_any_overlap="Any-Overlap Span Match",
+    span_iou_match="IoU Span Match",
+    char_overlap="Character Overlap",
+)
+
+ALL_METRIC_TITLES = dict(METRIC_TITLES, **OVERLAP_METRIC_TITLES)
+
+
+Errors = Tuple[Set[Hashable], Set[Hashable], Set[Hashable]]
+# (note_id, billing code) of a key; None for keys that are not tied to a note
+GroupFn = Callable[[Hashable], Tuple[Optional[int], BillingCode]]
+
+
+def _annotations_by_note(admission: Admission) -> List[Tuple[Note, List[Annotation]]]:
+    """Annotations per note, with covered_text filled in like ``Admission.__iter__``"""
+    notes = list()
+    for note, annotation in admission:
+        if not notes or notes[-1][0] is not note:
+            notes.append((note, list()))
+        notes[-1][1].append(annotation)
+    return notes
+
+
+# keys of one note, equivalent to exact_match_key/position_independent_key on the
+# (tokenized) admission. Token Annotations compare by begin, end (which equals begin,
+# see tokenize_annotation) and billing code only, so exact token keys are plain
+# tuples; position-independent token keys use the interned token id as text.
+def _span_exact_match_keys(
+    note: Note, annotations: List[Annotation]
+) -> Iterable[Hashable]:
+    return zip(repeat(note.note_id), annotations)
+
+
+def _span_position_independent_keys(
+    note: Note, annotations: List[Annotation]
+) -> Iterable[Hashable]:
+    return (
+        (normalize(anno.span.covered_text), anno.billing_code) for anno in annotations
+    )
+
+
+def _token_exact_match_keys(note: Note, tokenized: List) -> Iterable[Hashable]:
+    note_id = note.note_id
+    for anno, (begins, _, _) in tokenized:
+        yield from zip(repeat(note_id), begins, repeat(anno.billing_code))
+
+
+def _token_position_independent_keys(note: Note, tokenized: List) -> Iterable[Hashable]:
+    for anno, (_, _, token_ids) in tokenized:
+        yield from zip(token_ids, repeat(anno.billing_code))
+
+
+def _span_exact_match_group(key: Hashable) -> Tuple[Optional[int], BillingCode]:
+    return key[0], key[1].billing_code
+
+
+def _token_exact_match_group(key: Hashable) -> Tuple[Optional[int], BillingCode]:
+    return key[0], key[2]
+
+
+def _position_independent_group(key: Hashable) -> Tuple[Optional[int], BillingCode]:
+    return None, key[1]
+
+
+@dataclass(frozen=True)
+class MetricInputs:
+    """Both sides of one metric for one admission, as (note, payload) pairs
+
+    The payload of a note is its annotations for span metrics and the token offsets of
+    its annotations for token metrics; ``note_keys`` turns it into the metric's keys.
+    """
+
+    actual: List[Tuple[Note, Any]]
+    predicted: List[Tuple[Note, Any]]
+    note_keys: Callable[[Note, Any], Iterable[Hashable]]
+    group: GroupFn
+
+    def _keys(self, notes: List[Tuple[Note, Any]], by_category: bool) -> Set[Hashable]:
+        keys = set()
+        for note, payload in notes:
+            if by_category:
+                keys.update(zip(repeat(note.category), self.note_keys(note, payload)))
+            else:
+                keys.update(self.note_keys(note, payload))
+        return keys
+
+    def errors(self, by_category: bool = False) -> Errors:
+        """TP/FP/FN keys; with ``by_category`` keys are (note category, key) pairs"""
+        actual_set = self._keys(self.actual, by_category)
+        predicted_set = self._keys(self.predicted, by_category)
+        return (
+            actual_set & predicted_set,
+            predicted_set - actual_set,
+            actual_set - predicted_set,
+        )
+
+    def error_rate(self) -> ErrorRate:
+        return _error_rate(self.errors())
+
+
+def _by_billing_code(
+    annotations: List[Annotation],
+) -> Dict[BillingCode, List[Annotation]]:
+    # unique spans per code, like the keys of the exact span metric
+    by_code = dict()  # type: Dict[BillingCode, Dict[Annotation, None]]
+    for annotation in annotations:
+        by_code.setdefault(annotation.billing_code, dict())[annotation] = None
+    return {code: list(unique) for code, unique in by_code.items()}
+
+
+def _span_match_errors(
+    note_id: int,
+    actual: List[Annotation],
+    predicted: List[Annotation],
+    threshold: float,
+) -> Errors:
+    """Spans of the same code matched one-to-one by ``match_spans``
+
+    Keys are exact span keys: matched gold spans are TP, unmatched predicted spans FP
+    and unmatched gold spans FN.
+    """
+    tp, fp, fn = set(), set(), set()
+    a_by_code, p_by_code = _by_billing_code(actual), _by_billing_code(predicted)
+    for code in a_by_code.keys() | p_by_code.keys():
+        a_annos, p_annos = a_by_code.get(code, []), p_by_code.get(code, [])
+        pairs = match_spans(
+            [(anno.span.begin, anno.span.end) for anno in a_annos],
+            [(anno.span.begin, anno.span.end) for anno in p_annos],
+            threshold,
+        )
+        a_matched = {a_idx for a_idx, _ in pairs}
+        p_matched = {p_idx for _, p_idx in pairs}
+        for idx, anno in enumerate(a_annos):
+            (tp if idx in a_matched else fn).add((note_id, anno))
+        fp.update(
+            (note_id, anno) for idx, anno in enumerate(p_annos) if idx not in p_matched
+        )
+    return tp, fp, fn
+
+
+def _char_overlap_by_code(
+    actual: List[Annotation], predicted: List[Annotation]
+) -> Iterator[Tuple[BillingCode, Tuple[List[Interval], ...]]]:
+    """Disjoint TP/FP/FN character intervals (see ``char_overlap``) per code"""
+    a_by_code, p_by_code = _by_billing_code(actual), _by_billing_code(predicted)
+    for code in a_by_code.keys() | p_by_code.keys():
+        yield code, char_overlap(
+            [(anno.span.begin, anno.span.end) for anno in a_by_code.get(code, [])],
+            [(anno.span.begin, anno.span.end) for anno in p_by_code.get(code, [])],
+        )
+
+
+def _char_overlap_errors(
+    note_id: int, actual: List[Annotation], predicted: List[Annotation]
+) -> Errors:
+    """Characters covered per code; keys are (note_id, offset, billing code)"""
+    errors = set(), set(), set()
+    for code, overlap in _char_overlap_by_code(actual, predicted):
+        for keys, intervals in zip(errors, overlap):
+            for begin, end in intervals:
+                keys.update(zip(repeat(note_id), range(begin, end), repeat(code)))
+    return errors
+
+
+def _char_overlap_counts(
+    note_id: int, actual: List[Annotation], predicted: List[Annotation]
+) -> Tuple[int, int, int]:
+    """Number of keys of ``_char_overlap_errors``, from the interval lengths"""
+    counts = [0, 0, 0]
+    for _, overlap in _char_overlap_by_code(actual, predicted):
+        for idx, intervals in enumerate(overlap):
+            counts[idx] += sum(end - begin for begin, end in intervals)
+    return counts[0], counts[1], counts[2]
+
+
+@dataclass(frozen=True)
+class OverlapInputs:
+    """Like MetricInputs, for metrics that compare the spans of each note by overlap
+
+    ``note_errors(note_id, actual, predicted)`` returns the TP/FP/FN keys of a note,
+    and ``note_counts``, if given, the number of those keys without building them.
+    """
+
+    actual: List[Tuple[Note, List[Annotation]]]
+    predicted: List[Tuple[Note, List[Annotation]]]
+    note_errors: Callable[[int, List[Annotation], List[Annotation]], Errors]
+    group: GroupFn
+    note_counts: Optional[
+        Callable[[int, List[Annotation], List[Annotation]], Tuple[int, int, int]]
+    ] = None
+
+    def _notes(self) -> Dict[int, Tuple[Note, List[Annotation], List[Annotation]]]:
+        notes = (
+            dict()
+        )  # type: Dict[int, Tuple[Note, List[Annotation], List[Annotation]]]
+        for note, annotations in self.actual:
+            notes.setdefault(note.note_id, (note, [], []))[1].extend(annotations)
+        for note, annotations in self.predicted:
+            notes.setdefault(note.note_id, (note, [], []))[2].extend(annotations)
+        return notes
+
+    def error_rate(self) -> ErrorRate:
+        if self.note_counts is None:
+            return _error_rate(self.errors())
+        counts = [0, 0, 0]
+        for note_id, (_, actual, predicted) in self._notes().items():
+            for idx, count in enumerate(self.note_counts(note_id, actual, predicted)):
+                counts[idx] += count
+        return ErrorRate(*counts)
+
+    def errors(self, by_category: bool = False) -> Errors:
+        """TP/FP/FN keys; with ``by_category`` keys are (note category, key) pairs"""
+        errors = set(), set(), set()
+        for note_id, (note, actual, predicted) in self._notes().items():
+            for out, keys in zip(errors, self.note_errors(note_id, actual, predicted)):
+                if by_category:
+                    out.update(zip(repeat(note.category), keys))
+                else:
+                    out.update(keys)
+        return errors
+
+
+def _error_rate(errors: Errors) -> ErrorRate:
+    tp, fp, fn = errors
+    return ErrorRate(
+        true_positives=len(tp),
+        false_positives=len(fp),
+        false_negatives=len(fn),
+    )
+
+
+def breakdown_rows(
+    hadm_id: int, metric: str, errors: Errors, group: GroupFn
+) -> List[Dict]:
+    """TP/FP/FN counts of one metric and admission per note_id and billing code"""
+    counts = dict()  # type: Dict[Tuple[Optional[int], BillingCode], List[int]]
+    for idx, keys in enumerate(errors):
+        for key in keys:
+            counts.setdefault(group(key), [0, 0, 0])[idx] += 1
+
+    def sort_key(group):
+        note_id, billing_code = group
+        return (
+            note_id is not None,
+            note_id or 0,
+            billing_code.code_system,
+            billing_code.code,
+        )
+
+    return [
+        dict(
+            hadm_id=hadm_id,
+            note_id=note_id,
+            code=billing_code.code,
+            code_system=billing_code.code_system,
+            metric=metric,
+            true_positives=tp_count,
+            false_positives=fp_count,
+            false_negatives=fn_count,
+        )
+        for (note_id, billing_code), (tp_count, fp_count, fn_count) in sorted(
+            counts.items(), key=lambda item: sort_key(item[0])
+        )
+    ]
+
+
+GROUP_BYS = ("code", "chapter", "category")
 
-    def __init__(self, tokenize_fn: Callable[[str], List[Span]]):
+
+def _error_rate_row(label: str, error_rate: ErrorRate) -> str:
+    return (
+        f"| {label} |{error_rate.n_pred:^8d}|{error_rate.n_actual:^8d}"
+        f"|{error_rate.true_positives:^8d}|{error_rate.false_positives:^8d}"
+        f"|{error_rate.false_negatives:^8d}|{error_rate.precision:^8.1%}"
+        f"|{error_rate.recall:^8.1%}|{error_rate.f1_score:^8.1%}|"
+    )
+
+
+class GroupedErrorRates(object):
+    """Error rates of every metric per ICD code, code chapter and/or note category
+
+    Code and chapter groups partition the TP/FP/FN keys of each metric, so their micro
+    average equals the overall error rate. Category groups match scoring each note
+    category on its own (``--note-category``): position-independent keys are unique
+    per category rather than per admission.
+    """
+
+    def __init__(self, group_bys: Sequence[str] = GROUP_BYS, top_k: int = 10):
+        for group_by in group_bys:
+            if group_by not in GROUP_BYS:
+                raise ValueError(f"Unknown group_by={group_by}, expected {GROUP_BYS}")
+        self.group_bys = tuple(group_bys)
+        self.top_k = top_k
+        # group_by -> metric -> group -> [TP, FP, FN]
+        self.counts = {
+            group_by: {metric: dict() for metric in METRIC_TITLES}
+            for group_by in self.group_bys
+        }  # type: Dict[str, Dict[str, Dict[str, List[int]]]]
+
+    def observe(self, metric: str, inputs: MetricInputs, errors: Errors):
+        """Add the TP/FP/FN keys ``errors`` of one admission, computed from ``inputs``"""
+        for group_by in self.group_bys:
+            counts = self.counts[group_by].setdefault(metric, dict())
+            if group_by == "category":
+                for idx, keys in enumerate(inputs.errors(by_category=True)):
+                    for category, _ in keys:
+                        counts.setdefault(category, [0, 0, 0])[idx] += 1
+                continue
+
+            for idx, keys in enumerate(errors):
+                for group_key in keys:
+                    _, billing_code = inputs.group(group_key)
+                    if group_by == "code":
+                        group = billing_code.code
+                    else:
+                        group = code_chapter(billing_code)
+                    counts.setdefault(group, [0, 0, 0])[idx] += 1
+
+    def groups(self, group_by: str, metric: str) -> Dict[str, ErrorRate]:
+        return {
+            group: ErrorRate(*counts)
+            for group, counts in sorted(self.counts[group_by][metric].items())
+        }
+
+    def micro(self, group_by: str, metric: str) -> ErrorRate:
+        return sum(self.groups(group_by, metric).values(), ErrorRate())
+
+    def macro(self, group_by: str, metric: str) -> Tuple[float, float, float]:
+        """Unweighted mean precision, recall and F1 over all observed groups"""
+        groups = list(self.groups(group_by, metric).values())
+        if not groups:
+            return 0.0, 0.0, 0.0
+        return (
+            sum(error_rate.precision for error_rate in groups) / len(groups),
+            sum(error_rate.recall for error_rate in groups) / len(groups),
+            sum(error_rate.f1_score for error_rate in groups) / len(groups),
+        )
+
+    def worst(self, group_by: str, metric: str, k: int) -> List[Tuple[str, ErrorRate]]:
+        """``k`` groups with the lowest F1; ties go to the group with more gold annotations"""
+        return sorted(
+            self.groups(group_by, metric).items(),
+            key=lambda item: (item[1].f1_score, -item[1].n_actual, item[0]),
+        )[:k]
+
+    def __str__(self):
+        lines = list()
+        for group_by in self.group_bys:
+            title = f"Per {group_by.title()}"
+            lines.extend(
+                (
+                    "",
+                    title,
+                    "=" * len(title),
+                    "| Metric | #Groups | Micro Pr | Micro Rc | Micro F1 | Macro Pr | Macro Rc | Macro F1 |",
+                    "| ------ | ------- | -------- | -------- | -------- | -------- | -------- | -------- |",
+                )
+            )
+            for metric in self.counts[group_by]:
+                metric_title = ALL_METRIC_TITLES[metric]
+                micro = self.micro(group_by, metric)
+                macro = self.macro(group_by, metric)
+                values = (micro.precision, micro.recall, micro.f1_score) + macro
+                lines.append(
+                    f"| {metric_title} | {len(self.counts[group_by][metric]):,} | "
+                    + " | ".join(f"{value:.1%}" for value in values)
+                    + " |"
+                )
+
+            for metric in self.counts[group_by]:
+                metric_title = ALL_METRIC_TITLES[metric]
+                lines.extend(
+                    (
+                        "",
+                        f"{metric_title}: {self.top_k} Worst by F1",
+                        "",
+                        f"| {group_by.title()} |  #Prd  |  #Act  |   TP   |   FP   |   FN   |   Pr   |   Rc   |   F1   |",
+                        "| ------ | ------ | ------ | ------ | ------ | ------ | ------ | ------ | ------ |",
+                    )
+                )
+                lines.extend(
+                    _error_rate_row(group, error_rate)
+                    for group, error_rate in self.worst(group_by, metric, self.top_k)
+                )
+        return "\n".join(lines)
+
+
+class AllErrorRates(object):
+    """Wrapper object for a bunch of error rates
+
+    Each admission is tokenized once per ``observe`` and shared by both token metrics.
+    Tokens are kept as offset and token id arrays (see ``tokenize_offsets``) and the
+    token metrics key on those directly.
+    Pass a ``gold_token_cache`` to also reuse the tokenized gold admissions across
+    calls, e.g. when scoring several prediction sets against the same gold, and
+    ``grouped`` to also aggregate error rates per code/chapter/note category in the
+    same pass. With ``keep_per_admission`` the error rates of every admission are kept
+    in ``per_admission`` (by hadm_id), e.g. for bootstrapping.
+    With ``overlap_metrics`` the overlap metrics (OVERLAP_METRIC_TITLES) are added:
+    spans of the same code matched one-to-one on any overlap and on an IoU of at least
+    ``iou_threshold``, and the characters covered per code.
+    """
+
+    def __init__(
+        self,
+        tokenize_fn: Callable[[str], List[Span]],
+        gold_token_cache: Optional[TokenizationCache] = None,
+        grouped: Optional[GroupedErrorRates] = None,
+        keep_per_admission: bool = False,
+        overlap_metrics: bool = False,
+        iou_threshold: float = 0.5,
+    ):
         self.tokenize_fn = tokenize_fn
+        self.tokenize_offsets_fn = offsets_tokenizer(tokenize_fn)
+        self.gold_token_cache = gold_token_cache
+        # share tokenized notes with the gold cache, predictions are on the same notes
+        if gold_token_cache is not None:
+            self.note_tokens = gold_token_cache.note_tokens
+        else:
+            self.note_tokens = note_token_cache(tokenize_fn)
+        self.grouped = grouped
+        self.per_admission = (
+            dict() if keep_per_admission else None
+        )  # type: Optional[Dict[int, Dict[str, ErrorRate]]]
         self.error_rates = dict(
             span_exact_match=ErrorRate(),
             span_position_independent=ErrorRate(),
             token_exact_match=ErrorRate(),
             token_position_independent=ErrorRate(),
         )
+        self.overlap_metrics = overlap_metrics
+        self.iou_threshold = iou_threshold
+        if overlap_metrics:
+            self.error_rates.update(
+                (metric, ErrorRate()) for metric in OVERLAP_METRIC_TITLES
+            )
 
-    def observe(self, actual: Admission, predicted: Admission):
-        self.error_rates["span_exact_match"] += exact_match_error(actual, predicted)
-        self.error_rates["span_position_independent"] += position_independent_error(
-            actual, predicted
-        )
-        self.error_rates["token_exact_match"] += token_exact_match_error(
-            actual, predicted, self.tokenize_fn
+    def _tokenize(self, admission: Admission) -> TokenizedAdmission:
+        return tokenize_admission_offsets(
+            admission, self.tokenize_offsets_fn, self.note_tokens
         )
-        self.error_rates[
-            "token_position_independent"
-        ] += token_position_independent_error(actual, predicted, self.tokenize_fn)
+
+    def _metric_inputs(
+        self, actual: Admission, predicted: Admission
+    ) -> Dict[str, Union[MetricInputs, OverlapInputs]]:
+        if self.gold_token_cache is not None:
+            a_tokenized = self.gold_token_cache(actual)
+        else:
+            a_tokenized = self._tokenize(actual)
+        p_tokenized = self._tokenize(predicted)
+        a_spans = _annotations_by_note(actual)
+        p_spans = _annotations_by_note(predicted)
+
+        inputs = dict(
+            span_exact_match=MetricInputs(
+                a_spans, p_spans, _span_exact_match_keys, _span_exact_match_group
+            ),
+            span_position_independent=MetricInputs(
+                a_spans,
+                p_spans,
+                _span_position_independent_keys,
+                _position_independent_group,
+            ),
+            token_exact_match=MetricInputs(
+                a_tokenized,
+                p_tokenized,
+                _token_exact_match_keys,
+                _token_exact_match_group,
+            ),
+            token_position_independent=MetricInputs(
+                a_tokenized,
+                p_tokenized,
+                _token_position_independent_keys,
+                _position_independent_group,
+            ),
+        )  # type: Dict[str, Union[MetricInputs, OverlapInputs]]
+        if self.overlap_metrics:
+            inputs.update(
+                span_any_overlap=OverlapInputs(
+                    a_spans,
+                    p_spans,
+                    functools.partial(_span_match_errors, threshold=0.0),
+                    _span_exact_match_group,
+                ),
+                span_iou_match=OverlapInputs(
+                    a_spans,
+                    p_spans,
+                    functools.partial(_span_match_errors, threshold=self.iou_threshold),
+                    _span_exact_match_group,
+                ),
+                char_overlap=OverlapInputs(
+                    a_spans,
+                    p_spans,
+                    _char_overlap_errors,
+                    _token_exact_match_group,
+                    _char_overlap_counts,
+                ),
+            )
+        return inputs
+
+    def score(self, actual: Admission, predicted: Admission) -> Dict[str, ErrorRate]:
+        """Error rates of a single admission, without adding them to the totals"""
+        return {
+            name: inputs.error_rate()
+            for name, inputs in self._metric_inputs(actual, predicted).items()
+        }
+
+    def _observe_errors(
+        self, actual: Admission, predicted: Admission, breakdown: bool
+    ) -> Tuple[Dict[str, ErrorRate], List[Dict]]:
+        error_rates, rows = dict(), list()
+        with stage("observe"):
+            with stage("tokenize"):
+                metric_inputs = self._metric_inputs(actual, predicted)
+            for name, inputs in metric_inputs.items():
+                with stage(name):
+                    if not breakdown and self.grouped is None:
+                        # only the counts are needed, e.g. not every character
+                        error_rates[name] = inputs.error_rate()
+                        continue
+                    errors = inputs.errors()
+                    error_rates[name] = _error_rate(errors)
+                    if breakdown:
+                        rows.extend(
+                            breakdown_rows(actual.hadm_id, name, errors, inputs.group)
+                        )
+                    if self.grouped is not None:
+                        self.grouped.observe(name, inputs, errors)
+        self.add(error_rates, actual.hadm_id)
+        return error_rates, rows
+
+    def observe_breakdown(self, actual: Admission, predicted: Admission) -> List[Dict]:
+        """``observe`` and return the admission's breakdown by metric, note_id and billing code"""
+        _, rows = self._observe_errors(actual, predicted, breakdown=True)
+        return rows
+
+    def add(self, error_rates: Dict[str, ErrorRate], hadm_id: Optional[int] = None):
+        for name, error_rate in error_rates.items():
+            self.error_rates[name] += error_rate
+        if self.per_admission is not None and hadm_id is not None:
+            self.per_admission[hadm_id] = error_rates
+
+    def observe(self, actual: Admission, predicted: Admission) -> Dict[str, ErrorRate]:
+        error_rates, _ = self._observe_errors(actual, predicted, breakdown=False)
+        return error_rates
 
     def __str__(self):
-        return "\n".join(
-            (
-                "",
-                "Exact Span Match",
-                "================",
-                str(self.error_rates["span_exact_match"]),
-                "",
-                "Position-Independent Span Match",
-                "===============================",
-                str(self.error_rates["span_position_independent"]),
-                "",
-                "Exact Token Match",
-                "=================",
-                str(self.error_rates["token_exact_match"]),
-                "",
-                "Position-Independent Token Match",
-                "================================",
-                str(self.error_rates["token_position_independent"]),
+        if self.grouped is not None:
+            return "\n".join((error_rates_str(self.error_rates), str(self.grouped)))
+        return error_rates_str(self.error_rates)
+
+
+def error_rates_str(error_rates: Dict[str, ErrorRate]) -> str:
+    """Markdown table of every metric, under its title"""
+    lines = list()
+    for name, error_rate in error_rates.items():
+        title = ALL_METRIC_TITLES[name]
+        lines.extend(("", title, "=" * len(title), str(error_rate)))
+    return "\n".join(lines)
+
+
+def comparison_table(runs: Dict[str, AllErrorRates]) -> str:
+    """Markdown table with precision/recall/F1 of every metric, one row per run"""
+    # overlap metrics only when every run has them
+    metrics = [
+        metric
+        for metric in ALL_METRIC_TITLES
+        if all(metric in run.error_rates for run in runs.values())
+    ]
+    header = ["Run"] + [
+        f"{ALL_METRIC_TITLES[metric]} {stat}"
+        for metric in metrics
+        for stat in ("Pr", "Rc", "F1")
+    ]
+    lines = [
+        "| " + " | ".join(header) + " |",
+        "| " + " | ".join("------" for _ in header) + " |",
+    ]
+    for run_name, all_error_rates in runs.items():
+        cells = [run_name]
+        for metric in metrics:
+            error_rate = all_error_rates.error_rates[metric]
+            cells.extend(
+                f"{value:.1%}"
+                for value in (
+                    error_rate.precision,
+                    error_rate.recall,
+                    error_rate.f1_score,
+                )
             )
-        )
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+import bisect
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+_logger = logging.getLogger(Path(__file__).name)
+
+_MAGIC = b"MDACENTS"
+_HEADER = struct.Struct("=8sq")  # magic, number of notes (native byte order)
+_ITEMSIZE = array("q").itemsize
+
+
+class NoteTextStore(Mapping):
+    """Read-only, memory-mapped mapping from note_id (NOTEEVENTS ROW_ID) to note text
+
+    Layout of the file: header, sorted note_ids, begin offsets, end offsets (all int64)
+    followed by one UTF-8 blob with the text of every note. Opening a store only maps
+    the file; lookups are a binary search over the mapped note_ids plus a decode of
+    one slice of the blob, so only the notes that are actually used are read.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as ifp:
+            self._mmap = mmap.mmap(ifp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n_notes = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path} is not a note text store")
+
+        view = memoryview(self._mmap)
+        offset = _HEADER.size
+        arrays = list()
+        for _ in range(3):
+            end = offset + n_notes * _ITEMSIZE
+            arrays.append(view[offset:end].cast("q"))
+            offset = end
+        self._note_ids, self._begins, self._ends = arrays
+        self._blob_offset = offset
+
+    def _position(self, note_id: int) -> int:
+        idx = bisect.bisect_left(self._note_ids, note_id)
+        if idx < len(self._note_ids) and self._note_ids[idx] == note_id:
+            return idx
+        return -1
+
+    def __getitem__(self, note_id: int) -> str:
+        idx = self._position(note_id)
+        if idx < 0:
+            raise KeyError(note_id)
+        begin = self._blob_offset + self._begins[idx]
+        end = self._blob_offset + self._ends[idx]
+        return self._mmap[begin:end].decode("utf8")
+
+    def __contains__(self, note_id) -> bool:
+        return isinstance(note_id, int) and self._position(note_id) >= 0
+
+    def __len__(self) -> int:
+        return len(self._note_ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._note_ids)
+
+    def __reduce__(self):
+        # re-open (and re-map) in other processes instead of copying the text
+        return NoteTextStore, (self.path,)
+
+    def close(self):
+        for view in (self._note_ids, self._begins, self._ends):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> "NoteTextStore":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def build(path: Path, notes: Iterable[Tuple[int, str]]) -> "NoteTextStore":
+        """Write a store with the (note_id, text) pairs from ``notes`` and open it"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        note_ids, begins, ends = array("q"), array("q"), array("q")
+        with tempfile.TemporaryFile(dir=path.parent) as blob:
+            offset = 0
+            for note_id, text in notes:
+                encoded = text.encode("utf8")
+                blob.write(encoded)
+                note_ids.append(note_id)
+                begins.append(offset)
+                offset += len(encoded)
+                ends.append(offset)
+
+            # NOTEEVENTS is mostly, but not necessarily, sorted by ROW_ID
+            order = sorted(range(len(note_ids)), key=note_ids.__getitem__)
+            if len(set(note_ids)) != len(note_ids):
+                raise ValueError("Duplicate note_id; cannot build note text store")
+
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "wb") as ofp:
+                ofp.write(_HEADER.pack(_MAGIC, len(order)))
+                for column in (note_ids, begins, ends):
+                    array("q", (column[idx] for idx in order)).tofile(ofp)
+                blob.seek(0)
+                shutil.copyfileobj(blob, ofp)
+            os.replace(tmp_path, path)
+
+        _logger.info(f"Wrote {len(note_ids):,} notes ({offset:,} bytes) to {path}")
+        return NoteTextStore(path)
@@ -0,0 +1,133 @@
+"""
+Overlap between the spans of two annotators, without comparing all pairs.
+
+Spans are half-open [begin, end) character intervals; empty spans never overlap (but
+``match_spans`` matches identical ones).
+"""
+
+import heapq
+import logging
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+_logger = logging.getLogger(Path(__file__).name)
+
+Interval = Tuple[int, int]
+
+
+def overlapping_pairs(
+    actual: Sequence[Interval], predicted: Sequence[Interval]
+) -> Iterator[Tuple[int, int]]:
+    """(actual, predicted) positions of every pair of overlapping spans
+
+    One sweep over the spans of both sides in order of begin, keeping the spans that
+    are still open (in a heap by end): a span overlaps exactly the open spans of the
+    other side when it begins. O((n + m) log(n + m) + k) for k overlapping pairs.
+    """
+    spans = sorted(
+        (begin, end, side, idx)
+        for side, intervals in enumerate((actual, predicted))
+        for idx, (begin, end) in enumerate(intervals)
+        if end > begin
+    )
+    open_spans = (dict(), dict())  # type: Tuple[Dict[int, None], Dict[int, None]]
+    ends = list()  # type: List[Tuple[int, int, int]]
+    for begin, end, side, idx in spans:
+        while ends and ends[0][0] <= begin:
+            _, closed_side, closed_idx = heapq.heappop(ends)
+            del open_spans[closed_side][closed_idx]
+        for other in open_spans[1 - side]:
+            yield (other, idx) if side else (idx, other)
+        open_spans[side][idx] = None
+        heapq.heappush(ends, (end, side, idx))
+
+
+def iou(a: Interval, b: Interval) -> float:
+    """Intersection over union of two intervals"""
+    intersection = min(a[1], b[1]) - max(a[0], b[0])
+    if intersection <= 0:
+        return 0.0
+    return intersection / (max(a[1], b[1]) - min(a[0], b[0]))
+
+
+def match_spans(
+    actual: Sequence[Interval], predicted: Sequence[Interval], threshold: float = 0.0
+) -> List[Tuple[int, int]]:
+    """Greedy one-to-one matching of overlapping spans, highest IoU first
+
+    Returns (actual, predicted) positions of pairs that overlap with an IoU of at least
+    ``threshold``; with 0 any overlap matches. Empty spans (e.g. trimmed to nothing) only
+    match an identical span.
+    """
+    empty_actual = {
+        tuple(span): idx for idx, span in enumerate(actual) if span[1] <= span[0]
+    }
+    candidates = list()
+    for p_idx, p_span in enumerate(predicted):
+        if p_span[1] <= p_span[0]:
+            a_idx = empty_actual.get(tuple(p_span))
+            if a_idx is not None:
+                candidates.append((-1.0, a_idx, p_idx))
+    for a_idx, p_idx in overlapping_pairs(actual, predicted):
+        score = iou(actual[a_idx], predicted[p_idx])
+        if score >= threshold:
+            candidates.append((-score, a_idx, p_idx))
+    candidates.sort()
+
+    matched_actual, matched_predicted, pairs = set(), set(), list()
+    for _, a_idx, p_idx in candidates:
+        if a_idx in matched_actual or p_idx in matched_predicted:
+            continue
+        matched_actual.add(a_idx)
+        matched_predicted.add(p_idx)
+        pairs.append((a_idx, p_idx))
+    return pairs
+
+
+def merge_intervals(intervals: Sequence[Interval]) -> List[Interval]:
+    """Union of ``intervals`` as sorted, disjoint intervals"""
+    merged = list()  # type: List[Interval]
+    for begin, end in sorted(intervals):
+        if end <= begin:
+            continue
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def char_overlap(
+    actual: Sequence[Interval], predicted: Sequence[Interval]
+) -> Tuple[List[Interval], List[Interval], List[Interval]]:
+    """Characters covered by both, only ``predicted`` and only ``actual`` spans
+
+    One linear sweep over the merged (sorted, disjoint) spans of both sides.
+    """
+    events = list()
+    for side, intervals in enumerate((actual, predicted)):
+        for begin, end in merge_intervals(intervals):
+            events.append((begin, side, 1))
+            events.append((end, side, -1))
+    events.sort()
+    both, predicted_only, actual_only = list(), list(), list()
+    depth, position = [0, 0], None
+    for offset, side, delta in events:
+        if position is not None and offset > position:
+            if depth[0] and depth[1]:
+                out = both
+            elif depth[1]:
+                out = predicted_only
+            elif depth[0]:
+                out = actual_only
+            else:
+                out = None
+            if out is not None:
+                if out and out[-1][1] == position:
+                    out[-1] = (out[-1][0], offset)
+                else:
+                    out.append((position, offset))
+        depth[side] += delta
+        position = offset
+    return both, predicted_only, actual_only
@@ -0,0 +1,165 @@
+"""
+Preprocessing of admissions as a pipeline of stages.
+
+Each admission is streamed through every stage once; a stage returns the (new)
+admission or None to drop it. Stages record their wall time and how many admissions,
+notes and annotations they pass on. Admissions and notes are filtered (by hadm_id and
+note category) while they are loaded, before any stage, so excluded files and notes are
+never parsed.
+"""
+
+import dataclasses
+import functools
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from mdace.cleanup import clean_note, merge_adjacent_in_note, trim_annotations_in_note
+from mdace import profiling
+from mdace.data import Admission, Note
+
+_logger = logging.getLogger(Path(__file__).name)
+
+
+@dataclass()
+class StageStats:
+    name: str
+    seconds: float = 0.0
+    admissions_in: int = 0
+    admissions_out: int = 0
+    notes_out: int = 0
+    annotations_out: int = 0
+
+    def count(self, admission: Optional[Admission]):
+        self.admissions_in += 1
+        if admission is not None:
+            self.admissions_out += 1
+            self.notes_out += len(admission.notes)
+            self.annotations_out += sum(
+                len(note.annotations) for note in admission.notes
+            )
+
+
+class Stage(object):
+    """Transform or drop (return None) one admission"""
+
+    name = "stage"
+
+    def __call__(self, admission: Admission) -> Optional[Admission]:
+        raise NotImplementedError
+
+
+class NoteStage(Stage):
+    """Apply ``note_fn`` to every note"""
+
+    def __init__(self, name: str, note_fn: Callable[[Note], Note]):
+        self.name = name
+        self.note_fn = note_fn
+
+    def __call__(self, admission: Admission) -> Optional[Admission]:
+        return dataclasses.replace(
+            admission, notes=[self.note_fn(note) for note in admission.notes]
+        )
+
+
+def _merge_adjacent_stage() -> Stage:
+    return NoteStage("merge-adjacent", merge_adjacent_in_note)
+
+
+def _trim_stage() -> Stage:
+    return NoteStage("trim", trim_annotations_in_note)
+
+
+# stages that can be selected by name, e.g. with --stages
+STAGES = {
+    "merge-adjacent": _merge_adjacent_stage,
+    "trim": _trim_stage,
+}  # type: Dict[str, Callable[[], Stage]]
+
+
+def stage_names(merge_adjacent: bool, trim_annos: bool) -> List[str]:
+    """Stages of the --merge-adjacent and --trim-annotations options"""
+    return ["merge-adjacent"] * merge_adjacent + ["trim"] * trim_annos
+
+
+class Pipeline(object):
+    """Run admissions through ``stages`` one admission at a time
+
+    ``run`` also times the iterator it reads from, as the "load" stage, and logs the
+    stats once the admissions are exhausted. Pipelines are plain callables too, e.g. as
+    a ``LazyMDACEData`` transform; call ``log_stats`` when done.
+    """
+
+    def __init__(self, stages: Sequence[Stage], name: str = "pipeline"):
+        self.stages = list(stages)
+        self.name = name
+        self.load_stats = StageStats("load")
+        self.stats = [StageStats(stage.name) for stage in self.stages]
+
+    @staticmethod
+    def from_names(names: Sequence[str], name: str = "pipeline") -> "Pipeline":
+        """Stages from STAGES; merge-adjacent directly followed by trim runs fused"""
+        stages, idx = list(), 0
+        while idx < len(names):
+            if names[idx] not in STAGES:
+                raise ValueError(
+                    f"Unknown stage {names[idx]!r}, expected one of {', '.join(STAGES)}"
+                )
+            if names[idx : idx + 2] == ["merge-adjacent", "trim"]:
+                stages.append(
+                    NoteStage(
+                        "merge-adjacent+trim",
+                        functools.partial(clean_note, merge_adjacent=True, trim=True),
+                    )
+                )
+                idx += 2
+            else:
+                stages.append(STAGES[names[idx]]())
+                idx += 1
+        return Pipeline(stages, name)
+
+    def __call__(self, admission: Admission) -> Optional[Admission]:
+        for stage, stats in zip(self.stages, self.stats):
+            start = time.perf_counter()
+            with profiling.stage(stage.name):
+                admission = stage(admission)
+            stats.seconds += time.perf_counter() - start
+            stats.count(admission)
+            if admission is None:
+                break
+        return admission
+
+    def run(self, admissions: Iterable[Admission]) -> Iterator[Admission]:
+        admissions = iter(admissions)
+        while True:
+            start = time.perf_counter()
+            with profiling.stage("load"):
+                admission = next(admissions, None)
+            self.load_stats.seconds += time.perf_counter() - start
+            if admission is None:
+                break
+            self.load_stats.count(admission)
+            admission = self(admission)
+            if admission is not None:
+                yield admission
+        self.log_stats()
+
+    def __str__(self):
+        lines = [
+            f"| {self.name} | Seconds | Admissions in | Admissions out | Notes | Annotations |",
+            "| ------ | ------ | ------ | ------ | ------ | ------ |",
+        ]
+        for stats in [self.load_stats] + self.stats:
+            if stats is self.load_stats and not stats.admissions_in:
+                # used as a transform, loading is not timed
+                continue
+            lines.append(
+                f"| {stats.name} | {stats.seconds:.3f} | {stats.admissions_in:,} "
+                f"| {stats.admissions_out:,} | {stats.notes_out:,} | {stats.annotations_out:,} |"
+            )
+        return "\n".join(lines)
+
+    def log_stats(self):
+        _logger.info(f"Preprocessing\n{self}")
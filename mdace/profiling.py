@@ -0,0 +1,188 @@
+"""
+Stage-level profiling.
+
+Code marks its stages with ``with stage(name):``; nested stages are named by their
+path, e.g. "observe/tokenize". While a Profiler is active (see ``profiling``) every
+stage records its calls, wall time, peak RSS, how much it raised the peak RSS and the
+net number of memory blocks it allocated (``sys.getallocatedblocks``). Otherwise
+``stage`` is a no-op.
+
+The active profiler is held in a context variable: threads see it when they run in a
+copy of the context (``contextvars.copy_context().run``), worker processes do not.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import ContextManager, Dict, Iterator, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows: no peak RSS
+    resource = None
+
+_logger = logging.getLogger(Path(__file__).name)
+
+_PROFILER = contextvars.ContextVar(
+    "profiler", default=None
+)  # type: contextvars.ContextVar[Optional[Profiler]]
+_STAGE_PATH = contextvars.ContextVar("stage_path", default="")
+_NO_STAGE = contextlib.nullcontext()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@dataclass()
+class StageProfile:
+    name: str
+    calls: int = 0
+    seconds: float = 0.0
+    peak_rss_mb: Optional[float] = None
+    peak_rss_growth_mb: float = 0.0
+    allocated_blocks: int = 0
+
+
+class Profiler(object):
+    """Profiles of the stages run while it is active, by stage path
+
+    With ``cprofile_stage`` (a stage path, or the name of a stage at any depth) calls
+    within that stage are also recorded by cProfile, see ``dump_cprofile``.
+    """
+
+    def __init__(self, cprofile_stage: Optional[str] = None):
+        self.stages = dict()  # type: Dict[str, StageProfile]
+        self.cprofile_stage = cprofile_stage
+        self.cprofile = cProfile.Profile() if cprofile_stage else None
+        self.seconds = 0.0
+        self._cprofile_depth = 0
+        self._lock = threading.Lock()
+
+    def _cprofiled(self, path: str) -> bool:
+        return self.cprofile is not None and self.cprofile_stage in (
+            path,
+            path.rpartition("/")[2],
+        )
+
+    def _toggle_cprofile(self, delta: int):
+        with self._lock:
+            self._cprofile_depth += delta
+            if delta > 0 and self._cprofile_depth == 1:
+                self.cprofile.enable()
+            elif delta < 0 and self._cprofile_depth == 0:
+                self.cprofile.disable()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        parent = _STAGE_PATH.get()
+        path = f"{parent}/{name}" if parent else name
+        token = _STAGE_PATH.set(path)
+        with self._lock:
+            # listed in the order stages are entered, parents before their children
+            profile = self.stages.get(path)
+            if profile is None:
+                profile = self.stages[path] = StageProfile(path)
+        cprofiled = self._cprofiled(path)
+        if cprofiled:
+            self._toggle_cprofile(1)
+        rss, blocks = peak_rss_mb(), sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            blocks = sys.getallocatedblocks() - blocks
+            peak = peak_rss_mb()
+            if cprofiled:
+                self._toggle_cprofile(-1)
+            _STAGE_PATH.reset(token)
+            with self._lock:
+                profile.calls += 1
+                profile.seconds += seconds
+                profile.allocated_blocks += blocks
+                if peak is not None:
+                    profile.peak_rss_mb = max(profile.peak_rss_mb or 0.0, peak)
+                    profile.peak_rss_growth_mb += peak - rss
+
+    def report(self) -> Dict:
+        """Machine-readable report of all stages"""
+        return dict(
+            seconds=self.seconds,
+            peak_rss_mb=peak_rss_mb(),
+            python=platform.python_version(),
+            argv=sys.argv,
+            cprofile_stage=self.cprofile_stage,
+            stages=[asdict(profile) for profile in self.stages.values()],
+        )
+
+    def write_report(self, report_out: Path):
+        report_out.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_out, "w") as ofp:
+            json.dump(self.report(), ofp, indent=2)
+
+    def dump_cprofile(self, pstats_out: Path):
+        """Write the cProfile stats of ``cprofile_stage`` (e.g. for pstats or snakeviz)"""
+        pstats_out.parent.mkdir(parents=True, exist_ok=True)
+        self.cprofile.dump_stats(str(pstats_out))
+
+    def __str__(self):
+        lines = [
+            "| Stage | Calls | Seconds | Peak RSS (MB) | RSS growth (MB) | Allocated blocks |",
+            "| ------ | ------ | ------ | ------ | ------ | ------ |",
+        ]
+        for profile in self.stages.values():
+            peak = "" if profile.peak_rss_mb is None else f"{profile.peak_rss_mb:,.0f}"
+            lines.append(
+                f"| {profile.name} | {profile.calls:,} | {profile.seconds:.3f} | {peak} "
+                f"| {profile.peak_rss_growth_mb:,.1f} | {profile.allocated_blocks:,} |"
+            )
+        return "\n".join(lines)
+
+
+def stage(name: str) -> ContextManager[None]:
+    """Profile the enclosed code as stage ``name`` of the active profiler, if any"""
+    profiler = _PROFILER.get()
+    if profiler is None:
+        return _NO_STAGE
+    return profiler.stage(name)
+
+
+@contextlib.contextmanager
+def profiling(
+    report_out: Optional[Path] = None,
+    cprofile_stage: Optional[str] = None,
+    pstats_out: Optional[Path] = None,
+) -> Iterator[Profiler]:
+    """Activate a Profiler for the enclosed code
+
+    When done the stage profiles are logged and written to ``report_out`` as JSON, and
+    the cProfile stats of ``cprofile_stage`` to ``pstats_out``, if given.
+    """
+    profiler = Profiler(cprofile_stage)
+    token = _PROFILER.set(profiler)
+    start = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.seconds = time.perf_counter() - start
+        _PROFILER.reset(token)
+        _logger.info(f"Profile ({profiler.seconds:.3f}s)\n{profiler}")
+        if report_out is not None:
+            profiler.write_report(report_out)
+        if pstats_out is not None and profiler.cprofile is not None:
+            profiler.dump_cprofile(pstats_out)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from mdace.data import index_dir
+from mdace.metrics import ErrorRate
+
+_logger = logging.getLogger(Path(__file__).name)
+
+# bump when a change to loading, preprocessing or the metrics changes per-admission results
+RESULTS_VERSION = 1
+
+
+class ResultCache(object):
+    """Per-admission error rates in a SQLite database, keyed by ``admission_keys``
+
+    Values are the ``{metric: ErrorRate}`` dicts returned by ``AllErrorRates.score``.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=60)
+        # allow concurrent readers while another evaluation writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, error_rates TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, ErrorRate]]:
+        keys = list(keys)
+        found = dict()
+        # stay below SQLite's limit on the number of host parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows = self._conn.execute(
+                f"SELECT key, error_rates FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for key, value in rows:
+                found[key] = {
+                    name: ErrorRate(*counts)
+                    for name, counts in json.loads(value).items()
+                }
+        return found
+
+    def put_many(self, results: Dict[str, Dict[str, ErrorRate]]):
+        rows = [
+            (
+                key,
+                json.dumps(
+                    {
+                        name: (
+                            error_rate.true_positives,
+                            error_rate.false_positives,
+                            error_rate.false_negatives,
+                        )
+                        for name, error_rate in error_rates.items()
+                    }
+                ),
+            )
+            for key, error_rates in results.items()
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (key, error_rates) VALUES (?, ?)", rows
+            )
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self) -> "ResultCache":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def settings_digest(
+    target_categories: Optional[List[str]],
+    merge_adjacent: bool,
+    trim_annos: bool,
+    tokenizer: str,
+    note_store: Optional[Path] = None,
+    iou_threshold: Optional[float] = None,
+    stages: Optional[List[str]] = None,
+) -> str:
+    """Hash of everything besides the JSON files that changes per-admission results"""
+    note_store_id = None
+    if note_store:
+        stat = os.stat(note_store)
+        note_store_id = (
+            str(Path(note_store).absolute()),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    settings = dict(
+        version=RESULTS_VERSION,
+        target_categories=sorted(target_categories or []),
+        merge_adjacent=merge_adjacent,
+        trim_annos=trim_annos,
+        tokenizer=tokenizer,
+        note_store=note_store_id,
+    )
+    if iou_threshold is not None:
+        # overlap metrics, see AllErrorRates(overlap_metrics=True)
+        settings["iou_threshold"] = iou_threshold
+    if stages is not None:
+        # explicit preprocessing stages (--stages), in order
+        settings["stages"] = list(stages)
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def _file_digest(json_file: Path) -> str:
+    with open(json_file, "rb") as ifp:
+        return hashlib.sha256(ifp.read()).hexdigest()
+
+
+def file_digests(
+    dataset_dir: Path, hadm_ids: Set[int]
+) -> Tuple[Dict[int, List[str]], List[str]]:
+    """Content hashes of the files of each admission in ``hadm_ids``
+
+    Files whose hadm_id cannot be read from the name may hold any admission; their
+    hashes are returned separately.
+    """
+    by_hadm_id, shared = defaultdict(list), list()
+    for json_file, hadm_id in index_dir(dataset_dir):
+        if hadm_id is None:
+            shared.append(_file_digest(json_file))
+        elif hadm_id in hadm_ids:
+            by_hadm_id[hadm_id].append(_file_digest(json_file))
+    return by_hadm_id, shared
+
+
+def admission_keys(
+    gold_dir: Path, predictions_dir: Path, hadm_ids: Set[int], settings: str
+) -> Optional[Dict[int, str]]:
+    """Cache key of every gold admission in ``hadm_ids``
+
+    A key changes whenever the gold or predicted files of the admission or the
+    ``settings`` change. Returns None when gold admissions cannot be told apart by
+    file name.
+    """
+    gold, gold_shared = file_digests(gold_dir, hadm_ids)
+    if gold_shared:
+        return None
+    predicted, predicted_shared = file_digests(predictions_dir, hadm_ids)
+
+    keys = dict()
+    for hadm_id, gold_digests in gold.items():
+        digest = hashlib.sha256(f"{settings}\n{hadm_id}\n".encode())
+        for part in (gold_digests, predicted.get(hadm_id, []), predicted_shared):
+            digest.update((",".join(part) + "\n").encode())
+        keys[hadm_id] = digest.hexdigest()
+    return keys
@@ -0,0 +1,304 @@
+"""
+Synthetic MDACE-like corpora, e.g. for benchmarks and CI where MIMIC-III text is not
+available.
+
+Admissions are written in the schema of ``data/`` (with note text included), and a
+matching prediction tree is derived from the gold annotations. Defaults roughly follow
+Inpatient ICD-9 (302 admissions, ~2 notes per admission, ~6.5 evidence spans per note
+of ~16 characters, ~900 distinct codes).
+"""
+
+import dataclasses
+import json
+import logging
+import random
+from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+_logger = logging.getLogger(Path(__file__).name)
+
+_GOLD_TYPE = "MapType.APPROX"
+_PREDICTED_TYPE = "synthetic"
+_SEPARATORS = (" ",) * 20 + (", ", ". ", ": ", "\n", " - ", " (", ") ", "/")
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    n_admissions: int = 302
+    notes_per_admission: float = 2.0
+    note_chars: int = 8000
+    annotations_per_note: float = 6.5
+    # mean words per evidence span
+    span_words: float = 2.0
+    # chance that an annotation overlaps the previous one / directly follows it (with
+    # only punctuation or white space in between) with the same code
+    overlap_rate: float = 0.05
+    adjacent_rate: float = 0.1
+    n_codes: int = 900
+    codes_per_admission: float = 11.0
+    # Zipf exponent of code frequencies
+    code_skew: float = 1.1
+    code_system: str = "ICD-9-CM"
+    categories: Tuple[Tuple[str, float], ...] = (
+        ("Discharge summary", 0.53),
+        ("Physician", 0.36),
+        ("Radiology", 0.06),
+        ("General", 0.03),
+        ("Respiratory", 0.02),
+    )
+    # chance that non-ASCII characters are used within a word
+    non_ascii_rate: float = 0.001
+    # predictions: share of gold spans found, chance that a found span boundary is off
+    # by a word, spurious spans per note
+    recall: float = 0.6
+    jitter: float = 0.3
+    false_positives_per_note: float = 8.0
+    seed: int = 0
+
+    def scaled(self, scale: float) -> "SyntheticConfig":
+        """Same corpus with ``scale`` times as many admissions"""
+        return dataclasses.replace(
+            self, n_admissions=max(1, round(self.n_admissions * scale))
+        )
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    # Knuth; fine for the small means used here
+    limit, k, p = pow(2.718281828459045, -mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def _zipf_cum_weights(n: int, skew: float) -> List[float]:
+    return list(accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+class _Vocabulary(object):
+    """Codes (with descriptions) and words shared by all admissions of a corpus"""
+
+    def __init__(self, config: SyntheticConfig):
+        rng = random.Random(f"{config.seed}-vocabulary")
+        codes = dict()  # type: Dict[str, str]
+        while len(codes) < config.n_codes:
+            kind = rng.random()
+            if kind < 0.85:
+                code = f"{rng.randint(1, 999):03d}.{rng.randint(0, 99):0{rng.randint(1, 2)}d}"
+            elif kind < 0.95:
+                code = f"V{rng.randint(1, 91):02d}.{rng.randint(0, 9)}"
+            else:
+                code = f"E{rng.randint(800, 999)}.{rng.randint(0, 9)}"
+            codes.setdefault(code, f"Synthetic condition {len(codes)}")
+        self.codes = list(codes.items())
+        self.code_weights = _zipf_cum_weights(len(self.codes), config.code_skew)
+
+        syllables = [a + b for a in "bcdfghlmnprstv" for b in "aeiouy"]
+        words = set()
+        while len(words) < 5000:
+            words.add("".join(rng.choices(syllables, k=rng.randint(1, 4))))
+        self.words = sorted(words) + [str(number) for number in range(100)]
+        rng.shuffle(self.words)
+        self.word_weights = _zipf_cum_weights(len(self.words), 1.0)
+
+        self.categories = [category for category, _ in config.categories]
+        self.category_weights = list(
+            accumulate(weight for _, weight in config.categories)
+        )
+
+
+def _note_text(
+    rng: random.Random, vocabulary: _Vocabulary, config: SyntheticConfig
+) -> Tuple[str, List[Tuple[int, int]]]:
+    """Note text and the (begin, end) offsets of its words"""
+    n_chars = max(200, int(rng.gauss(config.note_chars, config.note_chars / 3)))
+    parts, words, offset = list(), list(), 0
+    while offset < n_chars:
+        word = rng.choices(vocabulary.words, cum_weights=vocabulary.word_weights)[0]
+        if rng.random() < 0.1:
+            word = word.capitalize()
+        if rng.random() < config.non_ascii_rate:
+            word += rng.choice("éü°±")
+        words.append((offset, offset + len(word)))
+        separator = rng.choice(_SEPARATORS)
+        parts.extend((word, separator))
+        offset += len(word) + len(separator)
+    return "".join(parts), words
+
+
+def _span(
+    rng: random.Random,
+    words: List[Tuple[int, int]],
+    first: int,
+    config: SyntheticConfig,
+) -> Tuple[int, int, int]:
+    """(first word, last word, end offset) of a span starting at word ``first``"""
+    n_words = 1 + _poisson(rng, config.span_words - 1)
+    last = min(len(words) - 1, first + n_words - 1)
+    return first, last, words[last][1]
+
+
+def _annotation(
+    begin: int, end: int, code: Tuple[str, str], code_system: str, gold: bool
+):
+    annotation = dict(begin=begin, end=end, code=code[0], code_system=code_system)
+    if gold:
+        annotation["description"] = code[1]
+        annotation["type"] = _GOLD_TYPE
+    else:
+        annotation["type"] = _PREDICTED_TYPE
+    return annotation
+
+
+def _gold_annotations(
+    rng: random.Random,
+    words: List[Tuple[int, int]],
+    codes: Sequence[Tuple[str, str]],
+    config: SyntheticConfig,
+) -> List[Tuple[int, int, Tuple[str, str]]]:
+    """(first word, last word, code) of the evidence spans of a note"""
+    spans = list()
+    for _ in range(_poisson(rng, config.annotations_per_note)):
+        draw = rng.random()
+        if spans and draw < config.overlap_rate:
+            previous = spans[-1]
+            first = rng.randint(previous[0], previous[1])
+            code = rng.choice(codes)
+        elif spans and draw < config.overlap_rate + config.adjacent_rate:
+            previous = spans[-1]
+            first = min(len(words) - 1, previous[1] + 1)
+            code = previous[2]
+        else:
+            first = rng.randrange(len(words))
+            code = rng.choice(codes)
+        first, last, _ = _span(rng, words, first, config)
+        spans.append((first, last, code))
+    return spans
+
+
+def _predicted_annotations(
+    rng: random.Random,
+    words: List[Tuple[int, int]],
+    gold: List[Tuple[int, int, Tuple[str, str]]],
+    codes: Sequence[Tuple[str, str]],
+    config: SyntheticConfig,
+) -> List[Tuple[int, int, Tuple[str, str]]]:
+    spans = list()
+    for first, last, code in gold:
+        if rng.random() >= config.recall:
+            continue
+        if rng.random() < config.jitter:
+            first = min(max(0, first + rng.choice((-1, 1))), last)
+        if rng.random() < config.jitter:
+            last = max(first, min(len(words) - 1, last + rng.choice((-1, 1))))
+        spans.append((first, last, code))
+    for _ in range(_poisson(rng, config.false_positives_per_note)):
+        first, last, _ = _span(rng, words, rng.randrange(len(words)), config)
+        spans.append((first, last, rng.choice(codes)))
+    return sorted(spans, key=lambda span: (span[0], span[1]))
+
+
+def generate_admission(
+    idx: int, vocabulary: _Vocabulary, config: SyntheticConfig
+) -> Tuple[Dict, Dict]:
+    """Gold and predicted JSON dicts of the ``idx``-th admission
+
+    Each admission has its own random state, so a corpus is a prefix of any larger
+    corpus with the same config.
+    """
+    rng = random.Random(f"{config.seed}-{idx}")
+    hadm_id, note_id = 100_000 + idx, 1_000_000 + idx * 100
+    n_codes = max(1, _poisson(rng, config.codes_per_admission))
+    codes = rng.choices(
+        vocabulary.codes, cum_weights=vocabulary.code_weights, k=n_codes
+    )
+
+    gold_notes, predicted_notes = list(), list()
+    for note_idx in range(1 + _poisson(rng, config.notes_per_admission - 1)):
+        text, words = _note_text(rng, vocabulary, config)
+        note = dict(
+            note_id=note_id + note_idx,
+            category=rng.choices(
+                vocabulary.categories, cum_weights=vocabulary.category_weights
+            )[0],
+            description="Report",
+            text=text,
+        )
+        gold = _gold_annotations(rng, words, codes, config)
+        predicted = _predicted_annotations(rng, words, gold, codes, config)
+        for notes, spans, is_gold in (
+            (gold_notes, gold, True),
+            (predicted_notes, predicted, False),
+        ):
+            notes.append(
+                dict(
+                    note,
+                    annotations=[
+                        _annotation(
+                            words[first][0],
+                            words[last][1],
+                            code,
+                            config.code_system,
+                            is_gold,
+                        )
+                        for first, last, code in spans
+                    ],
+                )
+            )
+
+    return (
+        dict(hadm_id=hadm_id, comment="", notes=gold_notes),
+        dict(hadm_id=hadm_id, comment="", notes=predicted_notes),
+    )
+
+
+def generate(config: SyntheticConfig) -> Iterator[Tuple[Dict, Dict]]:
+    """Gold and predicted JSON dicts of every admission"""
+    vocabulary = _Vocabulary(config)
+    for idx in range(config.n_admissions):
+        yield generate_admission(idx, vocabulary, config)
+
+
+def _code_system_suffix(code_system: str) -> str:
+    # file names like data/: <hadm_id>-ICD-9.json
+    return (
+        code_system.rsplit("-", 1)[0] if code_system.startswith("ICD") else code_system
+    )
+
+
+def write_corpus(out_dir: Path, config: SyntheticConfig) -> Tuple[Path, Path, Path]:
+    """Write ``gold/``, ``predictions/`` and a split file (all hadm_ids) to ``out_dir``
+
+    ``config.json`` records the config the corpus was generated with.
+    """
+    gold_dir, predictions_dir = out_dir / "gold", out_dir / "predictions"
+    split_file = out_dir / "split.csv"
+    for path in (gold_dir, predictions_dir):
+        path.mkdir(parents=True, exist_ok=True)
+        for json_file in path.glob("*.json"):
+            json_file.unlink()
+
+    suffix = _code_system_suffix(config.code_system)
+    with open(split_file, "w") as split_ofp:
+        print("HADM_ID", file=split_ofp)
+        for gold, predicted in generate(config):
+            file_name = f"{gold['hadm_id']}-{suffix}.json"
+            for path, data in ((gold_dir, gold), (predictions_dir, predicted)):
+                with open(path / file_name, "w", encoding="utf8") as ofp:
+                    json.dump(data, ofp)
+            print(gold["hadm_id"], file=split_ofp)
+
+    with open(out_dir / "config.json", "w") as ofp:
+        json.dump(dataclasses.asdict(config), ofp, indent=2)
+    _logger.info(f"Wrote {config.n_admissions:,} synthetic admissions to {out_dir}")
+    return gold_dir, predictions_dir, split_file
+
+
+def read_config(out_dir: Path) -> SyntheticConfig:
+    """Config of a corpus written by ``write_corpus``"""
+    with open(out_dir / "config.json") as ifp:
+        data = json.load(ifp)
+    data["categories"] = tuple(tuple(category) for category in data["categories"])
+    return SyntheticConfig(**data)
@@ -1,8 +1,16 @@
+import bisect
 import dataclasses
+import logging
 import re
-from typing import List, Callable
+from array import array
+from collections import OrderedDict
+from itertools import compress
+from pathlib import Path
+from typing import List, Callable, Dict, Tuple, Optional
 
-from mdace.data import Span, Annotation, Admission
+from mdace.data import Span, Annotation, Admission, Note
+
+_logger = logging.getLogger(Path(__file__).name)
 
 TOKEN_PATTERN = re.compile(r"\w+", flags=re.UNICODE | re.MULTILINE | re.DOTALL)
 
@@ -25,10 +33,322 @@ def tokenize(text: str) -> List[Span]:
     return spans
 
 
+def normalize(text: str) -> str:
+    return text.lower()
+
+
+class TokenVocabulary(object):
+    """Intern token strings to dense integer ids"""
+
+    def __init__(self):
+        self.ids = dict()  # type: Dict[str, int]
+        self._tokens = list()  # type: List[str]
+
+    def __call__(self, token: str) -> int:
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self._tokens)
+            self._tokens.append(token)
+        return token_id
+
+    def token(self, token_id: int) -> str:
+        return self._tokens[token_id]
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+# shared by all offset tokenizers in a process, so token ids are comparable
+VOCABULARY = TokenVocabulary()
+
+# begin offsets, end offsets and token ids (see tokenize_offsets)
+TokenOffsets = Tuple[array, array, array]
+
+
+def tokenize_offsets(
+    text: str, vocabulary: TokenVocabulary = VOCABULARY
+) -> TokenOffsets:
+    """``tokenize`` without a Span per token
+
+    Numbers > 10 are dropped in the same pass and token text is interned with
+    ``vocabulary``.
+    """
+    begins, ends, token_ids = array("q"), array("q"), array("q")
+    get_id = vocabulary.ids.get
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token.isdigit() and int(token) > 10:
+            continue
+        token_id = get_id(token)
+        if token_id is None:
+            token_id = vocabulary(token)
+        begin, end = match.span()
+        begins.append(begin)
+        ends.append(end)
+        token_ids.append(token_id)
+    return begins, ends, token_ids
+
+
+class SpanOffsetTokenizer(object):
+    """Offset tokenizer (see ``tokenize_offsets``) for a tokenizer that returns Spans
+
+    Token text is normalized before it is interned, like the keys of
+    ``token_position_independent_error``, so cased tokenizers count the same.
+    """
+
+    def __init__(self, tokenize_fn: Callable[[str], List[Span]]):
+        self.tokenize_fn = tokenize_fn
+
+    def __call__(self, text: str) -> TokenOffsets:
+        spans = self.tokenize_fn(text)
+        return (
+            array("q", (span.begin for span in spans)),
+            array("q", (span.end for span in spans)),
+            array("q", (VOCABULARY(normalize(span.covered_text)) for span in spans)),
+        )
+
+
+def offsets_tokenizer(
+    tokenize_fn: Callable[[str], List[Span]],
+) -> Callable[[str], TokenOffsets]:
+    if tokenize_fn is tokenize:
+        return tokenize_offsets
+    return SpanOffsetTokenizer(tokenize_fn)
+
+
+def _keep_token(token: str) -> bool:
+    # exclude numbers > 10, per mullenbach
+    return not token.isdigit() or int(token) <= 10
+
+
+# begin offsets, end offsets, token strings and keep flags of every token of a note
+NoteTokenization = Tuple[array, array, List[str], bytearray]
+
+
+class RegexTokenizer(object):
+    """Lowercase ``text`` and keep the matches of ``pattern`` accepted by ``keep_fn``
+
+    ``pattern`` must match maximal runs of a character class (like ``\\w+`` or
+    ``\\S+``): the matches in part of a text are then the text's matches clipped to
+    that part, which lets NoteTokenCache project annotations onto note tokens.
+    """
+
+    clip = True
+
+    def __init__(
+        self,
+        name: str,
+        pattern: re.Pattern,
+        keep_fn: Optional[Callable[[str], bool]] = None,
+    ):
+        self.name = name
+        self.pattern = pattern
+        self.keep_fn = keep_fn
+        self.fingerprint = f"{name}:{pattern.pattern}"
+
+    def normalize(self, text: str) -> str:
+        return text.lower()
+
+    def keep_token(self, token: str) -> bool:
+        return self.keep_fn is None or self.keep_fn(token)
+
+    def __call__(self, text: str) -> List[Span]:
+        return [
+            Span(*match.span(), covered_text=match.group())
+            for match in self.pattern.finditer(text.lower())
+            if self.keep_token(match.group())
+        ]
+
+    def note_tokens(self, text: str) -> NoteTokenization:
+        begins, ends, tokens, keep = array("q"), array("q"), list(), bytearray()
+        for match in self.pattern.finditer(text.lower()):
+            token = match.group()
+            begin, end = match.span()
+            begins.append(begin)
+            ends.append(end)
+            tokens.append(token)
+            keep.append(self.keep_token(token))
+        return begins, ends, tokens, keep
+
+    def __repr__(self) -> str:
+        return f"RegexTokenizer({self.name!r})"
+
+
+# note level equivalent of tokenize
+PAPER_TOKENIZER = RegexTokenizer("regex", TOKEN_PATTERN, _keep_token)
+
+
+class _NoteTokens(object):
+    """All tokens of a note, including the ones the tokenizer drops
+
+    Token ids are of the normalized token text, whatever the tokenizer produced.
+    Without a ``tokenization`` the note cannot be projected onto.
+    """
+
+    __slots__ = ("text", "begins", "ends", "token_ids", "keep")
+
+    def __init__(self, text: str, tokenization: Optional[NoteTokenization]):
+        self.text = text
+        if tokenization is None:
+            self.begins = self.ends = self.token_ids = self.keep = None
+            return
+        self.begins, self.ends, tokens, self.keep = tokenization
+        self.token_ids = array("q", (VOCABULARY(normalize(token)) for token in tokens))
+
+
+class NoteTokenCache(object):
+    """Tokenize each note once and project annotations onto its tokens
+
+    ``tokenizer`` provides ``note_tokens``, ``normalize``, ``keep_token`` and ``clip``
+    (see RegexTokenizer). For clipping tokenizers the tokens of an annotation's text
+    are the note's tokens clipped to the annotation, so tokens are found by binary
+    search over the note's token offsets. Boundary tokens are clipped and filtered
+    after projection; the others reuse the note's token ids and filter flags.
+    Projected tokens equal ``tokenize_offsets`` of the annotation text (shifted to
+    note offsets). Other (subword) tokenizers project to the note's tokens that
+    overlap the annotation, unclipped.
+
+    Entries are keyed by note_id, checked against the note text and limited to the
+    ``max_notes`` most recently used notes. With a ``store`` (see
+    ``mdace.tokenizers.TokenOffsetStore``) note tokenizations are also kept on disk.
+    Notes whose length the tokenizer's ``normalize`` changes (e.g. lowercasing "İ")
+    are not projected, since their token offsets would not be note offsets.
+    """
+
+    def __init__(self, tokenizer=PAPER_TOKENIZER, max_notes: int = 1024, store=None):
+        self.tokenizer = tokenizer
+        self.max_notes = max_notes
+        self.store = store
+        self._notes = OrderedDict()  # type: OrderedDict[int, _NoteTokens]
+
+    def __reduce__(self):
+        # token ids are only valid within a process; do not ship entries
+        return NoteTokenCache, (self.tokenizer, self.max_notes, self.store)
+
+    def _tokenize_note(self, note: Note) -> NoteTokenization:
+        if self.store is None:
+            return self.tokenizer.note_tokens(note.text)
+
+        fingerprint = self.tokenizer.fingerprint
+        tokenization = self.store.get(fingerprint, note.note_id, note.text)
+        if tokenization is None:
+            tokenization = self.tokenizer.note_tokens(note.text)
+            self.store.put(fingerprint, note.note_id, note.text, tokenization)
+        return tokenization
+
+    def _new_entry(self, note: Note) -> _NoteTokens:
+        text = note.text
+        if not text.isascii() and len(self.tokenizer.normalize(text)) != len(text):
+            _logger.info(
+                f"Normalizing note {note.note_id} changes its length, "
+                "tokenizing its annotations one by one"
+            )
+            return _NoteTokens(text, None)
+        return _NoteTokens(text, self._tokenize_note(note))
+
+    def _note_tokens(self, note: Note) -> Optional[_NoteTokens]:
+        text = note.text
+        if text is None:
+            return None
+
+        entry = self._notes.get(note.note_id)
+        if entry is not None and (entry.text is text or entry.text == text):
+            self._notes.move_to_end(note.note_id)
+        else:
+            entry = self._notes[note.note_id] = self._new_entry(note)
+            self._notes.move_to_end(note.note_id)
+            if len(self._notes) > self.max_notes:
+                self._notes.popitem(last=False)
+        return entry if entry.token_ids is not None else None
+
+    def project(self, note: Note, annotation: Annotation) -> Optional[TokenOffsets]:
+        """Tokens of ``annotation`` in note offsets; None when it cannot be projected"""
+        span = annotation.span
+        entry = self._note_tokens(note)
+        if entry is None or span.begin < 0 or span.end < 0:
+            # negative offsets slice from the end of the text
+            return None
+        if (
+            span.covered_text is not None
+            and span.covered_text != entry.text[span.begin : span.end]
+        ):
+            # predicted covered_text that differs from the note
+            return None
+
+        begins, ends, token_ids, keep = (
+            entry.begins,
+            entry.ends,
+            entry.token_ids,
+            entry.keep,
+        )
+        anno_begin, anno_end = span.begin, min(span.end, len(entry.text))
+        out_begins, out_ends, out_ids = array("q"), array("q"), array("q")
+        if anno_end <= anno_begin:
+            return out_begins, out_ends, out_ids
+
+        # tokens [first, last) overlap the annotation
+        first = bisect.bisect_right(ends, anno_begin)
+        last = bisect.bisect_left(begins, anno_end)
+        tokenizer = self.tokenizer
+
+        def add_clipped(idx: int):
+            begin, end = max(begins[idx], anno_begin), min(ends[idx], anno_end)
+            if not tokenizer.clip or (begin == begins[idx] and end == ends[idx]):
+                if keep[idx]:
+                    out_begins.append(begins[idx])
+                    out_ends.append(ends[idx])
+                    out_ids.append(token_ids[idx])
+                return
+            token = tokenizer.normalize(entry.text[begin:end])
+            if tokenizer.keep_token(token):
+                out_begins.append(begin)
+                out_ends.append(end)
+                out_ids.append(VOCABULARY(normalize(token)))
+
+        if first >= last:
+            return out_begins, out_ends, out_ids
+
+        add_clipped(first)
+        inner_first, inner_last = first + 1, last - 1
+        if inner_last > inner_first:
+            inner_keep = keep[inner_first:inner_last]
+            if 0 in inner_keep:
+                for column, out in (
+                    (begins, out_begins),
+                    (ends, out_ends),
+                    (token_ids, out_ids),
+                ):
+                    out.extend(compress(column[inner_first:inner_last], inner_keep))
+            else:
+                out_begins.extend(begins[inner_first:inner_last])
+                out_ends.extend(ends[inner_first:inner_last])
+                out_ids.extend(token_ids[inner_first:inner_last])
+        if last - 1 > first:
+            add_clipped(last - 1)
+        return out_begins, out_ends, out_ids
+
+
+def note_token_cache(
+    tokenize_fn: Callable[[str], List[Span]],
+) -> Optional[NoteTokenCache]:
+    """NoteTokenCache for tokenizers that support projection, otherwise None"""
+    if tokenize_fn is tokenize:
+        return NoteTokenCache()
+    if hasattr(tokenize_fn, "note_tokens"):
+        return NoteTokenCache(tokenize_fn, store=getattr(tokenize_fn, "store", None))
+    return None
+
+
 def tokenize_annotation(
-    annotation: Annotation, tokenize_fn: Callable[[str], List[Span]]
+    annotation: Annotation,
+    tokenize_fn: Callable[[str], List[Span]],
+    note_text: Optional[str] = None,
 ) -> List[Annotation]:
-    if annotation.span.covered_text is None:
+    covered_text = annotation.span.covered_text
+    if covered_text is None and note_text is not None:
+        covered_text = note_text[annotation.span.begin : annotation.span.end]
+
+    if covered_text is None:
         raise ValueError(
             "Cannot tokenize annotations without text -- run inject-note-text.py"
         )
@@ -42,19 +362,69 @@ def tokenize_annotation(
                 span, begin=token_offset + span.begin, end=token_offset + span.begin
             ),
         )
-        for span in tokenize_fn(annotation.span.covered_text)
+        for span in tokenize_fn(covered_text)
     ]
 
 
 def tokenize_annotations(
-    annotations: List[Annotation], tokenize_fn: Callable[[str], List[Span]]
+    annotations: List[Annotation],
+    tokenize_fn: Callable[[str], List[Span]],
+    note_text: Optional[str] = None,
 ) -> List[Annotation]:
     flat = list()
     for a in annotations:
-        flat.extend(tokenize_annotation(a, tokenize_fn))
+        flat.extend(tokenize_annotation(a, tokenize_fn, note_text))
     return flat
 
 
+# per note: the note and, per annotation, the annotation and its token offsets
+TokenizedAdmission = List[Tuple[Note, List[Tuple[Annotation, TokenOffsets]]]]
+
+
+def tokenize_admission_offsets(
+    admission: Admission,
+    tokenize_fn: Callable[[str], TokenOffsets],
+    note_tokens: Optional[NoteTokenCache] = None,
+) -> TokenizedAdmission:
+    """Offsets (in the note) of the tokens of every annotation
+
+    Same tokens as ``tokenize_admission`` with an offset tokenizer (see
+    ``offsets_tokenizer``). With ``note_tokens`` annotations are projected onto the
+    cached tokens of their note instead of being tokenized one by one.
+    """
+    tokenized = list()
+    for note in admission.notes:
+        annotations = list()
+        for annotation in note.annotations:
+            if note_tokens is not None:
+                projected = note_tokens.project(note, annotation)
+                if projected is not None:
+                    annotations.append((annotation, projected))
+                    continue
+
+            covered_text = annotation.span.covered_text
+            if covered_text is None and note.text is not None:
+                covered_text = note.text[annotation.span.begin : annotation.span.end]
+            if covered_text is None:
+                raise ValueError(
+                    "Cannot tokenize annotations without text -- run inject-note-text.py"
+                )
+            begins, ends, token_ids = tokenize_fn(covered_text)
+            offset = annotation.span.begin
+            annotations.append(
+                (
+                    annotation,
+                    (
+                        array("q", (offset + begin for begin in begins)),
+                        array("q", (offset + end for end in ends)),
+                        token_ids,
+                    ),
+                )
+            )
+        tokenized.append((note, annotations))
+    return tokenized
+
+
 def tokenize_admission(
     admission: Admission, tokenize_fn: Callable[[str], List[Span]]
 ) -> Admission:
@@ -62,8 +432,37 @@ def tokenize_admission(
         admission,
         notes=[
             dataclasses.replace(
-                note, annotations=tokenize_annotations(note.annotations, tokenize_fn)
+                note,
+                annotations=tokenize_annotations(
+                    note.annotations, tokenize_fn, note.text
+                ),
             )
             for note in admission.notes
         ],
     )
+
+
+class TokenizationCache(object):
+    """Memoize ``tokenize_admission_offsets`` by hadm_id
+
+    An entry is only reused for the very same Admission object, so one cache can be
+    shared between several scorers that evaluate different predictions against the
+    same (already loaded) gold admissions.
+    """
+
+    def __init__(self, tokenize_fn: Callable[[str], List[Span]]):
+        self.tokenize_fn = tokenize_fn
+        self.tokenize_offsets_fn = offsets_tokenizer(tokenize_fn)
+        self.note_tokens = note_token_cache(tokenize_fn)
+        self._cache = dict()  # type: Dict[int, Tuple[Admission, TokenizedAdmission]]
+
+    def __call__(self, admission: Admission) -> TokenizedAdmission:
+        cached = self._cache.get(admission.hadm_id)
+        if cached is not None and cached[0] is admission:
+            return cached[1]
+
+        tokenized = tokenize_admission_offsets(
+            admission, self.tokenize_offsets_fn, self.note_tokens
+        )
+        self._cache[admission.hadm_id] = (admission, tokenized)
+        return tokenized
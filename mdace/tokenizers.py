@@ -0,0 +1,341 @@
+"""
+Tokenizers for the token metrics, selected by a spec string (see ``get_tokenizer``):
+
+regex                   the tokenizer used in the paper (``mdace.text.tokenize``)
+whitespace              lowercased runs of non-white space
+wordpiece:<vocab.txt>   BERT-style (uncased) WordPiece with a local vocabulary file
+bpe:<merges.txt>        BPE with a local merges file ("left right" per line)
+
+Subword tokenizers split the whole note once, and an annotation is represented by the
+note's tokens that overlap it, as a model reading the note would see it. Their note
+tokenizations can be kept in a TokenOffsetStore, so they run once per corpus.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mdace.data import Span
+from mdace.text import NoteTokenization, RegexTokenizer, tokenize
+
+_logger = logging.getLogger(Path(__file__).name)
+
+# words are split into subwords; punctuation characters are words of their own
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]", flags=re.UNICODE)
+
+# words memoized per subword tokenizer
+_MAX_CACHED_WORDS = 100_000
+
+
+def _file_digest(path: Path) -> str:
+    with open(path, "rb") as ifp:
+        return hashlib.sha256(ifp.read()).hexdigest()[:16]
+
+
+class TokenOffsetStore(object):
+    """Note tokenizations in a SQLite database, keyed by tokenizer, note_id and text
+
+    Connections are opened lazily per process, so a store can be shared with worker
+    processes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        self._pid = None  # type: Optional[int]
+
+    def __reduce__(self):
+        return TokenOffsetStore, (self.path,)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.path), timeout=60)
+            self._pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS note_tokens ("
+                "tokenizer TEXT, note_id INTEGER, text_digest TEXT, "
+                "begins BLOB, ends BLOB, keep BLOB, tokens TEXT, "
+                "PRIMARY KEY (tokenizer, note_id, text_digest))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _text_digest(text: str) -> str:
+        return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+    def get(
+        self, tokenizer: str, note_id: int, text: str
+    ) -> Optional[NoteTokenization]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT begins, ends, keep, tokens FROM note_tokens "
+                "WHERE tokenizer = ? AND note_id = ? AND text_digest = ?",
+                (tokenizer, note_id, self._text_digest(text)),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        begins, ends = array("q"), array("q")
+        begins.frombytes(row[0])
+        ends.frombytes(row[1])
+        return begins, ends, json.loads(row[3]), bytearray(row[2])
+
+    def put(
+        self, tokenizer: str, note_id: int, text: str, tokenization: NoteTokenization
+    ):
+        begins, ends, tokens, keep = tokenization
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO note_tokens VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    tokenizer,
+                    note_id,
+                    self._text_digest(text),
+                    begins.tobytes(),
+                    ends.tobytes(),
+                    bytes(keep),
+                    json.dumps(tokens),
+                ),
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class SubwordTokenizer(object):
+    """Split text into words (``_WORD_PATTERN``) and words into subwords
+
+    Subclasses implement ``_word_pieces``. Token text is the subword as spelled in the
+    vocabulary (e.g. "##ing"), so position independent matches compare subwords. Like
+    all token text it is lowercased for its token id (``mdace.text.normalize``), also
+    when the model reads cased text.
+    """
+
+    # tokens of part of a text are not the text's tokens clipped to that part
+    clip = False
+
+    def __init__(self, lowercase: bool, store: Optional[TokenOffsetStore] = None):
+        self.lowercase = lowercase
+        self.store = store
+        self._words = dict()  # type: Dict[str, List[Tuple[int, int, str]]]
+
+    def _word_pieces(self, word: str) -> List[Tuple[int, int, str]]:
+        """(begin, end, subword) in ``word``"""
+        raise NotImplementedError
+
+    def normalize(self, text: str) -> str:
+        return text.lower() if self.lowercase else text
+
+    def keep_token(self, token: str) -> bool:
+        return True
+
+    def _pieces(self, word: str) -> List[Tuple[int, int, str]]:
+        pieces = self._words.get(word)
+        if pieces is None:
+            if len(self._words) >= _MAX_CACHED_WORDS:
+                self._words.clear()
+            pieces = self._words[word] = self._word_pieces(word)
+        return pieces
+
+    def note_tokens(self, text: str) -> NoteTokenization:
+        begins, ends, tokens = array("q"), array("q"), list()
+        for match in _WORD_PATTERN.finditer(self.normalize(text)):
+            offset = match.start()
+            for begin, end, piece in self._pieces(match.group()):
+                begins.append(offset + begin)
+                ends.append(offset + end)
+                tokens.append(piece)
+        return begins, ends, tokens, bytearray(b"\x01" * len(tokens))
+
+    def __call__(self, text: str) -> List[Span]:
+        begins, ends, tokens, _ = self.note_tokens(text)
+        return [
+            Span(begin, end, covered_text=token)
+            for begin, end, token in zip(begins, ends, tokens)
+        ]
+
+
+class WordPieceTokenizer(SubwordTokenizer):
+    """Greedy longest-match-first WordPiece, as in BERT
+
+    ``vocab_file`` has one subword per line; continuation subwords start with "##".
+    Words that cannot be split are a single ``unk_token``.
+    """
+
+    def __init__(
+        self,
+        vocab_file: Path,
+        lowercase: bool = True,
+        unk_token: str = "[UNK]",
+        max_chars: int = 100,
+        store: Optional[TokenOffsetStore] = None,
+    ):
+        super().__init__(lowercase, store)
+        self.vocab_file = Path(vocab_file)
+        self.unk_token = unk_token
+        self.max_chars = max_chars
+        with open(self.vocab_file, encoding="utf8") as ifp:
+            self.vocab = {line.strip() for line in ifp if line.strip()}
+        self.fingerprint = f"wordpiece:{_file_digest(self.vocab_file)}:{lowercase}:{unk_token}:{max_chars}"
+
+    def __reduce__(self):
+        return WordPieceTokenizer, (
+            self.vocab_file,
+            self.lowercase,
+            self.unk_token,
+            self.max_chars,
+            self.store,
+        )
+
+    def _word_pieces(self, word: str) -> List[Tuple[int, int, str]]:
+        if len(word) > self.max_chars:
+            return [(0, len(word), self.unk_token)]
+
+        pieces, begin = list(), 0
+        while begin < len(word):
+            end = len(word)
+            while end > begin:
+                piece = word[begin:end] if begin == 0 else "##" + word[begin:end]
+                if piece in self.vocab:
+                    break
+                end -= 1
+            else:
+                return [(0, len(word), self.unk_token)]
+            pieces.append((begin, end, piece))
+            begin = end
+        return pieces
+
+    def __repr__(self) -> str:
+        return f"WordPieceTokenizer({str(self.vocab_file)!r})"
+
+
+class BPETokenizer(SubwordTokenizer):
+    """Byte pair encoding with the merge rules in ``merges_file``
+
+    Merges are applied to the characters of each word in order of their rank (line in
+    the file). If the merges use a "</w>" end-of-word marker (as subword-nmt does), it
+    is appended to the last character of every word. Byte-level vocabularies (GPT-2
+    style "Ġ" markers) are not supported.
+    """
+
+    END_OF_WORD = "</w>"
+
+    def __init__(
+        self,
+        merges_file: Path,
+        lowercase: bool = False,
+        store: Optional[TokenOffsetStore] = None,
+    ):
+        super().__init__(lowercase, store)
+        self.merges_file = Path(merges_file)
+        self.ranks = dict()  # type: Dict[Tuple[str, str], int]
+        with open(self.merges_file, encoding="utf8") as ifp:
+            for line in ifp:
+                if line.startswith("#version") or not line.strip():
+                    continue
+                left, right = line.split()
+                self.ranks.setdefault((left, right), len(self.ranks))
+        self.end_of_word = any(
+            right.endswith(self.END_OF_WORD) for _, right in self.ranks
+        )
+        self.fingerprint = f"bpe:{_file_digest(self.merges_file)}:{lowercase}"
+
+    def __reduce__(self):
+        return BPETokenizer, (self.merges_file, self.lowercase, self.store)
+
+    def _word_pieces(self, word: str) -> List[Tuple[int, int, str]]:
+        symbols = list(word)
+        if self.end_of_word:
+            symbols[-1] += self.END_OF_WORD
+
+        while len(symbols) > 1:
+            rank, idx = min(
+                (self.ranks.get(pair, len(self.ranks)), idx)
+                for idx, pair in enumerate(zip(symbols, symbols[1:]))
+            )
+            if rank == len(self.ranks):
+                break
+            symbols[idx : idx + 2] = [symbols[idx] + symbols[idx + 1]]
+
+        pieces, begin = list(), 0
+        for symbol in symbols:
+            end = begin + len(symbol)
+            if symbol.endswith(self.END_OF_WORD) and self.end_of_word:
+                end -= len(self.END_OF_WORD)
+            pieces.append((begin, end, symbol))
+            begin = end
+        return pieces
+
+    def __repr__(self) -> str:
+        return f"BPETokenizer({str(self.merges_file)!r})"
+
+
+def _regex(arg: Optional[str], store: Optional[TokenOffsetStore]):
+    return tokenize
+
+
+def _whitespace(arg: Optional[str], store: Optional[TokenOffsetStore]):
+    return RegexTokenizer("whitespace", re.compile(r"\S+"))
+
+
+def _wordpiece(arg: Optional[str], store: Optional[TokenOffsetStore]):
+    if not arg:
+        raise ValueError("Usage: wordpiece:<vocab.txt>")
+    return WordPieceTokenizer(Path(arg), store=store)
+
+
+def _bpe(arg: Optional[str], store: Optional[TokenOffsetStore]):
+    if not arg:
+        raise ValueError("Usage: bpe:<merges.txt>")
+    return BPETokenizer(Path(arg), store=store)
+
+
+# name -> factory(argument after the colon, offset store)
+TOKENIZERS = dict(
+    regex=_regex,
+    whitespace=_whitespace,
+    wordpiece=_wordpiece,
+    bpe=_bpe,
+)  # type: Dict[str, Callable[[Optional[str], Optional[TokenOffsetStore]], Callable[[str], List[Span]]]]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(
+    spec: str, token_cache: Optional[Path] = None
+) -> Callable[[str], List[Span]]:
+    """Tokenizer for ``spec`` ("<name>" or "<name>:<argument>", see TOKENIZERS)
+
+    Tokenizers that tokenize whole notes keep them in a TokenOffsetStore at
+    ``token_cache``, if given.
+    """
+    name, _, arg = spec.partition(":")
+    if name not in TOKENIZERS:
+        raise ValueError(
+            f"Unknown tokenizer {name!r}, expected one of {', '.join(TOKENIZERS)}"
+        )
+    store = TokenOffsetStore(token_cache) if token_cache else None
+    return TOKENIZERS[name](arg or None, store)
+
+
+def tokenizer_id(tokenize_fn: Callable[[str], List[Span]]) -> str:
+    """Identifies the tokenizer and its vocabulary, e.g. for ``settings_digest``"""
+    fingerprint = getattr(tokenize_fn, "fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint
+    return f"{tokenize_fn.__module__}.{tokenize_fn.__qualname__}"
@@ -0,0 +1,303 @@
+"""
+Time loading, cleanup, tokenization and scoring on synthetic corpora (see
+``mdace/synthetic.py``) at multiples of the Inpatient ICD-9 size, and keep a history of
+the results to catch regressions.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from mdace.cleanup import clean_annotations
+from mdace.data import Admission, MDACEData
+from mdace.metrics import AllErrorRates
+from mdace.synthetic import SyntheticConfig, read_config, write_corpus
+from mdace.text import (
+    note_token_cache,
+    offsets_tokenizer,
+    tokenize,
+    tokenize_admission_offsets,
+)
+
+logger = logging.getLogger(Path(__file__).name)
+
+
+@dataclass()
+class Corpus:
+    """Gold and predicted trees as loaded (``raw_*``) and cleaned"""
+
+    scale: float
+    gold_dir: Path
+    predictions_dir: Path
+    raw_gold: MDACEData
+    raw_predictions: MDACEData
+    gold: MDACEData
+    predictions: MDACEData
+
+    @property
+    def n_admissions(self) -> int:
+        return len(self.gold.admissions)
+
+    @property
+    def n_annotations(self) -> int:
+        return sum(
+            len(note.annotations)
+            for adm in self.gold.admissions + self.predictions.admissions
+            for note in adm.notes
+        )
+
+
+def bench_load(corpus: Corpus):
+    MDACEData.from_dir(corpus.gold_dir)
+    MDACEData.from_dir(corpus.predictions_dir)
+
+
+def bench_iterate(corpus: Corpus):
+    # fills in covered_text from the note text, see Admission.__iter__
+    for adm in corpus.gold.admissions + corpus.predictions.admissions:
+        for _ in adm:
+            pass
+
+
+def bench_cleanup(corpus: Corpus):
+    clean_annotations(corpus.raw_gold)
+    clean_annotations(corpus.raw_predictions)
+
+
+def bench_tokenize(corpus: Corpus):
+    # as AllErrorRates does: each note is tokenized once, in the cache shared by the
+    # gold and predicted admission, and annotations are projected onto its tokens
+    tokenize_offsets_fn = offsets_tokenizer(tokenize)
+    note_tokens = note_token_cache(tokenize)
+    predictions = {adm.hadm_id: adm for adm in corpus.predictions.admissions}
+    for adm in corpus.gold.admissions:
+        tokenize_admission_offsets(adm, tokenize_offsets_fn, note_tokens)
+        predicted = predictions.get(adm.hadm_id)
+        if predicted is not None:
+            tokenize_admission_offsets(predicted, tokenize_offsets_fn, note_tokens)
+
+
+def bench_observe(corpus: Corpus):
+    predictions = {adm.hadm_id: adm for adm in corpus.predictions.admissions}
+    error_rates = AllErrorRates(tokenize)
+    for adm in corpus.gold.admissions:
+        predicted = predictions.get(adm.hadm_id)
+        if predicted is None:
+            predicted = Admission(adm.hadm_id, [])
+        error_rates.observe(adm, predicted)
+
+
+# name -> benchmark over the gold and predicted trees of a corpus
+BENCHMARKS = dict(
+    load=bench_load,
+    iterate=bench_iterate,
+    cleanup=bench_cleanup,
+    tokenize=bench_tokenize,
+    observe=bench_observe,
+)  # type: Dict[str, Callable[[Corpus], None]]
+
+
+def prepare_corpus(work_dir: Path, config: SyntheticConfig, scale: float) -> Corpus:
+    """Generate the corpus of ``scale`` unless ``work_dir`` has it already"""
+    config = config.scaled(scale)
+    corpus_dir = work_dir / f"scale-{scale:g}"
+    if (corpus_dir / "config.json").exists() and read_config(corpus_dir) == config:
+        logger.info(f"Reusing synthetic corpus in {corpus_dir}")
+        gold_dir, predictions_dir = corpus_dir / "gold", corpus_dir / "predictions"
+    else:
+        logger.info(f"Generating {config.n_admissions:,} admissions in {corpus_dir}")
+        gold_dir, predictions_dir, _ = write_corpus(corpus_dir, config)
+
+    # cleanup runs on the trees as loaded, the other benchmarks on the cleaned trees
+    # as in evaluate-predictions.py
+    raw_gold = MDACEData.from_dir(gold_dir)
+    raw_predictions = MDACEData.from_dir(predictions_dir)
+    return Corpus(
+        scale,
+        gold_dir,
+        predictions_dir,
+        raw_gold,
+        raw_predictions,
+        clean_annotations(raw_gold),
+        clean_annotations(raw_predictions),
+    )
+
+
+def time_benchmark(fn: Callable[[Corpus], None], corpus: Corpus, repeat: int) -> float:
+    """Best wall time of ``repeat`` runs"""
+    timings = list()
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(corpus)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(history_file: Path) -> List[Dict]:
+    if not history_file.exists():
+        return list()
+    with open(history_file) as ifp:
+        return [json.loads(line) for line in ifp if line.strip()]
+
+
+def _comparable(record: Dict, other: Dict) -> bool:
+    return all(
+        record.get(key) == other.get(key)
+        for key in ("benchmark", "n_admissions", "seed", "python", "machine")
+    )
+
+
+def baseline_seconds(record: Dict, history: List[Dict], window: int) -> Optional[float]:
+    """Median of the last ``window`` comparable results, if any"""
+    previous = [other["seconds"] for other in history if _comparable(record, other)]
+    if not previous:
+        return None
+    return statistics.median(previous[-window:])
+
+
+def main(args: argparse.Namespace):
+    config = SyntheticConfig(seed=args.seed)
+    history = load_history(args.history)
+    commit, timestamp = git_commit(), datetime.now(timezone.utc).isoformat()
+
+    lines = [
+        "| Benchmark | Scale | Admissions | Annotations | Seconds | Baseline | Change |",
+        "| ------ | ------ | ------ | ------ | ------ | ------ | ------ |",
+    ]
+    records, regressions = list(), list()
+    for scale in args.scales:
+        corpus = prepare_corpus(args.work_dir, config, scale)
+        for name in args.benchmarks:
+            seconds = time_benchmark(BENCHMARKS[name], corpus, args.repeat)
+            record = dict(
+                timestamp=timestamp,
+                commit=commit,
+                python=platform.python_version(),
+                machine=platform.machine(),
+                benchmark=name,
+                scale=scale,
+                seed=args.seed,
+                n_admissions=corpus.n_admissions,
+                n_annotations=corpus.n_annotations,
+                repeat=args.repeat,
+                seconds=seconds,
+            )
+            baseline = baseline_seconds(record, history, args.window)
+            change = "" if baseline is None else f"{seconds / baseline - 1:+.1%}"
+            if baseline is not None and seconds > baseline * (1 + args.tolerance):
+                regressions.append(record)
+                change += " (regression)"
+            logger.info(f"{name} at {scale:g}x: {seconds:.3f}s {change}")
+            lines.append(
+                f"| {name} | {scale:g}x | {corpus.n_admissions:,} | {corpus.n_annotations:,} "
+                f"| {seconds:.3f} | {'' if baseline is None else f'{baseline:.3f}'} | {change} |"
+            )
+            records.append(record)
+        del corpus
+
+    report = "\n".join(lines)
+    print(report)
+    if args.md_out:
+        args.md_out.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.md_out, "w") as ofp:
+            print(report, file=ofp)
+
+    if not args.no_record:
+        args.history.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.history, "a") as ofp:
+            for record in records:
+                print(json.dumps(record), file=ofp)
+
+    for record in regressions:
+        logger.warning(
+            f"{record['benchmark']} at {record['scale']:g}x is more than "
+            f"{args.tolerance:.0%} slower than its baseline"
+        )
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--work-dir",
+        help="Directory for the synthetic corpora (reused between runs)",
+        type=Path,
+        default="benchmarks",
+    )
+    parser.add_argument(
+        "--scales",
+        help="Corpus sizes as multiples of Inpatient ICD-9 (302 admissions)",
+        nargs="+",
+        type=float,
+        default=[1, 10, 100],
+    )
+    parser.add_argument(
+        "--benchmarks",
+        help="Benchmarks to run",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+    )
+    parser.add_argument(
+        "--repeat", help="Runs per benchmark (the best is kept)", type=int, default=3
+    )
+    parser.add_argument(
+        "--seed", help="Seed of the synthetic corpora", type=int, default=0
+    )
+    parser.add_argument(
+        "--history",
+        help="JSON lines file results are appended to and compared against",
+        type=Path,
+        default="benchmarks/history.jsonl",
+    )
+    parser.add_argument(
+        "--no-record",
+        help="Compare against the history without appending to it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--window",
+        help="Number of previous comparable results the baseline is the median of",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="Slowdown relative to the baseline reported as a regression",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        help="Exit with status 1 if any benchmark regressed, e.g. in CI",
+        action="store_true",
+    )
+    parser.add_argument("--md-out", help="Write the results table here", type=Path)
+
+    logging.basicConfig(level=logging.INFO)
+    main(parser.parse_args())
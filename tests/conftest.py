@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import pytest
+
+# the scripts and the mdace package live in the repository root
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from mdace.cleanup import clean_annotations
+from mdace.data import Admission, MDACEData
+from mdace.synthetic import SyntheticConfig, write_corpus
+
+# small, but with overlapping/adjacent annotations and non-ASCII text
+CONFIG = SyntheticConfig(n_admissions=30, note_chars=1500, non_ascii_rate=0.02)
+
+
+@pytest.fixture(scope="session")
+def corpus_dirs(tmp_path_factory) -> Tuple[Path, Path, Path]:
+    """(gold, predictions, split file) of a synthetic corpus"""
+    return write_corpus(tmp_path_factory.mktemp("corpus"), CONFIG)
+
+
+@pytest.fixture(scope="session")
+def corpus(corpus_dirs) -> Tuple[MDACEData, MDACEData]:
+    """Cleaned (merged and trimmed) gold and predictions"""
+    gold_dir, predictions_dir, _ = corpus_dirs
+    return (
+        clean_annotations(MDACEData.from_dir(gold_dir)),
+        clean_annotations(MDACEData.from_dir(predictions_dir)),
+    )
+
+
+def paired(corpus) -> Dict[int, Tuple[Admission, Admission]]:
+    """Gold and predicted admission by hadm_id"""
+    gold, predictions = corpus
+    predicted = {adm.hadm_id: adm for adm in predictions.admissions}
+    return {
+        adm.hadm_id: (adm, predicted.get(adm.hadm_id, Admission(adm.hadm_id, [])))
+        for adm in gold.admissions
+    }
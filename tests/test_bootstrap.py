@@ -0,0 +1,33 @@
+import pytest
+
+from conftest import paired
+from mdace.metrics import ALL_METRIC_TITLES, AllErrorRates
+from mdace.text import tokenize
+
+bootstrap = pytest.importorskip("mdace.bootstrap")
+
+
+def _observed(corpus, **kwargs) -> AllErrorRates:
+    error_rates = AllErrorRates(tokenize, keep_per_admission=True, **kwargs)
+    for gold, predicted in paired(corpus).values():
+        error_rates.observe(gold, predicted)
+    return error_rates
+
+
+def test_overlap_metrics_are_bootstrapped(corpus):
+    error_rates = _observed(corpus, overlap_metrics=True)
+    metrics = bootstrap.observed_metrics(error_rates.per_admission)
+    assert metrics == tuple(ALL_METRIC_TITLES)
+
+    report = bootstrap.bootstrap_report(error_rates, n_resamples=20)
+    for title in ALL_METRIC_TITLES.values():
+        assert f"| {title} |" in report
+
+
+def test_paired_report_compares_common_metrics(corpus):
+    baseline = _observed(corpus)
+    report = bootstrap.paired_report(
+        "baseline", baseline, dict(overlap=_observed(corpus, overlap_metrics=True)), 20
+    )
+    assert "Exact Span Match" in report
+    assert "Character Overlap" not in report
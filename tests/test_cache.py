@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mdace.data import MDACEData
+
+pytest.importorskip("pyarrow")
+cache = pytest.importorskip("mdace.cache")
+
+
+def _fields(dataset: MDACEData):
+    # also the fields that are not compared by __eq__
+    return [
+        (
+            adm.hadm_id,
+            adm.comment,
+            [
+                (
+                    note.note_id,
+                    note.category,
+                    note.description,
+                    note.text,
+                    [
+                        (
+                            anno.span,
+                            anno.span.covered_text,
+                            anno.billing_code,
+                            anno.billing_code.code_description,
+                            anno.type,
+                        )
+                        for anno in note.annotations
+                    ],
+                )
+                for note in adm.notes
+            ],
+        )
+        for adm in dataset.admissions
+    ]
+
+
+def test_cached_load_matches_from_dir(corpus_dirs, tmp_path):
+    gold_dir = corpus_dirs[0]
+    expected = MDACEData.from_dir(gold_dir)
+    for _ in range(2):
+        # built, then read from the cache
+        actual = cache.from_dir_cached(gold_dir, tmp_path)
+        assert _fields(actual) == _fields(expected)
+
+    hadm_ids = {adm.hadm_id for adm in expected.admissions[::3]}
+    filters = dict(
+        hadm_id_filter=hadm_ids.__contains__,
+        category_filter={"Physician", "Radiology"}.__contains__,
+    )
+    actual = cache.from_dir_cached(gold_dir, tmp_path, **filters)
+    assert _fields(actual) == _fields(MDACEData.from_dir(gold_dir, **filters))
+
+
+def test_cache_is_rebuilt_when_files_change(corpus_dirs, tmp_path):
+    dataset_dir = tmp_path / "gold"
+    shutil.copytree(corpus_dirs[0], dataset_dir)
+    cache_dir = tmp_path / "cache"
+    path = cache.cache_path(cache_dir, dataset_dir)
+    cache.from_dir_cached(dataset_dir, cache_dir)
+    built = cache.cached_fingerprint(path)
+
+    json_file = sorted(dataset_dir.glob("*.json"))[0]
+    stat = json_file.stat()
+    os.utime(json_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    cache.from_dir_cached(dataset_dir, cache_dir)
+    touched = cache.cached_fingerprint(path)
+    assert touched != built
+
+    with open(json_file, encoding="utf8") as ifp:
+        data = json.load(ifp)
+    data["comment"] = "changed"
+    with open(json_file, "w", encoding="utf8") as ofp:
+        json.dump(data, ofp)
+    dataset = cache.from_dir_cached(dataset_dir, cache_dir)
+    assert cache.cached_fingerprint(path) not in (built, touched)
+    assert _fields(dataset) == _fields(MDACEData.from_dir(dataset_dir))
+
+
+def test_concurrent_saves_leave_a_complete_cache(corpus_dirs, tmp_path):
+    dataset = MDACEData.from_dir(corpus_dirs[0])
+    path = tmp_path / "cache" / "gold"
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for future in [
+            pool.submit(cache.save, dataset, path, "fingerprint") for _ in range(8)
+        ]:
+            future.result()
+    assert cache.cached_fingerprint(path) == "fingerprint"
+    assert _fields(cache.load(path)) == _fields(dataset)
+    assert os.listdir(path.parent) == ["gold"]
@@ -0,0 +1,43 @@
+import pytest
+
+from mdace.chapters import code_chapter
+from mdace.data import BillingCode
+
+
+@pytest.mark.parametrize(
+    "code,code_system,expected",
+    [
+        # ICD-9-CM chapter boundaries, E and V codes
+        ("001.0", "ICD-9-CM", "ICD-9-CM 001-139"),
+        ("139.9", "ICD-9-CM", "ICD-9-CM 001-139"),
+        ("140", "ICD-9-CM", "ICD-9-CM 140-239"),
+        ("140.0", "ICD-9-CM", "ICD-9-CM 140-239"),
+        ("999.9", "ICD-9-CM", "ICD-9-CM 800-999"),
+        ("E880.9", "ICD-9-CM", "ICD-9-CM E000-E999"),
+        ("e849.7", "ICD-9-CM", "ICD-9-CM E000-E999"),
+        ("V45.81", "ICD-9-CM", "ICD-9-CM V01-V91"),
+        # ICD-9 procedures
+        ("00.66", "ICD-9-PCS", "ICD-9-PCS 00"),
+        ("36.15", "ICD-9-PCS", "ICD-9-PCS 35-39"),
+        ("99.04", "ICD-9-PCS", "ICD-9-PCS 87-99"),
+        # ICD-10-CM chapter boundaries
+        ("D49.9", "ICD-10-CM", "ICD-10-CM C00-D49"),
+        ("D49", "ICD-10-CM", "ICD-10-CM C00-D49"),
+        ("D50", "ICD-10-CM", "ICD-10-CM D50-D89"),
+        ("D50.9", "ICD-10-CM", "ICD-10-CM D50-D89"),
+        ("O9A.1", "ICD-10-CM", "ICD-10-CM O00-O9A"),
+        ("T88.7", "ICD-10-CM", "ICD-10-CM S00-T88"),
+        # CPT, including Category II and III codes
+        ("00100", "CPT", "CPT 00100-01999"),
+        ("99213", "CPT", "CPT 99202-99499"),
+        ("0001F", "CPT", "CPT category F"),
+        ("0042T", "CPT", "CPT category T"),
+        # ICD-10-PCS sections
+        ("02703ZZ", "ICD-10-PCS", "ICD-10-PCS section 0"),
+        ("B2111ZZ", "ICD-10-PCS", "ICD-10-PCS section B"),
+        # unknown code systems
+        ("123", "SNOMED-CT", "SNOMED-CT other"),
+    ],
+)
+def test_code_chapter(code, code_system, expected):
+    assert code_chapter(BillingCode(code, code_system)) == expected
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from mdace.cleanup import (
+    clean_annotations,
+    clean_note,
+    merge_adjacent_annotations,
+    merge_adjacent_in_note,
+    trim_annotations,
+    trim_annotations_in_note,
+)
+from mdace.data import Annotation, BillingCode, MDACEData, Note, Span
+
+ALPHABET = "ab .,-/()\n\t;x\xa0é"
+CODES = (BillingCode("401.9", "ICD-9-CM"), BillingCode("428.0", "ICD-9-CM"))
+
+
+def _fields(note: Note):
+    # covered_text and type are not compared by Annotation.__eq__
+    return [
+        (
+            anno.span.begin,
+            anno.span.end,
+            anno.span.covered_text,
+            anno.billing_code,
+            anno.type,
+        )
+        for anno in note.annotations
+    ]
+
+
+def _random_note(rng: random.Random) -> Note:
+    text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 30)))
+    annotations = list()
+    for _ in range(rng.randint(0, 6)):
+        begin = rng.randint(0, len(text))
+        end = rng.randint(begin, len(text))
+        covered_text = rng.choice((None, text[begin:end], ""))
+        annotations.append(
+            Annotation(
+                Span(begin, end, covered_text), rng.choice(CODES), rng.choice("ab")
+            )
+        )
+    return Note(1, "Physician", "Report", annotations, text)
+
+
+@pytest.mark.parametrize("merge_adjacent", (False, True))
+@pytest.mark.parametrize("trim", (False, True))
+def test_clean_note_matches_two_step_cleanup(merge_adjacent, trim):
+    rng = random.Random(0)
+    for _ in range(5000):
+        note = _random_note(rng)
+        expected = note
+        if merge_adjacent:
+            expected = merge_adjacent_in_note(expected)
+        if trim:
+            expected = trim_annotations_in_note(expected)
+        assert _fields(clean_note(note, merge_adjacent, trim)) == _fields(expected)
+
+
+def test_clean_annotations_matches_two_step_cleanup(corpus_dirs):
+    for data_dir in corpus_dirs[:2]:
+        data = MDACEData.from_dir(data_dir)
+        expected = trim_annotations(merge_adjacent_annotations(data))
+        actual = clean_annotations(data)
+        for expected_adm, adm in zip(expected.admissions, actual.admissions):
+            for expected_note, note in zip(expected_adm.notes, adm.notes):
+                assert _fields(note) == _fields(expected_note)
@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import paired
+from mdace.metrics import AllErrorRates
+from mdace.text import tokenize
+
+columnar = pytest.importorskip("mdace.columnar")
+
+
+def test_columnar_matches_object_scoring(corpus):
+    expected, actual = AllErrorRates(tokenize), columnar.ColumnarErrorRates(tokenize)
+    for gold, predicted in paired(corpus).values():
+        expected.observe(gold, predicted)
+        actual.observe(gold, predicted)
+    assert actual.error_rates == expected.error_rates
+    assert str(actual) == str(expected)
+
+
+def test_error_rates_are_computed_once_per_observe(corpus):
+    error_rates = columnar.ColumnarErrorRates(tokenize)
+    admissions = list(paired(corpus).values())
+    error_rates.observe(*admissions[0])
+    first = error_rates.error_rates
+    assert error_rates.error_rates is first
+
+    error_rates.observe(*admissions[1])
+    assert error_rates.error_rates is not first
@@ -0,0 +1,19 @@
+import pickle
+
+from mdace.data import BillingCode, MDACEData
+
+
+def test_unpickled_billing_codes_are_interned():
+    billing_code = BillingCode.intern("401.9", "ICD-9-CM", "Hypertension NOS")
+    assert pickle.loads(pickle.dumps(billing_code)) is billing_code
+
+
+def test_workers_match_single_process_with_interned_codes(corpus_dirs):
+    gold_dir = corpus_dirs[0]
+    expected = MDACEData.from_dir(gold_dir)
+    actual = MDACEData.from_dir(gold_dir, workers=2)
+    assert actual == expected
+    for adm, expected_adm in zip(actual.admissions, expected.admissions):
+        for note, expected_note in zip(adm.notes, expected_adm.notes):
+            for anno, expected_anno in zip(note.annotations, expected_note.annotations):
+                assert anno.billing_code is expected_anno.billing_code
@@ -0,0 +1,110 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from conftest import ROOT
+from mdace.notestore import NoteTextStore
+
+
+def _evaluate(
+    gold_dir: Path, predictions_dir: Path, split_file: Path, md_out: Path, *args
+):
+    subprocess.run(
+        [
+            sys.executable,
+            str(ROOT / "evaluate-predictions.py"),
+            "--gold-dir",
+            str(gold_dir),
+            "--predictions-dir",
+            str(predictions_dir),
+            "--split-file",
+            str(split_file),
+            "--merge-adjacent",
+            "--trim-annotations",
+            "--md-out",
+            str(md_out),
+            *args,
+        ],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+    )
+    return md_out.read_text(encoding="utf8")
+
+
+def _without_text(data_dir: Path, out_dir: Path, note_texts: dict) -> Path:
+    out_dir.mkdir()
+    for json_file in data_dir.glob("*.json"):
+        with open(json_file, encoding="utf8") as ifp:
+            data = json.load(ifp)
+        for note in data["notes"]:
+            note_texts[note["note_id"]] = note.pop("text")
+        with open(out_dir / json_file.name, "w", encoding="utf8") as ofp:
+            json.dump(data, ofp)
+    return out_dir
+
+
+def test_text_free_trees_with_note_store_match_with_text(corpus_dirs, tmp_path):
+    gold_dir, predictions_dir, split_file = corpus_dirs
+    expected = _evaluate(gold_dir, predictions_dir, split_file, tmp_path / "a.md")
+
+    note_texts = dict()
+    text_free = [
+        _without_text(data_dir, tmp_path / data_dir.name, note_texts)
+        for data_dir in (gold_dir, predictions_dir)
+    ]
+    note_store = tmp_path / "notes.bin"
+    NoteTextStore.build(note_store, sorted(note_texts.items())).close()
+    actual = _evaluate(
+        *text_free, split_file, tmp_path / "b.md", "--note-store", str(note_store)
+    )
+    assert actual == expected
+
+
+def test_result_cache_matches_fresh_run(corpus_dirs, tmp_path):
+    expected = _evaluate(*corpus_dirs, tmp_path / "fresh.md")
+    result_cache = str(tmp_path / "results.sqlite")
+    # the first run fills the cache, the second only reads it
+    for name in ("filled.md", "cached.md"):
+        actual = _evaluate(
+            *corpus_dirs, tmp_path / name, "--result-cache", result_cache
+        )
+        assert actual == expected
+
+
+def test_workers_match_single_process(corpus_dirs, tmp_path):
+    expected = _evaluate(*corpus_dirs, tmp_path / "one.md", "--workers", "1")
+    assert _evaluate(*corpus_dirs, tmp_path / "two.md", "--workers", "2") == expected
+
+
+def test_profile_report(corpus_dirs, tmp_path):
+    expected = _evaluate(*corpus_dirs, tmp_path / "plain.md")
+    profile_out = tmp_path / "profile.json"
+    actual = _evaluate(
+        *corpus_dirs, tmp_path / "profiled.md", "--profile", str(profile_out)
+    )
+    assert actual == expected
+
+    with open(profile_out, encoding="utf8") as ifp:
+        report = json.load(ifp)
+    assert set(report) == {
+        "seconds",
+        "peak_rss_mb",
+        "python",
+        "argv",
+        "cprofile_stage",
+        "stages",
+    }
+    stages = {profile["name"]: profile for profile in report["stages"]}
+    assert {"load", "observe", "observe/tokenize"} <= set(stages)
+    for profile in stages.values():
+        assert profile["calls"] > 0
+        assert set(profile) == {
+            "name",
+            "calls",
+            "seconds",
+            "peak_rss_mb",
+            "peak_rss_growth_mb",
+            "allocated_blocks",
+        }
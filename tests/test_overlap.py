@@ -0,0 +1,92 @@
+import random
+from typing import List
+
+from conftest import paired
+from mdace.metrics import AllErrorRates
+from mdace.overlap import Interval, char_overlap, iou, match_spans, overlapping_pairs
+from mdace.text import tokenize
+
+
+def _random_spans(
+    rng: random.Random, n: int, lengths=(0, 1, 2, 5, 20, 80)
+) -> List[Interval]:
+    spans = list()
+    for _ in range(n):
+        begin = rng.randrange(100)
+        spans.append((begin, begin + rng.choice(lengths)))
+    return spans
+
+
+def _overlaps(a: Interval, b: Interval) -> bool:
+    return max(a[0], b[0]) < min(a[1], b[1])
+
+
+def test_overlapping_pairs_match_brute_force():
+    rng = random.Random(0)
+    for _ in range(200):
+        actual, predicted = _random_spans(rng, 15), _random_spans(rng, 15)
+        expected = {
+            (a_idx, p_idx)
+            for a_idx, a_span in enumerate(actual)
+            for p_idx, p_span in enumerate(predicted)
+            if _overlaps(a_span, p_span)
+        }
+        pairs = list(overlapping_pairs(actual, predicted))
+        assert len(pairs) == len(expected)
+        assert set(pairs) == expected
+
+
+def test_match_spans_matches_brute_force():
+    rng = random.Random(1)
+    for threshold in (0.0, 0.5):
+        for _ in range(100):
+            # without empty spans, which only match identical ones
+            actual = _random_spans(rng, 10, lengths=(1, 2, 5, 20, 80))
+            predicted = _random_spans(rng, 10, lengths=(1, 2, 5, 20, 80))
+            candidates = sorted(
+                (-iou(a_span, p_span), a_idx, p_idx)
+                for a_idx, a_span in enumerate(actual)
+                for p_idx, p_span in enumerate(predicted)
+                if _overlaps(a_span, p_span) and iou(a_span, p_span) >= threshold
+            )
+            expected, matched_actual, matched_predicted = list(), set(), set()
+            for _, a_idx, p_idx in candidates:
+                if a_idx not in matched_actual and p_idx not in matched_predicted:
+                    matched_actual.add(a_idx)
+                    matched_predicted.add(p_idx)
+                    expected.append((a_idx, p_idx))
+            assert match_spans(actual, predicted, threshold) == expected
+
+
+def test_char_overlap_matches_character_sets():
+    rng = random.Random(2)
+    for _ in range(200):
+        actual, predicted = _random_spans(rng, 8), _random_spans(rng, 8)
+        a_chars = {offset for begin, end in actual for offset in range(begin, end)}
+        p_chars = {offset for begin, end in predicted for offset in range(begin, end)}
+        for intervals, expected in zip(
+            char_overlap(actual, predicted),
+            (a_chars & p_chars, p_chars - a_chars, a_chars - p_chars),
+        ):
+            chars = [offset for begin, end in intervals for offset in range(begin, end)]
+            assert len(chars) == len(expected)
+            assert set(chars) == expected
+
+
+def test_char_overlap_counts_match_keys(corpus):
+    error_rates = AllErrorRates(tokenize, overlap_metrics=True)
+    for gold, predicted in paired(corpus).values():
+        scores = error_rates.score(gold, predicted)
+        rows = error_rates.observe_breakdown(gold, predicted)
+        counts = [0, 0, 0]
+        for row in rows:
+            if row["metric"] == "char_overlap":
+                counts[0] += row["true_positives"]
+                counts[1] += row["false_positives"]
+                counts[2] += row["false_negatives"]
+        char_overlap_rate = scores["char_overlap"]
+        assert counts == [
+            char_overlap_rate.true_positives,
+            char_overlap_rate.false_positives,
+            char_overlap_rate.false_negatives,
+        ]
@@ -0,0 +1,83 @@
+import pstats
+
+from mdace.profiling import Profiler, profiling, stage
+
+REPORT_KEYS = {"seconds", "peak_rss_mb", "python", "argv", "cprofile_stage", "stages"}
+STAGE_KEYS = {
+    "name",
+    "calls",
+    "seconds",
+    "peak_rss_mb",
+    "peak_rss_growth_mb",
+    "allocated_blocks",
+}
+
+
+def _work():
+    return sum(range(1000))
+
+
+def test_stage_is_a_no_op_without_profiler():
+    with stage("load"):
+        with profiling() as profiler:
+            pass
+    with stage("load"):
+        _work()
+    assert profiler.stages == dict()
+
+
+def test_nested_stages_are_named_by_path():
+    with profiling() as profiler:
+        for _ in range(3):
+            with stage("observe"):
+                with stage("tokenize"):
+                    _work()
+                with stage("tokenize"):
+                    _work()
+        with stage("tokenize"):
+            _work()
+
+    # in the order stages are entered, parents before their children
+    assert list(profiler.stages) == ["observe", "observe/tokenize", "tokenize"]
+    calls = {path: profile.calls for path, profile in profiler.stages.items()}
+    assert calls == {"observe": 3, "observe/tokenize": 6, "tokenize": 1}
+    observe = profiler.stages["observe"]
+    assert observe.seconds >= profiler.stages["observe/tokenize"].seconds
+    assert profiler.seconds >= observe.seconds
+
+
+def test_report_keys(tmp_path):
+    report_out = tmp_path / "profile.json"
+    with profiling(report_out) as profiler:
+        with stage("load"):
+            _work()
+
+    report = profiler.report()
+    assert set(report) == REPORT_KEYS
+    assert report["cprofile_stage"] is None
+    assert [set(profile) for profile in report["stages"]] == [STAGE_KEYS]
+    assert report_out.exists()
+
+
+def test_cprofile_stage_at_any_depth(tmp_path):
+    pstats_out = tmp_path / "profile.pstats"
+    with profiling(cprofile_stage="tokenize", pstats_out=pstats_out) as profiler:
+        with stage("observe"):
+            with stage("tokenize"):
+                _work()
+        with stage("load"):
+            sorted(range(10))
+
+    functions = {name for _, _, name in pstats.Stats(str(pstats_out)).stats}
+    assert "_work" in functions
+    assert "<built-in method builtins.sorted>" not in functions
+    assert profiler.report()["cprofile_stage"] == "tokenize"
+
+
+def test_cprofile_stage_by_path():
+    profiler = Profiler("observe/tokenize")
+    assert profiler._cprofiled("observe/tokenize")
+    assert not profiler._cprofiled("tokenize")
+    assert not profiler._cprofiled("observe")
+    assert Profiler("tokenize")._cprofiled("observe/tokenize")
+    assert not Profiler()._cprofiled("tokenize")
@@ -0,0 +1,82 @@
+import re
+from typing import List
+
+from conftest import paired
+from mdace.data import Annotation, BillingCode, Note, Span
+from mdace.metrics import (
+    AllErrorRates,
+    ErrorRate,
+    exact_match_error,
+    position_independent_error,
+    token_exact_match_error,
+    token_position_independent_error,
+)
+from mdace.text import NoteTokenCache, tokenize, tokenize_offsets
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def cased_tokenize(text: str) -> List[Span]:
+    return [
+        Span(*match.span(), covered_text=match.group())
+        for match in WORD_PATTERN.finditer(text)
+    ]
+
+
+def test_all_error_rates_match_object_metrics(corpus):
+    error_rates = AllErrorRates(tokenize)
+    expected = dict(
+        span_exact_match=ErrorRate(),
+        span_position_independent=ErrorRate(),
+        token_exact_match=ErrorRate(),
+        token_position_independent=ErrorRate(),
+    )
+    for gold, predicted in paired(corpus).values():
+        error_rates.observe(gold, predicted)
+        expected["span_exact_match"] += exact_match_error(gold, predicted)
+        expected["span_position_independent"] += position_independent_error(
+            gold, predicted
+        )
+        expected["token_exact_match"] += token_exact_match_error(
+            gold, predicted, tokenize
+        )
+        expected["token_position_independent"] += token_position_independent_error(
+            gold, predicted, tokenize
+        )
+    assert error_rates.error_rates == expected
+
+
+def test_offset_tokens_of_cased_tokenizer_match_object_path(corpus):
+    error_rates = AllErrorRates(cased_tokenize)
+    exact_match, position_independent = ErrorRate(), ErrorRate()
+    for gold, predicted in paired(corpus).values():
+        error_rates.observe(gold, predicted)
+        exact_match += token_exact_match_error(gold, predicted, cased_tokenize)
+        position_independent += token_position_independent_error(
+            gold, predicted, cased_tokenize
+        )
+    assert error_rates.error_rates["token_exact_match"] == exact_match
+    assert error_rates.error_rates["token_position_independent"] == position_independent
+
+
+def test_projected_tokens_match_annotation_tokens(corpus):
+    note_tokens, n_non_ascii = NoteTokenCache(), 0
+    for adm in corpus[0].admissions + corpus[1].admissions:
+        for note in adm.notes:
+            n_non_ascii += not note.text.isascii()
+            for annotation in note.annotations:
+                begin, end = annotation.span.begin, annotation.span.end
+                begins, ends, token_ids = tokenize_offsets(note.text[begin:end])
+                projected = note_tokens.project(note, annotation)
+                assert projected is not None
+                assert list(projected[0]) == [begin + offset for offset in begins]
+                assert list(projected[1]) == [begin + offset for offset in ends]
+                assert projected[2] == token_ids
+    assert n_non_ascii > 0
+
+
+def test_notes_that_change_length_are_not_projected():
+    text = "Dr. İpek saw the patient"
+    note = Note(1, "Physician", "Report", [], text)
+    annotation = Annotation(Span(4, 8, text[4:8]), BillingCode("401.9", "ICD-9-CM"))
+    assert NoteTokenCache().project(note, annotation) is None
@@ -0,0 +1,39 @@
+from mdace.data import Admission, Annotation, BillingCode, Note, Span
+from mdace.metrics import AllErrorRates, ErrorRate, token_position_independent_error
+from mdace.text import NoteTokenCache
+from mdace.tokenizers import BPETokenizer
+
+CODE = BillingCode("401.9", "ICD-9-CM")
+
+
+def _admission(text: str, *spans) -> Admission:
+    annotations = [
+        Annotation(Span(begin, end, text[begin:end]), CODE) for begin, end in spans
+    ]
+    return Admission(1, [Note(1, "Physician", "Report", annotations, text)])
+
+
+def _bpe(tmp_path) -> BPETokenizer:
+    merges_file = tmp_path / "merges.txt"
+    merges_file.write_text("#version: 0.2\nP a\np a\n", encoding="utf8")
+    return BPETokenizer(merges_file)
+
+
+def test_cased_subwords_share_token_ids(tmp_path):
+    bpe = _bpe(tmp_path)
+    text = "Pain is pain"
+    gold, predicted = _admission(text, (0, 4)), _admission(text, (8, 12))
+
+    error_rates = AllErrorRates(bpe)
+    error_rates.observe(gold, predicted)
+    expected = token_position_independent_error(gold, predicted, bpe)
+    assert error_rates.error_rates["token_position_independent"] == expected
+    assert expected == ErrorRate(true_positives=3)
+
+
+def test_non_ascii_notes_are_projected(tmp_path):
+    text = "Pain pé"
+    note = _admission(text, (5, 7)).notes[0]
+    projected = NoteTokenCache(_bpe(tmp_path)).project(note, note.annotations[0])
+    assert projected is not None
+    assert (list(projected[0]), list(projected[1])) == ([5, 6], [6, 7])